@@ -2,21 +2,58 @@
 Admin management blueprint
 Provides secure access to status pages and statistics
 """
-from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, session, jsonify
 from datetime import datetime, timedelta
+import os
+import threading
 import time
 from admin_auth import check_admin_credentials, require_admin_auth, is_admin_authenticated
 from db import get_db
+import realtime
+import ws_gateway
+from hyptrb_cache import cache as hyptrb_cache
+from hyptrb_client import client as hyptrb_client
+from token_cache import token_cache
+from presence import presence
+from blob_store import blob_store
+from media_pipeline import media_pipeline
+from thumbnails import variant_cache
+from upload_sessions import upload_sessions
+from thread_sync import thread_sync_scheduler
 
 # Track start time for uptime
 START_TIME = time.time()
 
+# How long /admin/api/stats serves the same stats snapshot (seconds); every open
+# dashboard tab polls it every 3 seconds
+ADMIN_STATS_CACHE_TTL = float(os.getenv('ADMIN_STATS_CACHE_TTL', 2))
+
 # Create blueprint
 admin_blueprint = Blueprint('admin_blueprint', __name__, url_prefix='/admin')
 
 # Get database instance
 db = get_db()
 
+_stats_snapshot = {'stats': None, 'taken_at': 0.0}
+_stats_lock = threading.Lock()
+
+
+def get_stats_snapshot() -> dict:
+    """
+    db.get_stats(), shared by all requests for ADMIN_STATS_CACHE_TTL seconds
+
+    Returns:
+        Dict of stats plus snapshot_age_seconds
+    """
+    with _stats_lock:
+        now = time.monotonic()
+        if _stats_snapshot['stats'] is None or now - _stats_snapshot['taken_at'] >= ADMIN_STATS_CACHE_TTL:
+            _stats_snapshot['stats'] = db.get_stats()
+            _stats_snapshot['taken_at'] = now
+        stats = dict(_stats_snapshot['stats'])
+        stats['snapshot_age_seconds'] = round(now - _stats_snapshot['taken_at'], 3)
+        return stats
+
 
 @admin_blueprint.route('/login', methods=['GET', 'POST'])
 def login():
@@ -84,9 +121,8 @@ def dashboard():
     except:
         database_status = {"text": "Error", "icon": "fa-times-circle", "color": "#f85149"}
     
-    # Check Firebase status (import here to avoid circular dependency)
-    from app import FIREBASE_INITIALIZED
-    if FIREBASE_INITIALIZED:
+    # Check Firebase status
+    if current_app.config.get('FIREBASE_INITIALIZED'):
         firebase_status = {"text": "Active", "icon": "fa-check-circle", "color": "#3fb950"}
     else:
         firebase_status = {"text": "Not Configured", "icon": "fa-exclamation-triangle", "color": "#d29922"}
@@ -116,7 +152,7 @@ def docs():
 @require_admin_auth
 def api_stats():
     """API endpoint for stats (JSON)"""
-    stats = db.get_stats()
+    stats = get_stats_snapshot()
     
     # Calculate uptime
     uptime_seconds = int(time.time() - START_TIME)
@@ -142,6 +178,29 @@ def api_stats():
     })
 
 
+@admin_blueprint.route('/api/metrics')
+@require_admin_auth
+def api_metrics():
+    """API endpoint for internal performance metrics (JSON)"""
+    return jsonify({
+        'status': 'ok',
+        'timestamp': datetime.now().isoformat(),
+        'database_pool': db.get_pool_stats(),
+        'database_storage': db.get_storage_stats(),
+        'firebase_token_cache': token_cache.stats(),
+        'presence': presence.stats(),
+        'blob_store': blob_store.stats(),
+        'media_pipeline': media_pipeline.stats(),
+        'thumbnails': variant_cache.stats(),
+        'upload_sessions': upload_sessions.stats(),
+        'realtime': realtime.hub.stats(),
+        'websocket': ws_gateway.get_gateway_stats(),
+        'thread_sync': thread_sync_scheduler.stats(),
+        'hyptrb_cache': hyptrb_cache.stats(),
+        'hyptrb_http': hyptrb_client.stats()
+    })
+
+
 # ============================================================================
 # HTMX Content Endpoints (for SPA navigation)
 # ============================================================================
@@ -174,8 +233,7 @@ def dashboard_content():
         database_status = {"text": "Error", "icon": "fa-times-circle", "color": "#f85149"}
     
     # Check Firebase status
-    from app import FIREBASE_INITIALIZED
-    if FIREBASE_INITIALIZED:
+    if current_app.config.get('FIREBASE_INITIALIZED'):
         firebase_status = {"text": "Active", "icon": "fa-check-circle", "color": "#3fb950"}
     else:
         firebase_status = {"text": "Not Configured", "icon": "fa-exclamation-triangle", "color": "#d29922"}
@@ -1,40 +1,42 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template, redirect, url_for
+from flask import Flask, request, jsonify, send_file, render_template, redirect, url_for, Response, stream_with_context
 from flask_cors import CORS
 from flask_wtf.csrf import CSRFProtect
 from datetime import datetime, timedelta
 import os
 import time
+import mimetypes
 import logging
 from logging.handlers import RotatingFileHandler
 from werkzeug.utils import secure_filename
-from db import get_db
+from werkzeug.security import safe_join
+from urllib.parse import quote
+from db import get_db, encode_message_cursor, decode_message_cursor, encode_search_cursor, decode_search_cursor
+from request_context import identity_map
+from presence import presence
+from blob_store import blob_store, is_sha256
+from media_pipeline import media_pipeline, needs_processing
+from thumbnails import variant_cache, FORMATS
+from upload_sessions import upload_sessions, UploadSessionError
+from upload_ingest import ingest_request_class, IngestStream
 import json
-from firebase_auth import initialize_firebase, require_auth, optional_auth, get_current_user, is_admin_role
+from firebase_auth import initialize_firebase, require_auth, require_stream_auth, optional_auth, get_current_user, is_admin_role
 from hyptrb_api import (
     fetch_influencer_jobs,
+    fetch_all_influencer_jobs,
     fetch_user_role, 
     fetch_user_profile_by_role, 
     extract_display_name,
     fetch_client_campaigns,
     fetch_influencer_collaborations,
-    HyptrbAPIError
+    HyptrbAPIError,
+    HyptrbPartialResult
 )
 from admin_blueprint import admin_blueprint
+import realtime
+import ws_gateway
+from thread_sync import thread_sync_scheduler
 from logger_config import logger
 
-# Try to import PIL and OpenCV for dimension extraction
-try:
-    from PIL import Image
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
-
-try:
-    import cv2
-    CV2_AVAILABLE = True
-except ImportError:
-    CV2_AVAILABLE = False
-
 # Configure logging
 LOG_DIR = os.getenv('LOG_DIR', 'logs')
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -80,8 +82,9 @@ CORS(app, resources={
     },
     r"/uploads/*": {
         "origins": "*",
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
+        "methods": ["GET", "POST", "PATCH", "DELETE", "OPTIONS"],
+        "allow_headers": ["Content-Type", "Authorization", "Upload-Offset", "Upload-Checksum"],
+        "expose_headers": ["Upload-Offset"]
     }
 })
 
@@ -114,8 +117,31 @@ ALLOWED_EXTENSIONS = {
 }
 MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', 104857600))  # Default: 100MB
 
+# How stored files are sent: '' (streamed by Flask), 'x-accel' (nginx X-Accel-Redirect,
+# see nginx.conf.example) or 'x-sendfile' (Apache mod_xsendfile / lighttpd)
+FILE_SENDFILE_MODE = os.getenv('FILE_SENDFILE_MODE', '').lower()
+# Internal nginx location prefix mapped to the storage roots in x-accel mode
+ACCEL_REDIRECT_PREFIX = os.getenv('ACCEL_REDIRECT_PREFIX', '/_protected').rstrip('/')
+# Browser/CDN cache lifetime of stored files, which never change once written (seconds)
+FILE_CACHE_MAX_AGE = int(os.getenv('FILE_CACHE_MAX_AGE', 31536000))
+
+# Message history pagination
+MESSAGES_PAGE_SIZE = int(os.getenv('MESSAGES_PAGE_SIZE', 50))
+MESSAGES_MAX_PAGE_SIZE = int(os.getenv('MESSAGES_MAX_PAGE_SIZE', 200))
+
+# Message search page size
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 20))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv('SEARCH_MAX_PAGE_SIZE', 100))
+
+# Delta sync page size (rows per change type)
+SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', 200))
+SYNC_MAX_PAGE_SIZE = int(os.getenv('SYNC_MAX_PAGE_SIZE', 1000))
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
+app.config['USE_X_SENDFILE'] = FILE_SENDFILE_MODE == 'x-sendfile'
+# Read by blueprints through current_app (importing app from them loads it twice)
+app.config['FIREBASE_INITIALIZED'] = FIREBASE_INITIALIZED
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -178,10 +204,78 @@ def get_campaign_owner_uid(campaign_id: str, client_email: str = None, default_u
         
     return default_uid
 
-def sync_user_campaign_threads(firebase_uid: str, email: str, role: str) -> int:
+def fetch_user_campaigns(firebase_uid: str, email: str, role: str) -> dict:
+    """
+    Fetch the campaigns a user should have threads for from the Hyptrb API.
+    Makes HTTP calls only; see apply_user_campaigns for the database side.
+    
+    Args:
+        firebase_uid: User's Firebase UID
+        email: User's email
+        role: User's role (client or influencer)
+    
+    Returns:
+        Dict of campaign_id -> {'name': ..., 'client_email': ...}
+    
+    Raises:
+        HyptrbAPIError: If the campaigns (or the first page of jobs) cannot be fetched
+        HyptrbPartialResult: If some job pages are missing; `result` has the campaigns found
+    """
+    campaigns_dict = {}
+    
+    if role == 'client':
+        # Fetch client campaigns
+        campaigns = fetch_client_campaigns(email)
+        logger.debug(f"Fetched {len(campaigns)} campaigns for client {email}")
+        
+        for campaign in campaigns:
+            campaign_id = campaign.get('_id')
+            if campaign_id:
+                campaigns_dict[campaign_id] = {
+                    'name': campaign.get('campaignName', 'Unnamed Campaign'),
+                    # The client always owns their own campaigns
+                    'client_email': email
+                }
+    
+    elif role == 'influencer':
+        # Fetch influencer jobs/campaigns (all pages, fetched concurrently)
+        partial = None
+        try:
+            all_jobs = fetch_all_influencer_jobs(firebase_uid)
+        except HyptrbPartialResult as e:
+            logger.warning(f"Incomplete job list for influencer {firebase_uid}: {e}")
+            all_jobs, partial = e.result, e
+        
+        # Group jobs by campaign to avoid duplicate threads
+        for job in all_jobs:
+            # Extract campaign details from the job
+            campaign_details_list = job.get('campaignDetails', [])
+            if campaign_details_list and len(campaign_details_list) > 0:
+                campaign_detail = campaign_details_list[0]
+                campaign_id = campaign_detail.get('campaignId')
+                campaign_name = campaign_detail.get('campaignName', 'Unnamed Campaign')
+                
+                # Extract client email if available
+                client_email = campaign_detail.get('clientEmail') or job.get('clientEmail')
+                
+                if campaign_id and campaign_id not in campaigns_dict:
+                    campaigns_dict[campaign_id] = {
+                        'name': campaign_name,
+                        'client_email': client_email
+                    }
+        
+        logger.debug(f"Found {len(campaigns_dict)} unique campaigns from {len(all_jobs)} jobs")
+        
+        if partial:
+            raise HyptrbPartialResult(str(partial), campaigns_dict)
+    
+    return campaigns_dict
+
+def apply_user_campaigns(firebase_uid: str, email: str, role: str, campaigns: dict) -> int:
     """
-    Sync user's threads with their Hyptrb campaigns.
-    Creates missing threads for any campaigns not yet tracked.
+    Create missing threads (and, for influencers, the conversation with the
+    campaign owner) for campaigns returned by fetch_user_campaigns.
+    All threads and conversations are written in one transaction.
     
     For redundancy, thread IDs are set to the campaign_id, making them
     predictable and directly tied to campaigns.
@@ -189,146 +283,66 @@ def sync_user_campaign_threads(firebase_uid: str, email: str, role: str) -> int:
     Args:
         firebase_uid: User's Firebase UID
         email: User's email
-        role: User's role (client, influencer, admin)
+        role: User's role (client or influencer)
+        campaigns: Dict of campaign_id -> {'name': ..., 'client_email': ...}
     
     Returns:
         Number of threads created/synced
     """
-    if role not in ['client', 'influencer']:
-        return 0
+    threads = []
+    conversations = []
+    user_cache = {}
     
-    threads_created = 0
+    def get_profile(uid):
+        if uid not in user_cache:
+            user_cache[uid] = db.get_user_by_firebase_uid(uid)
+        return user_cache[uid]
     
-    try:
-        if role == 'client':
-            # Fetch client campaigns
-            campaigns = fetch_client_campaigns(email)
-            logger.debug(f"Syncing {len(campaigns)} campaigns for client {email}")
-            
-            # Create thread for each campaign
-            for campaign in campaigns:
-                campaign_id = campaign.get('_id')
-                campaign_name = campaign.get('campaignName', 'Unnamed Campaign')
-                
-                if campaign_id:
-                    # Determine thread owner (always the client)
-                    thread_owner_uid = get_campaign_owner_uid(campaign_id, email, firebase_uid)
-                    
-                    thread_data = {
-                        'title': campaign_name,
-                        'description': f"Messages for campaign {campaign_name}",
-                        'campaign_id': campaign_id,
-                        'created_by': thread_owner_uid,
-                        'status': 'active'
-                    }
-                    try:
-                        thread_id = db.create_thread(thread_data)
-                        threads_created += 1
-                        logger.debug(f"Thread synced: {thread_id} for campaign {campaign_name} (Owner: {thread_owner_uid})")
-                    except Exception as e:
-                        logger.warning(f"Failed to create thread for campaign {campaign_name}: {e}")
-        
-        elif role == 'influencer':
-            # Fetch influencer jobs/campaigns (fetch all pages)
-            all_jobs = []
-            page = 1
-            
-            # Fetch first page to get total info
-            jobs_data = fetch_influencer_jobs(firebase_uid, page=1)
-            total_jobs = jobs_data.get('totalJobs', 0)
-            total_pages = jobs_data.get('totalPages', 1)
-            all_jobs.extend(jobs_data.get('jobs', []))
-            
-            logger.debug(f"Syncing {total_jobs} jobs across {total_pages} pages for influencer {firebase_uid}")
-            
-            # Fetch remaining pages if any
-            for page in range(2, total_pages + 1):
-                try:
-                    jobs_data = fetch_influencer_jobs(firebase_uid, page=page)
-                    all_jobs.extend(jobs_data.get('jobs', []))
-                except Exception as e:
-                    logger.warning(f"Failed to fetch page {page}: {e}")
-            
-            # Group jobs by campaign to avoid duplicate threads
-            campaigns_dict = {}
-            for job in all_jobs:
-                # Extract campaign details from the job
-                campaign_details_list = job.get('campaignDetails', [])
-                if campaign_details_list and len(campaign_details_list) > 0:
-                    campaign_detail = campaign_details_list[0]
-                    campaign_id = campaign_detail.get('campaignId')
-                    campaign_name = campaign_detail.get('campaignName', 'Unnamed Campaign')
-                    
-                    # Extract client email if available
-                    client_email = campaign_detail.get('clientEmail') or job.get('clientEmail')
-                    
-                    if campaign_id and campaign_id not in campaigns_dict:
-                        campaigns_dict[campaign_id] = {
-                            'name': campaign_name,
-                            'client_email': client_email
-                        }
-            
-            logger.debug(f"Found {len(campaigns_dict)} unique campaigns from {len(all_jobs)} jobs")
-            
-            # Create thread for each unique campaign
-            for campaign_id, campaign_data in campaigns_dict.items():
-                campaign_name = campaign_data['name']
-                client_email = campaign_data['client_email']
-                
-                # Determine thread owner (always the client/campaign owner)
-                thread_owner_uid = get_campaign_owner_uid(campaign_id, client_email, firebase_uid)
-                
-                thread_data = {
-                    'title': campaign_name,
-                    'description': f"Messages for campaign {campaign_name}",
-                    'campaign_id': campaign_id,
-                    'created_by': thread_owner_uid,
-                    'status': 'active'
-                }
-                try:
-                    thread_id = db.create_thread(thread_data)
-                    threads_created += 1
-                    logger.debug(f"Thread synced: {thread_id} for campaign {campaign_name} (Owner: {thread_owner_uid})")
-                    
-                    # If an influencer is syncing a campaign, ensure they have a conversation 
-                    # with the campaign owner so they can see and access the thread.
-                    if role == 'influencer' and thread_owner_uid != firebase_uid:
-                        # Get influencer profile for conversation details
-                        influencer_user = db.get_user_by_firebase_uid(firebase_uid)
-                        influencer_name = influencer_user.get('display_name', 'Influencer') if influencer_user else 'Influencer'
-                        influencer_avatar = influencer_user.get('photo_url', '') if influencer_user else ''
-                        
-                        # Get client profile for conversation details
-                        client_user = db.get_user_by_firebase_uid(thread_owner_uid)
-                        client_name = client_user.get('display_name', 'Client') if client_user else 'Client'
-                        client_avatar = client_user.get('photo_url', '') if client_user else ''
-                        
-                        db.get_or_create_conversation(
-                            thread_id=thread_id,
-                            participant1_id=thread_owner_uid,
-                            participant2_id=firebase_uid,
-                            participant1_name=client_name,
-                            participant2_name=influencer_name,
-                            participant1_avatar=client_avatar,
-                            participant2_avatar=influencer_avatar,
-                            name=f"{campaign_name} - Chat"
-                        )
-                except Exception as e:
-                    # Thread might already exist (UNIQUE constraint on campaign_id)
-                    if 'UNIQUE constraint failed' not in str(e):
-                        logger.warning(f"Failed to create thread for campaign {campaign_name}: {e}")
-    
-    except HyptrbAPIError as e:
-        logger.warning(f"Failed to fetch campaigns for {email}: {e}")
-    except Exception as e:
-        logger.error(f"Error syncing threads for {email}: {e}")
+    for campaign_id, campaign_data in campaigns.items():
+        campaign_name = campaign_data['name']
+        
+        # Determine thread owner (always the client/campaign owner)
+        thread_owner_uid = get_campaign_owner_uid(campaign_id, campaign_data['client_email'], firebase_uid)
+        
+        threads.append({
+            'title': campaign_name,
+            'description': f"Messages for campaign {campaign_name}",
+            'campaign_id': campaign_id,
+            'created_by': thread_owner_uid,
+            'status': 'active'
+        })
+        
+        # If an influencer is syncing a campaign, ensure they have a conversation 
+        # with the campaign owner so they can see and access the thread.
+        if role == 'influencer' and thread_owner_uid != firebase_uid:
+            influencer_user = get_profile(firebase_uid)
+            client_user = get_profile(thread_owner_uid)
+            conversations.append({
+                'campaign_id': campaign_id,
+                'name': f"{campaign_name} - Chat",
+                'participant1_id': thread_owner_uid,
+                'participant1_name': client_user.get('display_name', 'Client') if client_user else 'Client',
+                'participant1_avatar': client_user.get('photo_url', '') if client_user else '',
+                'participant2_id': firebase_uid,
+                'participant2_name': influencer_user.get('display_name', 'Influencer') if influencer_user else 'Influencer',
+                'participant2_avatar': influencer_user.get('photo_url', '') if influencer_user else ''
+            })
     
-    return threads_created
+    thread_ids = db.upsert_campaign_threads(threads, conversations)
+    logger.debug(f"Synced {len(thread_ids)} campaign threads and {len(conversations)} conversations for {email}")
+    return len(thread_ids)
+
+# Decides when a user's campaigns are re-synced (TTL, content hash, background refresh)
+thread_sync_scheduler.fetch = fetch_user_campaigns
+thread_sync_scheduler.apply = apply_user_campaigns
 
 def ensure_user_exists(user_info: dict) -> dict:
     """
     Ensure user exists in database, create/update if needed.
     Fetches user role and profile from Hyptrb API on first access.
+    
+    Resolved once per request (see request_context.py); later calls in the
+    same request return the same row without touching the database.
     """
     # Validate user_info is a dictionary
     if not isinstance(user_info, dict):
@@ -338,6 +352,11 @@ def ensure_user_exists(user_info: dict) -> dict:
     if not firebase_uid:
         raise ValueError("user_info must contain 'uid' field")
     
+    identity = identity_map()
+    resolved_user = identity.resolved_user(firebase_uid)
+    if resolved_user:
+        return resolved_user
+    
     email = user_info.get('email')
     
     # Clean email - remove any .admin suffix that might be appended by Firebase
@@ -346,7 +365,7 @@ def ensure_user_exists(user_info: dict) -> dict:
         logger.info(f"Cleaned email from {user_info.get('email')} to {email}")
     
     # Check if user already exists in database
-    existing_user = db.get_user_by_firebase_uid(firebase_uid)
+    existing_user = identity.user(firebase_uid)
     
     # If user doesn't exist or doesn't have role, fetch from Hyptrb API
     if not existing_user or not existing_user.get('role'):
@@ -411,7 +430,7 @@ def ensure_user_exists(user_info: dict) -> dict:
         # Auto-create threads for campaigns (only for clients and influencers)
         if role in ['client', 'influencer'] and email:
             logger.info(f"Initial thread sync for new user {email}")
-            sync_user_campaign_threads(firebase_uid, email, role)
+            thread_sync_scheduler.sync(firebase_uid, email, role, force=True)
     
     else:
         # User exists, just update last seen and basic info
@@ -425,10 +444,29 @@ def ensure_user_exists(user_info: dict) -> dict:
             'phone_number': existing_user.get('phone_number') or user_info.get('phone_number')
         }
     
-    db.create_or_update_user(user_data)
-    db.update_user_last_seen(firebase_uid)
+    if existing_user and not user_profile_changed(existing_user, user_data):
+        # Nothing to write back; last_seen goes through the presence buffer
+        db_user = dict(existing_user)
+        db_user['last_seen'] = presence.touch(firebase_uid)
+    else:
+        # create_or_update_user also stamps last_seen
+        db.create_or_update_user(user_data)
+        identity.forget_user(firebase_uid)
+        db_user = identity.user(firebase_uid)
+        presence.touch(firebase_uid)
     
-    return db.get_user_by_firebase_uid(firebase_uid)
+    identity.set_resolved_user(db_user)
+    return db_user
+
+def user_profile_changed(existing_user: dict, user_data: dict) -> bool:
+    """True if any profile field in user_data differs from the stored user row"""
+    for field, value in user_data.items():
+        if field == 'email_verified':
+            if bool(existing_user.get(field)) != bool(value):
+                return True
+        elif existing_user.get(field) != value:
+            return True
+    return False
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
@@ -436,6 +474,10 @@ def allowed_file(filename):
         return False
     return filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Multipart file parts are written once, straight into the blob store, while they are
+# hashed, sized and sniffed (see upload_ingest.py); disallowed types are never written
+app.request_class = ingest_request_class(allowed_file, MAX_FILE_SIZE)
+
 def get_file_type(filename):
     """Determine file type based on extension"""
     ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
@@ -452,67 +494,97 @@ def get_file_type(filename):
     else:
         return 'file'
 
-def get_image_dimensions(file_path):
-    """Extract dimensions from image file"""
-    if not PIL_AVAILABLE:
-        return None
-    try:
-        with Image.open(file_path) as img:
-            return {"width": img.width, "height": img.height}
-    except Exception:
-        return None
-
-def get_video_dimensions(file_path):
-    """Extract dimensions from video file"""
-    if not CV2_AVAILABLE:
-        return None
-    try:
-        video = cv2.VideoCapture(file_path)
-        width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        video.release()
-        return {"width": width, "height": height}
-    except Exception:
-        return None
+def attachment_from_blob(blob, filename):
+    """Attachment metadata for a stored blob under its uploaded file name"""
+    attachment = {
+        'filename': filename,
+        'original_filename': filename,
+        'sha256': blob['sha256'],
+        'file_path': f"/files/{blob['sha256']}/{filename}",
+        'file_size': blob['size'],
+        'type': get_file_type(filename)
+    }
+    
+    # Probed metadata (dimensions, duration, codec, thumbnail/poster URLs); media
+    # that has not been processed yet is filled in later by the media pipeline
+    attachment.update(blob['metadata'])
+    if needs_processing(attachment['type'], blob['metadata']):
+        attachment['processing'] = 'pending'
+    
+    return attachment
 
 def process_file_upload(file):
-    """Process a single file upload and return metadata"""
+    """Store a single file upload in the blob store and return attachment metadata"""
     if not file or not file.filename or not allowed_file(file.filename):
         return None
     
     filename = secure_filename(file.filename)
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    unique_filename = f"{timestamp}_{filename}"
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
     
-    # Save file
-    file.save(file_path)
-    
-    # Get file size
-    file_size = os.path.getsize(file_path)
+    # Content that is already stored is not kept twice and keeps its probed
+    # metadata. New media is probed after the response by queue_media_processing.
+    ingest = file.stream if isinstance(file.stream, IngestStream) else None
+    if ingest and ingest.complete:
+        # Written, hashed and sniffed while the request was parsed: just rename it
+        blob = blob_store.adopt(ingest.detach(), ingest.sha256, ingest.size)
+        mime_type = ingest.mime_type
+    else:
+        blob = blob_store.put(file.stream)
+        mime_type = None
     
-    # Determine file type and extract dimensions
-    file_type = get_file_type(filename)
-    dimensions = None
+    attachment = attachment_from_blob(blob, filename)
+    if mime_type:
+        attachment['mime_type'] = mime_type
+        if attachment['type'] in ('image', 'video') and not mime_type.startswith(attachment['type'] + '/'):
+            # The extension claims media the content is not: no probing or previews
+            attachment['type'] = 'file'
+            attachment.pop('processing', None)
     
-    if file_type == 'image':
-        dimensions = get_image_dimensions(file_path)
-    elif file_type == 'video':
-        dimensions = get_video_dimensions(file_path)
+    return attachment
+
+def attachments_from_references(references):
+    """
+    Attachments for content that is already stored (POST /uploads, a finished
+    upload session), so a message can include it without sending the bytes again
     
-    # Create attachment metadata
-    attachment = {
-        'filename': unique_filename,
-        'original_filename': filename,
-        'file_path': f'/uploads/{unique_filename}',
-        'file_size': file_size,
-        'type': file_type
-    }
+    Args:
+        references: List of {"sha256": ..., "filename": ...}
     
-    if dimensions:
-        attachment['dimensions'] = dimensions
+    Raises:
+        ValueError: If a reference is malformed, has a disallowed file name or
+            names content that is not stored
+    """
+    if not isinstance(references, list):
+        raise ValueError('attachments must be a list of {"sha256", "filename"} objects')
+    
+    attachments = []
+    for reference in references:
+        if not isinstance(reference, dict):
+            raise ValueError('attachments must be a list of {"sha256", "filename"} objects')
+        sha256 = str(reference.get('sha256') or '').lower()
+        filename = secure_filename(str(reference.get('filename') or ''))
+        if not is_sha256(sha256) or not allowed_file(filename):
+            raise ValueError('Each attachment needs a sha256 and a filename with an allowed extension')
+        blob = blob_store.get(sha256)
+        if not blob:
+            raise ValueError(f'Unknown attachment content {sha256}, upload the file first')
+        attachments.append(attachment_from_blob(blob, filename))
+    return attachments
+
+def queue_media_processing(attachments, message_id=None):
+    """
+    Queue attachments still marked processing: 'pending' for the media pipeline
     
-    return attachment
+    Args:
+        attachments: Attachment dicts (from attachment_from_blob or a stored message)
+        message_id: Message to patch (and announce with message.processed) once probed
+    """
+    for attachment in attachments or []:
+        if isinstance(attachment, dict) and attachment.get('processing') == 'pending':
+            try:
+                media_pipeline.submit(attachment['sha256'], attachment['type'], message_id)
+            except Exception as e:
+                # The upload itself succeeded; the attachment just stays unprobed
+                logger.error(f"Failed to queue media processing for {attachment.get('sha256')}: {e}")
 
 def determine_message_type(message: dict) -> str:
     """
@@ -557,6 +629,64 @@ def determine_message_type(message: dict) -> str:
     else:
         return primary_type
 
+def build_conversation_summaries(conversations: list) -> list:
+    """
+    Build the simplified conversation list returned with threads from the
+    enriched conversations of db.get_thread_tree_for_user / get_thread_with_conversations
+    """
+    summaries = []
+    for conv in conversations:
+        last_msg = conv.get('last_message_data')
+        last_message_type = determine_message_type(last_msg) if last_msg else 'text'
+
+        summaries.append({
+            'id': conv['id'],
+            'name': conv.get('name'),
+            'participant1_id': conv.get('participant1_id'),
+            'participant1_name': conv.get('participant1_name'),
+            'participant1_avatar': conv.get('participant1_avatar'),
+            'participant1_email': conv.get('participant1_email'),
+            'participant1_role': conv.get('participant1_role'),
+            'participant2_id': conv.get('participant2_id'),
+            'participant2_name': conv.get('participant2_name'),
+            'participant2_avatar': conv.get('participant2_avatar'),
+            'participant2_email': conv.get('participant2_email'),
+            'participant2_role': conv.get('participant2_role'),
+            'participant_type': conv.get('participant_type'),
+            'last_message': conv.get('last_message'),
+            'last_message_time': conv.get('last_message_time'),
+            'last_message_type': last_message_type,
+            # Unread count specific to the current user
+            'unread_count': conv.get('user_unread_count', 0),
+            'updated_at': conv.get('updated_at')
+        })
+    return summaries
+
+def publish_conversation_event(event_type: str, conversation: dict, data: dict):
+    """Push a real-time event to every participant of a conversation"""
+    if not conversation:
+        return
+    try:
+        realtime.hub.publish(event_type, data, realtime.conversation_participants(conversation))
+    except Exception as e:
+        # Real-time delivery is best effort; clients recover through /messages/sync
+        logger.error(f"Failed to publish {event_type} event: {str(e)}")
+
+def publish_media_processed(message: dict):
+    """media_pipeline callback: announce a message whose attachments were probed"""
+    publish_conversation_event(realtime.MESSAGE_PROCESSED, db.get_conversation_by_id(message['conversation_id']),
+                               message)
+
+media_pipeline.on_processed = publish_media_processed
+
+def format_sse(event: dict) -> str:
+    """Serialize a hub event as a Server-Sent Events frame"""
+    frame = f"event: {event['type']}\n"
+    change_seq = event['data'].get('change_seq') if isinstance(event['data'], dict) else None
+    if change_seq:
+        frame += f"id: {change_seq}\n"
+    return frame + f"data: {json.dumps(event)}\n\n"
+
 # ============================================================================
 # THREAD ENDPOINTS (Protected)
 # ============================================================================
@@ -567,6 +697,10 @@ def determine_message_type(message: dict) -> str:
 def handle_threads():
     """
     GET: List all threads for authenticated user (auto-syncs with Hyptrb campaigns)
+         Query Parameters:
+         - refresh: true to re-sync campaigns from Hyptrb before responding
+         The response's `sync.status` tells whether campaigns were re-synced
+         (fresh, scheduled, unchanged, synced, partial, failed, backoff, skipped).
          Each thread includes:
          - conversation_count: Number of conversations in the thread
          - conversations: Simplified list of conversations with essential fields
@@ -607,72 +741,26 @@ def handle_threads():
             except HyptrbAPIError as e:
                 logger.error(f"Failed to fetch role: {e}")
         
-        if user_role and user_email:
-            threads_synced = sync_user_campaign_threads(user_id, user_email, user_role)
-            if threads_synced > 0:
-                logger.debug(f"Synced {threads_synced} new threads for {user_email}")
-            else:
-                logger.debug(f"No new threads to sync for {user_email}")
-        else:
-            logger.debug(f"Skipping thread sync - Role: {user_role}, Email: {user_email}")
-        
-        # Get threads based on user role (admins see all threads with conversations)
-        user_threads = db.get_threads_for_user(user_id, user_role)
+        # Sync with Hyptrb campaigns at most once per THREAD_SYNC_TTL
+        # (?refresh=true forces a sync before responding)
+        refresh = request.args.get('refresh', '').lower() in ('true', '1', 'yes')
+        sync_result = thread_sync_scheduler.sync(user_id, user_email, user_role, force=refresh)
+        logger.debug(f"Thread sync for {user_email}: {sync_result['status']}")
         
-        # Enrich each thread with conversation data
+        # Get threads based on user role (admins see all threads with conversations),
+        # each enriched with its conversations, last message and unread counts.
+        # Admins see all conversations, others see only their own.
+        user_threads = db.get_thread_tree_for_user(user_id, user_role)
         for thread in user_threads:
-            thread_id = thread['id']
-            # Admins see all conversations, others see only their own
-            if is_admin_role(user_role):
-                conversations = db.get_conversations_by_thread(thread_id, user_id=None)
-            else:
-                conversations = db.get_conversations_by_thread(thread_id, user_id=user_id)
-
-            # Add conversation count
-            thread['conversation_count'] = len(conversations)
-
-            # Calculate total unread count for this thread for the current user
-            thread['total_unread'] = db.get_thread_unread_count_for_user(thread_id, user_id)
-            
-            # Add simplified conversation list (only essential fields)
-            enriched_conversations = []
-            for conv in conversations:
-                # Get last message to determine type
-                last_msg = db.get_last_message(conv['id'])
-                last_message_type = determine_message_type(last_msg) if last_msg else 'text'
-
-                # Get unread count specific to the current user
-                unread_count = db.get_unread_count_for_user(conv['id'], user_id)
-
-                enriched_conversations.append({
-                    'id': conv['id'],
-                    'name': conv.get('name'),
-                    'participant1_id': conv.get('participant1_id'),
-                    'participant1_name': conv.get('participant1_name'),
-                    'participant1_avatar': conv.get('participant1_avatar'),
-                    'participant1_email': conv.get('participant1_email'),
-                    'participant1_role': conv.get('participant1_role'),
-                    'participant2_id': conv.get('participant2_id'),
-                    'participant2_name': conv.get('participant2_name'),
-                    'participant2_avatar': conv.get('participant2_avatar'),
-                    'participant2_email': conv.get('participant2_email'),
-                    'participant2_role': conv.get('participant2_role'),
-                    'participant_type': conv.get('participant_type'),
-                    'last_message': conv.get('last_message'),
-                    'last_message_time': conv.get('last_message_time'),
-                    'last_message_type': last_message_type,
-                    'unread_count': unread_count,
-                    'updated_at': conv.get('updated_at')
-                })
-            
-            thread['conversations'] = enriched_conversations
+            thread['conversations'] = build_conversation_summaries(thread['conversations'])
         
         logger.debug(f"Returning {len(user_threads)} threads for {user_email}")
         
         return jsonify({
             'threads': user_threads,
             'total_count': len(user_threads),
-            'user_id': user_id
+            'user_id': user_id,
+            'sync': sync_result
         })
     
     if request.method == 'POST':
@@ -685,43 +773,10 @@ def handle_threads():
         data['created_by'] = get_campaign_owner_uid(campaign_id, default_uid=user_id)
         
         thread_id = db.create_thread(data)
-        thread = db.get_thread_by_id(thread_id)
         
         # Enrich thread with conversation data
-        conversations = db.get_conversations_by_thread(thread_id, user_id=user_id)
-        thread['conversation_count'] = len(conversations)
-        
-        enriched_conversations = []
-        for conv in conversations:
-            # Get last message to determine type
-            last_msg = db.get_last_message(conv['id'])
-            last_message_type = determine_message_type(last_msg) if last_msg else 'text'
-
-            # Get unread count specific to the current user
-            unread_count = db.get_unread_count_for_user(conv['id'], user_id)
-
-            enriched_conversations.append({
-                'id': conv['id'],
-                'name': conv.get('name'),
-                'participant1_id': conv.get('participant1_id'),
-                'participant1_name': conv.get('participant1_name'),
-                'participant1_avatar': conv.get('participant1_avatar'),
-                'participant1_email': conv.get('participant1_email'),
-                'participant1_role': conv.get('participant1_role'),
-                'participant2_id': conv.get('participant2_id'),
-                'participant2_name': conv.get('participant2_name'),
-                'participant2_avatar': conv.get('participant2_avatar'),
-                'participant2_email': conv.get('participant2_email'),
-                'participant2_role': conv.get('participant2_role'),
-                'participant_type': conv.get('participant_type'),
-                'last_message': conv.get('last_message'),
-                'last_message_time': conv.get('last_message_time'),
-                'last_message_type': last_message_type,
-                'unread_count': unread_count,
-                'updated_at': conv.get('updated_at')
-            })
-        
-        thread['conversations'] = enriched_conversations
+        thread = db.get_thread_with_conversations(thread_id, user_id)
+        thread['conversations'] = build_conversation_summaries(thread['conversations'])
         
         return jsonify({
             'message': 'Thread created successfully',
@@ -734,20 +789,19 @@ def get_thread(thread_id):
     """Get thread details with all conversations"""
     user = get_current_user()
     user_id = user['uid']
-    ensure_user_exists(user)
+    db_user = ensure_user_exists(user)
+    identity = identity_map()
     
-    if not db.thread_exists(thread_id):
+    thread = identity.thread(thread_id)
+    if not thread:
         return jsonify({'error': 'Thread not found'}), 404
     
     # Verify user has access to thread (admins have access to all threads)
-    db_user = ensure_user_exists(user)
     user_role = db_user.get('role')
     
     if not db.user_has_thread_access(thread_id, user_id, user_role):
         return jsonify({'error': 'Access denied. You do not have access to this thread'}), 403
     
-    thread = db.get_thread_by_id(thread_id)
-    
     # Admins see all conversations, others see only their own
     if is_admin_role(user_role):
         conversations = db.get_conversations_by_thread(thread_id, user_id=None)
@@ -772,19 +826,18 @@ def handle_thread_conversations(thread_id):
     GET: List all conversations in a thread
     POST: Create/get conversation between thread owner and another participant
     """
-    if not db.thread_exists(thread_id):
+    identity = identity_map()
+    thread = identity.thread(thread_id)
+    if not thread:
         return jsonify({'error': 'Thread not found'}), 404
     
     user = get_current_user()
     user_id = user['uid']
-    ensure_user_exists(user)
-    
-    thread = db.get_thread_by_id(thread_id)
+    db_user = ensure_user_exists(user)
+    user_role = db_user.get('role')
     
     if request.method == 'GET':
         # Verify user has access to thread (admins have access to all threads)
-        db_user = ensure_user_exists(user)
-        user_role = db_user.get('role')
         
         if not db.user_has_thread_access(thread_id, user_id, user_role):
             return jsonify({'error': 'Access denied. You do not have access to this thread'}), 403
@@ -801,10 +854,6 @@ def handle_thread_conversations(thread_id):
         })
     
     if request.method == 'POST':
-        # Get user info to check if admin
-        db_user = ensure_user_exists(user)
-        user_role = db_user.get('role')
-        
         # For POST, verify user is the thread owner, an admin, or an influencer in a campaign thread
         # This ensures that even if the campaign owner is the thread owner, 
         # influencers can still initiate conversations with the client.
@@ -844,7 +893,7 @@ def handle_thread_conversations(thread_id):
             participant2_id = other_participant_id
         
         # Fetch participant1 info from database
-        participant1_user = db.get_user_by_firebase_uid(participant1_id)
+        participant1_user = identity.user(participant1_id)
         
         if not participant1_user:
             return jsonify({'error': 'Thread owner not found in database'}), 404
@@ -862,7 +911,7 @@ def handle_thread_conversations(thread_id):
         
         if participant2_id:
             # Try to get user by Firebase UID first
-            participant2_user = db.get_user_by_firebase_uid(participant2_id)
+            participant2_user = identity.user(participant2_id)
             
             # If not found and looks like an email, try to get by email
             if not participant2_user and '@' in participant2_id:
@@ -885,7 +934,6 @@ def handle_thread_conversations(thread_id):
         conversation_name = data.get('name')
         if not conversation_name and not participant2_id:
             # For client-only conversations, use thread title + " Discussion"
-            thread = db.get_thread_by_id(thread_id)
             if thread:
                 conversation_name = f"{thread.get('title', 'Campaign')} Discussion"
         
@@ -924,16 +972,14 @@ def handle_join_conversation(thread_id, conversation_id):
     """
     user = get_current_user()
     user_id = user['uid']
-    ensure_user_exists(user)
+    db_user = ensure_user_exists(user)
+    identity = identity_map()
     
-    if not db.thread_exists(thread_id):
+    if not identity.thread(thread_id):
         return jsonify({'error': 'Thread not found'}), 404
     
-    if not db.conversation_exists(conversation_id):
-        return jsonify({'error': 'Conversation not found'}), 404
-    
     # Get conversation details
-    conversation = db.get_conversation_by_id(conversation_id)
+    conversation = identity.conversation(conversation_id)
     
     if not conversation:
         return jsonify({'error': 'Conversation not found'}), 404
@@ -950,8 +996,6 @@ def handle_join_conversation(thread_id, conversation_id):
     if conversation.get('participant1_id') == user_id:
         return jsonify({'error': 'You cannot join your own conversation as participant2'}), 400
     
-    # Get user info from database
-    db_user = db.get_user_by_firebase_uid(user_id)
     if not db_user:
         return jsonify({'error': 'User not found in database'}), 404
     
@@ -970,7 +1014,8 @@ def handle_join_conversation(thread_id, conversation_id):
         return jsonify({'error': 'Failed to join conversation'}), 500
     
     # Get updated conversation
-    updated_conversation = db.get_conversation_by_id(conversation_id)
+    identity.forget_conversation(conversation_id)
+    updated_conversation = identity.conversation(conversation_id)
     
     return jsonify({
         'message': 'Successfully joined conversation',
@@ -1016,7 +1061,7 @@ def join_campaign(campaign_id):
             return jsonify({'error': 'You cannot join your own campaign'}), 400
         
         # Get campaign owner info
-        owner_user = db.get_user_by_firebase_uid(campaign_owner_id)
+        owner_user = identity_map().user(campaign_owner_id)
         if not owner_user:
             return jsonify({'error': 'Campaign owner not found in database'}), 404
         
@@ -1076,7 +1121,7 @@ def admin_start_chat(user_firebase_uid):
         return jsonify({'error': 'You cannot start a chat with yourself'}), 400
     
     # Get target user info
-    target_user = db.get_user_by_firebase_uid(user_firebase_uid)
+    target_user = identity_map().user(user_firebase_uid)
     if not target_user:
         return jsonify({'error': 'User not found'}), 404
     
@@ -1141,18 +1186,25 @@ def admin_start_chat(user_firebase_uid):
 @require_auth
 def handle_conversation(thread_id, conversation_id):
     """
-    GET: Get all messages in conversation
+    GET: Get messages in conversation (one page, newest first by default)
+         Query Parameters:
+         - limit: Page size (default MESSAGES_PAGE_SIZE, capped at MESSAGES_MAX_PAGE_SIZE)
+         - before: Cursor; return messages older than it (paging back through history)
+         - after: Cursor; return messages newer than it (polling for new messages)
+         Messages are ordered oldest first; `paging` holds the cursors for the
+         first (before_cursor) and last (after_cursor) message of the page.
     POST: Send a new message
     PUT: Mark conversation as read
     """
-    if not db.thread_exists(thread_id):
+    identity = identity_map()
+    if not identity.thread(thread_id):
         return jsonify({'error': 'Thread not found'}), 404
     
-    if not db.conversation_exists(conversation_id):
+    conversation = identity.conversation(conversation_id)
+    if not conversation:
         return jsonify({'error': 'Conversation not found'}), 404
     
     # Verify conversation belongs to thread
-    conversation = db.get_conversation_by_id(conversation_id)
     if conversation['thread_id'] != thread_id:
         return jsonify({'error': 'Conversation does not belong to this thread'}), 400
     
@@ -1168,23 +1220,55 @@ def handle_conversation(thread_id, conversation_id):
     
     # GET: Retrieve messages
     if request.method == 'GET':
-        messages = db.get_messages(conversation_id)
+        limit = request.args.get('limit', MESSAGES_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, MESSAGES_MAX_PAGE_SIZE))
+        
+        try:
+            before = decode_message_cursor(request.args['before']) if request.args.get('before') else None
+            after = decode_message_cursor(request.args['after']) if request.args.get('after') else None
+        except ValueError:
+            return jsonify({'error': 'Invalid pagination cursor'}), 400
+        
+        page = db.get_messages_page(conversation_id, before=before, after=after, limit=limit)
+        messages = page['messages']
+        
         return jsonify({
             'thread_id': thread_id,
             'conversation_id': conversation_id,
-            'messages': messages
+            'messages': messages,
+            'paging': {
+                'limit': limit,
+                'has_more_before': page['has_more_before'],
+                'has_more_after': page['has_more_after'],
+                'before_cursor': encode_message_cursor(messages[0]) if messages else request.args.get('before'),
+                'after_cursor': encode_message_cursor(messages[-1]) if messages else request.args.get('after')
+            }
         })
     
     # PUT: Mark as read
     if request.method == 'PUT':
-        # Use new per-user read status tracking
-        result = db.mark_messages_as_read(conversation_id, user_id)
+        # Moves the user's read cursor; optional JSON body {"up_to_seq": <msg_seq>}
+        # marks only up to that message (default: everything)
+        up_to_seq = (request.get_json(silent=True) or {}).get('up_to_seq')
+        if up_to_seq is not None and (not isinstance(up_to_seq, int) or isinstance(up_to_seq, bool)):
+            return jsonify({'error': 'up_to_seq must be an integer'}), 400
+        result = db.mark_messages_as_read(conversation_id, user_id, up_to_seq)
 
         if result['success']:
+            if result['marked_count']:
+                publish_conversation_event(realtime.CONVERSATION_READ, conversation, {
+                    'thread_id': thread_id,
+                    'conversation_id': conversation_id,
+                    'user_id': user_id,
+                    'marked_count': result['marked_count'],
+                    'last_read_seq': result['last_read_seq'],
+                    'read_at': datetime.now().isoformat() + 'Z'
+                })
             response = {
                 'message': result['message'],
                 'reason': result['reason'],
-                'marked_count': result['marked_count']
+                'marked_count': result['marked_count'],
+                'last_read_seq': result['last_read_seq']
             }
 
             return jsonify(response)
@@ -1201,11 +1285,17 @@ def handle_conversation(thread_id, conversation_id):
             text_content = request.form.get('text', '') or request.form.get('content', '')
             files = request.files.getlist('files')
             
-            if not files and not text_content:
+            # Already stored content: JSON-encoded [{"sha256": ..., "filename": ...}]
+            try:
+                references = json.loads(request.form['attachments']) if request.form.get('attachments') else []
+                attachments = attachments_from_references(references)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            if not files and not attachments and not text_content:
                 return jsonify({'error': 'No content or files provided'}), 400
             
             # Process uploaded files
-            attachments = []
             for file in files:
                 attachment = process_file_upload(file)
                 if attachment:
@@ -1215,7 +1305,7 @@ def handle_conversation(thread_id, conversation_id):
             sender_id = request.form.get('sender_id', user_id)
             
             # Fetch sender from database to get latest name and avatar
-            db_user = db.get_user_by_firebase_uid(sender_id)
+            db_user = identity.user(sender_id)
             sender_name = (db_user.get('display_name') if db_user 
                           else request.form.get('sender_name', user.get('name', user.get('email', 'User'))))
             
@@ -1237,6 +1327,8 @@ def handle_conversation(thread_id, conversation_id):
             
             message_id = db.create_message(message_data)
             message = db.get_message_by_id(message_id)
+            publish_conversation_event(realtime.MESSAGE_CREATED, conversation, message)
+            queue_media_processing(attachments, message_id)
             
             return jsonify({
                 'message': 'Message sent successfully',
@@ -1245,16 +1337,22 @@ def handle_conversation(thread_id, conversation_id):
             }), 201
         
         else:
-            # Handle JSON request (text-only message)
+            # Handle JSON request (text, optionally with references to stored content
+            # in "attachments": [{"sha256": ..., "filename": ...}])
             data = request.get_json()
             if not data:
                 return jsonify({'error': 'No data provided'}), 400
             
+            try:
+                attachments = attachments_from_references(data.get('attachments') or [])
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
             # Get sender info from request or use authenticated user
             sender_id = data.get('sender_id', user_id)
             
             # Fetch sender from database to get latest name and avatar
-            db_user = db.get_user_by_firebase_uid(sender_id)
+            db_user = identity.user(sender_id)
             sender_name = (db_user.get('display_name') if db_user 
                           else data.get('sender_name', user.get('name', user.get('email', 'User'))))
             
@@ -1264,15 +1362,19 @@ def handle_conversation(thread_id, conversation_id):
                 'sender_id': sender_id,
                 'sender_type': data.get('sender_type', 'client'),
                 'sender_name': sender_name,
-                'type': data.get('type', 'text'),
+                'type': 'file' if attachments else data.get('type', 'text'),
                 'content': data.get('content', ''),
                 'text_content': data.get('content', ''),
                 'timestamp': datetime.now().isoformat() + 'Z',
-                'status': 'delivered'
+                'status': 'delivered',
+                'has_attachment': len(attachments) > 0,
+                'attachments': attachments
             }
             
             message_id = db.create_message(message_data)
             message = db.get_message_by_id(message_id)
+            publish_conversation_event(realtime.MESSAGE_CREATED, conversation, message)
+            queue_media_processing(attachments, message_id)
             
             return jsonify({
                 'message': 'Message sent successfully',
@@ -1301,9 +1403,11 @@ def forward_message():
         return jsonify({'error': 'Original message not found'}), 404
     
     # Verify target thread and conversation exist
-    if not db.thread_exists(target_thread_id):
+    identity = identity_map()
+    if not identity.thread(target_thread_id):
         return jsonify({'error': 'Target thread not found'}), 404
-    if not db.conversation_exists(target_conversation_id):
+    target_conversation = identity.conversation(target_conversation_id)
+    if not target_conversation:
         return jsonify({'error': 'Target conversation not found'}), 404
     
     user = get_current_user()
@@ -1324,6 +1428,8 @@ def forward_message():
     
     if new_message_id:
         new_message = db.get_message_by_id(new_message_id)
+        publish_conversation_event(realtime.MESSAGE_CREATED, target_conversation, new_message)
+        queue_media_processing(new_message.get('attachments'), new_message_id)
         return jsonify({
             'message': 'Message forwarded successfully',
             'data': new_message
@@ -1331,6 +1437,202 @@ def forward_message():
     else:
         return jsonify({'error': 'Failed to forward message'}), 500
 
+@app.route('/messages/unread', methods=['GET'])
+@csrf.exempt
+@require_auth
+def get_unread_badges():
+    """
+    Unread badge counts for the authenticated user
+    
+    Served from the per-member unread counters (no message scan), so clients can
+    poll it or refresh it on every real-time event.
+    
+    Returns:
+    - total_unread: Unread messages across all conversations
+    - threads: {thread_id: unread} for threads with unread messages
+    - conversations: {conversation_id: unread} for conversations with unread messages
+    """
+    user = get_current_user()
+    ensure_user_exists(user)
+    
+    return jsonify(db.get_unread_summary(user['uid']))
+
+@app.route('/messages/search', methods=['GET'])
+@csrf.exempt
+@require_auth
+def search_messages():
+    """
+    Full-text search over messages the user can see
+    
+    Query Parameters:
+    - q: Search text; every word must match (the last one as a prefix)
+    - thread_id: Only messages in this thread
+    - conversation_id: Only messages in this conversation
+    - limit: Page size (default SEARCH_PAGE_SIZE, capped at SEARCH_MAX_PAGE_SIZE)
+    - cursor: next_cursor from the previous page
+    
+    Matches message text, captions and attachment file names. Admins search every
+    conversation, others only conversations they participate in.
+    
+    Returns:
+    - results: Messages, best match first, each with rank (lower is better) and a
+      snippet (HTML-escaped, hits wrapped in <mark>)
+    - next_cursor / has_more: Keyset pagination over (rank, message); later pages only
+      consider messages that existed when the first page was served (best-effort: ranks
+      can still shift if matching messages are edited or deleted meanwhile)
+    """
+    if not db.fts_enabled:
+        return jsonify({'error': 'Message search is not available (SQLite has no FTS5)'}), 503
+    
+    user = get_current_user()
+    user_id = user['uid']
+    db_user = ensure_user_exists(user)
+    user_role = db_user.get('role')
+    
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    
+    limit = request.args.get('limit', SEARCH_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
+    thread_id = request.args.get('thread_id')
+    conversation_id = request.args.get('conversation_id')
+    
+    try:
+        after = decode_search_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid pagination cursor'}), 400
+    
+    if thread_id and not db.user_has_thread_access(thread_id, user_id, user_role):
+        return jsonify({'error': 'Access denied. You do not have access to this thread'}), 403
+    
+    page = db.search_messages(
+        query,
+        user_id,
+        user_role,
+        thread_id=thread_id,
+        conversation_id=conversation_id,
+        after=after,
+        limit=limit
+    )
+    results = page['results']
+    keys = [result.pop('_search_key') for result in results]
+    for result in results:
+        result['message_type'] = determine_message_type(result)
+    
+    return jsonify({
+        'query': query,
+        'results': results,
+        'paging': {
+            'limit': limit,
+            'has_more': page['has_more'],
+            'next_cursor': encode_search_cursor(keys[-1]) if page['has_more'] else None
+        }
+    })
+
+@app.route('/messages/sync', methods=['GET'])
+@csrf.exempt
+@require_auth
+def sync_changes():
+    """
+    Incremental sync: everything visible to the user that changed after a watermark
+    
+    Query Parameters:
+    - since: Watermark returned by the previous call (default: 0)
+    - limit: Maximum rows per change type (default: SYNC_PAGE_SIZE, capped at SYNC_MAX_PAGE_SIZE)
+    - thread_id: Only changes in this thread
+    - conversation_id: Only changes in this conversation
+    
+    Returns:
+    - threads, conversations: Rows whose metadata changed
+    - messages: New and edited messages; soft-deleted ones have deleted=true and deleted_at
+    - read_receipts: Moved read cursors (conversation_id, user_id, last_read_seq, read_at);
+      every message with msg_seq <= last_read_seq is read by that user
+    - watermark: Pass as `since` on the next call
+    - has_more: True if the page was truncated; call again immediately with the watermark
+    
+    To bootstrap, call once without `since` first and keep the watermark, then load
+    the full state from the regular endpoints; changes made in between are replayed
+    by the next sync (applying a change twice is harmless).
+    """
+    user = get_current_user()
+    user_id = user['uid']
+    db_user = ensure_user_exists(user)
+    user_role = db_user.get('role')
+    
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', SYNC_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, SYNC_MAX_PAGE_SIZE))
+    thread_id = request.args.get('thread_id')
+    conversation_id = request.args.get('conversation_id')
+    
+    if thread_id and not db.user_has_thread_access(thread_id, user_id, user_role):
+        return jsonify({'error': 'Access denied. You do not have access to this thread'}), 403
+    
+    changes = db.get_changes_since(
+        user_id,
+        user_role,
+        since=since,
+        limit=limit,
+        thread_id=thread_id,
+        conversation_id=conversation_id
+    )
+    
+    for message in changes['messages']:
+        message['message_type'] = determine_message_type(message)
+    
+    return jsonify({
+        'since': since,
+        'watermark': changes['watermark'],
+        'has_more': changes['has_more'],
+        'threads': changes['threads'],
+        'conversations': changes['conversations'],
+        'messages': changes['messages'],
+        'read_receipts': changes['read_receipts']
+    })
+
+@app.route('/messages/stream', methods=['GET'])
+@csrf.exempt
+@require_stream_auth
+def stream_events():
+    """
+    Server-Sent Events stream of real-time changes for the current user
+    
+    Streams message.created, message.deleted and conversation.read events for
+    every conversation the user participates in. Comment lines are sent as a
+    heartbeat every REALTIME_HEARTBEAT_INTERVAL seconds.
+    
+    The token may be passed as ?access_token= because EventSource cannot set
+    headers. After a reconnect or a subscription.evicted event (client fell too
+    far behind), catch up with /messages/sync before relying on the stream again.
+    """
+    user = get_current_user()
+    user_id = user['uid']
+    ensure_user_exists(user)
+    
+    subscription = realtime.hub.subscribe(user_id)
+    
+    def generate():
+        try:
+            yield f"retry: 3000\n: connected as {user_id}\n\n"
+            while True:
+                event = subscription.get(timeout=realtime.REALTIME_HEARTBEAT_INTERVAL)
+                if event is None:
+                    # Heartbeat keeps proxies from closing the connection and
+                    # lets us notice disconnected clients
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event)
+                if event['type'] == realtime.SUBSCRIPTION_EVICTED:
+                    return
+        finally:
+            subscription.close()
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 # ============================================================================
 # MESSAGE ENDPOINTS (Protected)
 # ============================================================================
@@ -1343,12 +1645,15 @@ def handle_message(thread_id, conversation_id, message_id):
     GET: Get specific message details
     DELETE: Delete a message (soft delete)
     """
+    identity = identity_map()
+    
     # Verify thread exists
-    if not db.thread_exists(thread_id):
+    if not identity.thread(thread_id):
         return jsonify({'error': 'Thread not found'}), 404
     
     # Verify conversation exists
-    if not db.conversation_exists(conversation_id):
+    conversation = identity.conversation(conversation_id)
+    if not conversation:
         return jsonify({'error': 'Conversation not found'}), 404
     
     # Get message
@@ -1387,6 +1692,8 @@ def handle_message(thread_id, conversation_id, message_id):
         success = db.delete_message(message_id)
         
         if success:
+            publish_conversation_event(realtime.MESSAGE_DELETED, conversation,
+                                       db.get_message_by_id(message_id))
             return jsonify({'message': 'Message deleted successfully'})
         else:
             return jsonify({'error': 'Failed to delete message'}), 500
@@ -1395,16 +1702,122 @@ def handle_message(thread_id, conversation_id, message_id):
 # FILE SERVING ENDPOINT (Public)
 # ============================================================================
 
+def send_stored_file(path, root, location, etag, download_name=None, mimetype=None):
+    """
+    Response for a file in one of the storage roots, cached as immutable
+    
+    Conditional requests are answered here (304 on a matching strong ETag). The
+    bytes, including Range requests for seeking in videos (206/416), are sent by
+    Flask, or in x-accel mode by nginx from the internal location
+    ACCEL_REDIRECT_PREFIX/<location>/ that aliases root, so no worker is tied up
+    streaming large files; x-sendfile mode hands the path to Apache/lighttpd.
+    
+    Args:
+        path: File path inside root
+        root: Storage root the internal location points at
+        location: Name of that internal location ('uploads' or 'blobs')
+        etag: Strong ETag (the content hash for blobs)
+        download_name: File name for Content-Disposition and the content type
+        mimetype: Content type, if it cannot be guessed from the file name
+    """
+    if FILE_SENDFILE_MODE == 'x-accel':
+        mimetype = mimetype or mimetypes.guess_type(download_name or path)[0] or 'application/octet-stream'
+        response = Response(mimetype=mimetype)
+        response.set_etag(etag)
+        if request.if_none_match.contains_weak(etag):
+            response.status_code = 304
+        else:
+            relative = os.path.relpath(path, root).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = f"{ACCEL_REDIRECT_PREFIX}/{location}/{quote(relative)}"
+            if download_name:
+                response.headers.set('Content-Disposition', 'inline', filename=download_name)
+    else:
+        response = send_file(path, mimetype=mimetype, download_name=download_name, etag=etag,
+                             max_age=FILE_CACHE_MAX_AGE)
+    
+    response.cache_control.max_age = FILE_CACHE_MAX_AGE
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/uploads/<filename>', methods=['GET'])
 def serve_file(filename):
-    """Serve uploaded files (Publicly accessible)"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """
+    Serve files uploaded before the blob store (Publicly accessible)
+    
+    Nothing is written to the upload folder any more, so these files are immutable
+    too; their ETag is derived from size and modification time.
+    """
+    path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+    if not path or not os.path.isfile(path):
+        return jsonify({'error': 'File not found'}), 404
+    
+    stat = os.stat(path)
+    return send_stored_file(path, app.config['UPLOAD_FOLDER'], 'uploads',
+                            etag=f"{stat.st_size:x}-{stat.st_mtime_ns:x}",
+                            download_name=secure_filename(filename) or None)
+
+@app.route('/files/<sha256>/<filename>', methods=['GET'])
+def serve_blob(sha256, filename):
+    """
+    Serve a stored blob (Publicly accessible, like /uploads)
+    
+    The URL names the content, so it never changes and may be cached forever;
+    the file name only sets the download name and content type.
+    """
+    if not is_sha256(sha256) or not blob_store.exists(sha256):
+        return jsonify({'error': 'File not found'}), 404
+    
+    return send_stored_file(blob_store.path(sha256), blob_store.root, 'blobs', etag=sha256,
+                            download_name=secure_filename(filename) or sha256)
+
+@app.route('/files/<sha256>/variants/<name>', methods=['GET'])
+def serve_blob_variant(sha256, name):
+    """
+    Serve a preview of a stored image or video (Publicly accessible, like /files)
+    
+    `<size>.webp` / `<size>.jpg` is a thumbnail whose longest edge is at most size
+    pixels (one of THUMBNAIL_SIZES), `poster.jpg` a video's poster frame. Rendered on
+    first request, then served from the cache beside the blob; like the blob itself
+    the URL never changes content.
+    """
+    if not is_sha256(sha256):
+        return jsonify({'error': 'File not found'}), 404
+    
+    variant_path = variant_cache.get(sha256, name)
+    if not variant_path:
+        return jsonify({'error': 'Preview not available'}), 404
+    
+    return send_stored_file(variant_path, blob_store.root, 'blobs', etag=f"{sha256}-{name}",
+                            mimetype=FORMATS[name.rsplit('.', 1)[1]][1])
 
 @app.route('/uploads', methods=['POST'])
 @csrf.exempt
 @require_auth
 def upload_standalone_file():
-    """Standalone file upload endpoint (Requires authentication)"""
+    """
+    Standalone file upload endpoint (Requires authentication)
+    
+    Multipart `file` upload, or JSON {"sha256": ..., "filename": ...} to reuse content
+    that is already stored without sending it again (404 if it is not).
+    
+    The returned file_path may be used on its own (not only as a message attachment),
+    so the content is pinned: blob garbage collection never removes it.
+    """
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        filename = secure_filename(data.get('filename') or '')
+        if not data.get('sha256') or not allowed_file(filename):
+            return jsonify({'error': 'sha256 and a filename with an allowed extension are required'}), 400
+        blob = blob_store.get(str(data['sha256']).lower())
+        if not blob:
+            return jsonify({'error': 'Unknown content, upload the file instead'}), 404
+        blob_store.pin(blob['sha256'])
+        attachment = attachment_from_blob(blob, filename)
+        queue_media_processing([attachment])
+        attachment['upload_time'] = datetime.now().isoformat() + 'Z'
+        return jsonify(attachment), 200
+    
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     
@@ -1415,12 +1828,137 @@ def upload_standalone_file():
     attachment = process_file_upload(file)
     if not attachment:
         return jsonify({'error': 'File upload failed or invalid file type'}), 400
+    blob_store.pin(attachment['sha256'])
+    
+    # Probed in the background; the metadata is stored on the blob, so it is on
+    # the attachment when this content is sent or claimed later
+    queue_media_processing([attachment])
     
     # Add upload time to match frontend interface if needed
     attachment['upload_time'] = datetime.now().isoformat() + 'Z'
     
     return jsonify(attachment), 201
 
+def upload_session_response(session, status=200):
+    """JSON view of an upload session; Upload-Offset tells the client where to resume"""
+    body = {
+        'upload_id': session['id'],
+        'filename': session['filename'],
+        'size': session['size'],
+        'offset': session['received'],
+        'status': session['status'],
+        'chunk_size': upload_sessions.max_chunk_size,
+        'expires_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(session['expires_at']))
+    }
+    response = jsonify(body)
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(session['received'])
+    return response
+
+def upload_session_error(error):
+    """Response for an UploadSessionError (with the session's current offset when known)"""
+    body = {'error': str(error)}
+    if error.session:
+        body['offset'] = error.session['received']
+    response = jsonify(body)
+    response.status_code = error.status
+    if error.session:
+        response.headers['Upload-Offset'] = str(error.session['received'])
+    return response
+
+@app.route('/uploads/sessions', methods=['POST'])
+@csrf.exempt
+@require_auth
+def create_upload_session():
+    """
+    Start a resumable upload (Requires authentication)
+    
+    JSON body: {"filename": ..., "size": <bytes>, "sha256": optional hash of the whole file}
+    
+    Then send the file in chunks of at most chunk_size bytes with
+    PATCH /uploads/sessions/<upload_id> and finish with POST .../complete.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    if not allowed_file(filename):
+        return jsonify({'error': 'A filename with an allowed extension is required'}), 400
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'size (bytes) is required'}), 400
+    if size <= 0 or size > MAX_FILE_SIZE:
+        return jsonify({'error': f'size must be between 1 and {MAX_FILE_SIZE} bytes'}), 400
+    expected_sha256 = str(data['sha256']).lower() if data.get('sha256') else None
+    if expected_sha256 and not is_sha256(expected_sha256):
+        return jsonify({'error': 'sha256 must be a hex SHA-256'}), 400
+    
+    user = get_current_user()
+    session = upload_sessions.create(user['uid'], filename, size, expected_sha256)
+    return upload_session_response(session, 201)
+
+@app.route('/uploads/sessions/<upload_id>', methods=['GET', 'PATCH', 'DELETE'])
+@csrf.exempt
+@require_auth
+def handle_upload_session(upload_id):
+    """
+    GET: Upload status; resume from `offset` after a dropped connection
+    PATCH: Append one chunk (Requires authentication)
+           Raw request body (not multipart), with headers:
+           - Upload-Offset: Offset of the chunk, must equal the current offset (409 otherwise)
+           - Upload-Checksum: Optional "sha256 <hex>" of the chunk (400 and discarded on mismatch)
+    DELETE: Abandon the upload
+    
+    Sessions expire UPLOAD_SESSION_TTL seconds after their last chunk.
+    """
+    user = get_current_user()
+    try:
+        if request.method == 'GET':
+            return upload_session_response(upload_sessions.get(upload_id, user['uid']))
+        
+        if request.method == 'DELETE':
+            upload_sessions.cancel(upload_id, user['uid'])
+            return jsonify({'message': 'Upload cancelled'})
+        
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return jsonify({'error': 'Upload-Offset header is required'}), 400
+        if request.content_length is None:
+            return jsonify({'error': 'Content-Length is required'}), 411
+        checksum = None
+        if request.headers.get('Upload-Checksum'):
+            algorithm, _, checksum = request.headers['Upload-Checksum'].partition(' ')
+            if algorithm.lower() != 'sha256' or not checksum:
+                return jsonify({'error': 'Upload-Checksum must be "sha256 <hex>"'}), 400
+        
+        session = upload_sessions.append(upload_id, user['uid'], offset, request.stream,
+                                         request.content_length, checksum)
+        return upload_session_response(session)
+    except UploadSessionError as e:
+        return upload_session_error(e)
+
+@app.route('/uploads/sessions/<upload_id>/complete', methods=['POST'])
+@csrf.exempt
+@require_auth
+def complete_upload_session(upload_id):
+    """
+    Finish a resumable upload once every byte is received (Requires authentication)
+    
+    The staged file is moved into the blob store (no copy). Returns the attachment
+    metadata, like POST /uploads; repeating the call returns the same attachment.
+    """
+    user = get_current_user()
+    try:
+        session = upload_sessions.get(upload_id, user['uid'])
+        blob = upload_sessions.finalize(upload_id, user['uid'])
+    except UploadSessionError as e:
+        return upload_session_error(e)
+    
+    attachment = attachment_from_blob(blob, session['filename'])
+    queue_media_processing([attachment])
+    attachment['upload_time'] = datetime.now().isoformat() + 'Z'
+    return jsonify(attachment), 200 if session['status'] == 'completed' else 201
+
 # ============================================================================
 # HEALTH CHECK & STATUS PAGE (Public)
 # ============================================================================
@@ -1554,6 +2092,27 @@ def handle_current_user():
             'user': updated_user
         })
 
+@app.route('/users/online', methods=['GET'])
+@csrf.exempt
+@require_auth
+def list_online_users():
+    """
+    Users currently online (served from memory, no database access)
+    
+    Query Parameters:
+    - user_ids: Comma-separated Firebase UIDs to check (default: everyone online)
+    """
+    ensure_user_exists(get_current_user())
+    user_ids = request.args.get('user_ids')
+    user_ids = [uid for uid in user_ids.split(',') if uid] if user_ids else None
+    
+    online = presence.online_users(user_ids)
+    return jsonify({
+        'users': online,
+        'total_count': len(online),
+        'online_window_seconds': presence.online_window
+    })
+
 @app.route('/users/<firebase_uid>', methods=['GET'])
 @csrf.exempt
 @require_auth
@@ -1564,6 +2123,9 @@ def get_user(firebase_uid):
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
+    # The database copy of last_seen lags behind the presence buffer
+    user['last_seen'] = max(filter(None, (user.get('last_seen'), presence.last_seen(firebase_uid))), default=None)
+    
     return jsonify({
         'user': user
     })
@@ -1593,4 +2155,12 @@ if __name__ == '__main__':
     api_host = os.getenv('API_HOST', '0.0.0.0')
     api_port = int(os.getenv('API_PORT', 5001))
     
-    app.run(debug=debug_mode, host=api_host, port=api_port)
+    # WebSocket gateway shares this process (event hub, db pool); with the debug
+    # reloader only start it in the child process that serves requests
+    if not debug_mode or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        ws_gateway.start_gateway()
+        # Dispatch media jobs queued before the last shutdown right away
+        media_pipeline.start()
+    
+    # threaded: each open /messages/stream connection occupies a worker thread
+    app.run(debug=debug_mode, host=api_host, port=api_port, threaded=True)
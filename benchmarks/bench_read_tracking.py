@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Read tracking benchmark
+Compares the legacy per-message read rows (message_read_status) with per-conversation
+read cursors (conversation_read_cursors) and the unread counters maintained on top of
+them (conversation_unread_counters) on the same message history: unread counts,
+mark-as-read and the number of rows each model stores.
+
+Usage:
+    python3 benchmarks/bench_read_tracking.py [--messages 10000000] [--conversations 1000] [--unread 20]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from db import MessagingDatabase  # noqa: E402
+
+CHUNK = 100000
+
+
+def seed(db, conversations: int, messages: int, unread: int):
+    """
+    Two-party conversations with alternating senders. Each participant has read
+    everything from the other side except the newest `unread` messages, stored
+    both as legacy read rows and as a read cursor.
+    """
+    per_conversation = messages // conversations
+    with db.connection() as conn:
+        # Bulk load without the per-row triggers, then put them back
+        triggers = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name IN "
+            "('messages', 'message_read_status', 'conversation_read_cursors', 'conversations')")]
+        for name in triggers:
+            conn.execute(f'DROP TRIGGER {name}')
+        conn.execute("INSERT INTO threads (id, title, created_by) VALUES ('bench', 'Bench', 'client')")
+        conn.executemany('''
+            INSERT INTO conversations (id, thread_id, participant1_id, participant1_name,
+                                       participant2_id, participant2_name)
+            VALUES (?, 'bench', 'client', 'Client', ?, 'Influencer')
+        ''', [(f'c{i}', f'influencer{i}') for i in range(conversations)])
+
+        def message_rows():
+            for i in range(conversations):
+                for seq in range(1, per_conversation + 1):
+                    sender = 'client' if seq % 2 else f'influencer{i}'
+                    yield (f'c{i}m{seq}', f'c{i}', sender, f'message {seq}',
+                           f'2025-01-01T00:00:00.{seq:07d}Z', seq)
+
+        def read_rows():
+            for i in range(conversations):
+                for seq in range(1, per_conversation - unread + 1):
+                    reader = f'influencer{i}' if seq % 2 else 'client'
+                    yield (f'c{i}m{seq}', reader)
+
+        def chunks(rows):
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == CHUNK:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+        for chunk in chunks(message_rows()):
+            conn.executemany('''
+                INSERT INTO messages (id, conversation_id, thread_id, sender_id, sender_type,
+                                      sender_name, type, content, timestamp, msg_seq)
+                VALUES (?, ?, 'bench', ?, 'client', 'Bench', 'text', ?, ?, ?)
+            ''', chunk)
+        for chunk in chunks(read_rows()):
+            conn.executemany('INSERT INTO message_read_status (message_id, user_id) VALUES (?, ?)', chunk)
+        conn.executemany('''
+            INSERT INTO conversation_read_cursors (conversation_id, user_id, last_read_seq)
+            VALUES (?, ?, ?)
+        ''', [(f'c{i}', user, per_conversation - unread)
+              for i in range(conversations) for user in ('client', f'influencer{i}')])
+        db._backfill_unread_counters(conn.cursor())
+        conn.commit()
+    db._create_triggers()
+    return per_conversation
+
+
+def legacy_unread_count(conn, conversation_id: str, user_id: str) -> int:
+    """Unread count as computed before read cursors"""
+    return conn.execute('''
+        SELECT COUNT(*) FROM messages m
+        WHERE m.conversation_id = ? AND m.sender_id != ? AND m.deleted = FALSE
+          AND m.id NOT IN (SELECT message_id FROM message_read_status WHERE user_id = ?)
+    ''', (conversation_id, user_id, user_id)).fetchone()[0]
+
+
+def legacy_mark_as_read(conn, conversation_id: str, user_id: str) -> int:
+    """mark_messages_as_read as implemented before read cursors"""
+    unread = [row[0] for row in conn.execute('''
+        SELECT m.id FROM messages m
+        WHERE m.conversation_id = ? AND m.sender_id != ? AND m.deleted = FALSE
+          AND m.id NOT IN (SELECT message_id FROM message_read_status WHERE user_id = ?)
+    ''', (conversation_id, user_id, user_id))]
+    for message_id in unread:
+        conn.execute('INSERT OR IGNORE INTO message_read_status (message_id, user_id) VALUES (?, ?)',
+                     (message_id, user_id))
+    conn.commit()
+    return len(unread)
+
+
+def timed(fn, samples) -> dict:
+    latencies = []
+    for args in samples:
+        started = time.perf_counter()
+        fn(*args)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {'mean': statistics.mean(latencies), 'p95': latencies[int(len(latencies) * 0.95) - 1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10000000)
+    parser.add_argument('--conversations', type=int, default=1000)
+    parser.add_argument('--unread', type=int, default=20, help='unread messages per participant')
+    parser.add_argument('--samples', type=int, default=20, help='conversations measured per operation')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_read_tracking_')
+    db = MessagingDatabase(os.path.join(workdir, 'messaging.db'))
+    started = time.monotonic()
+    per_conversation = seed(db, args.conversations, args.messages, args.unread)
+    print(f"Seeded {per_conversation * args.conversations} messages in {args.conversations} conversations "
+          f"({time.monotonic() - started:.0f}s)\n")
+
+    samples = min(args.samples, args.conversations)
+    with db.connection() as conn:
+        read_rows = conn.execute('SELECT COUNT(*) FROM message_read_status').fetchone()[0]
+        cursor_rows = conn.execute('SELECT COUNT(*) FROM conversation_read_cursors').fetchone()[0]
+        counter_rows = conn.execute('SELECT COUNT(*) FROM conversation_unread_counters').fetchone()[0]
+        cursor_count = timed(lambda c: db._count_unread(conn, c, 'client', db._read_cursor(conn, c, 'client')),
+                             [(f'c{i}',) for i in range(samples)])
+        legacy_count = timed(lambda c: legacy_unread_count(conn, c, 'client'),
+                             [(f'c{i}',) for i in range(samples)])
+        legacy_mark = timed(lambda c: legacy_mark_as_read(conn, c, 'client'),
+                            [(f'c{i}',) for i in range(samples)])
+    counter_count = timed(lambda c: db.get_unread_count_for_user(c, 'client'), [(f'c{i}',) for i in range(samples)])
+    cursor_mark = timed(lambda c: db.mark_messages_as_read(c, 'client'), [(f'c{i}',) for i in range(samples)])
+    db.close()
+
+    print('| Model | Rows stored | Unread count mean / p95 (ms) | Mark as read mean / p95 (ms) |')
+    print('|---|---|---|---|')
+    print(f"| message_read_status | {read_rows} | {legacy_count['mean']:.2f} / {legacy_count['p95']:.2f} | "
+          f"{legacy_mark['mean']:.2f} / {legacy_mark['p95']:.2f} |")
+    print(f"| conversation_read_cursors | {cursor_rows} | {cursor_count['mean']:.2f} / {cursor_count['p95']:.2f} | "
+          f"{cursor_mark['mean']:.2f} / {cursor_mark['p95']:.2f} |")
+    print(f"| + conversation_unread_counters | {counter_rows} | "
+          f"{counter_count['mean']:.2f} / {counter_count['p95']:.2f} | (included above) |")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Storage profile benchmark
+Runs a mixed read/write messaging workload against each DB_STORAGE_PROFILE preset
+and prints throughput plus "database is locked" errors per profile.
+
+Usage:
+    python3 benchmarks/bench_storage_profiles.py [--duration 10] [--writers 4] [--readers 8]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from db import MessagingDatabase  # noqa: E402
+from db_storage import STORAGE_PROFILES  # noqa: E402
+
+
+def seed(db, conversations: int, messages_per_conversation: int):
+    """Create one thread with N two-party conversations and some history"""
+    db.create_or_update_user({'firebase_uid': 'bench_client', 'email': 'client@bench.local',
+                              'display_name': 'Client', 'role': 'client'})
+    thread_id = db.create_thread({'title': 'Bench', 'campaign_id': 'bench', 'created_by': 'bench_client'})
+    conversation_ids = []
+    for i in range(conversations):
+        influencer_id = f'bench_influencer_{i}'
+        db.create_or_update_user({'firebase_uid': influencer_id, 'email': f'inf{i}@bench.local',
+                                  'display_name': f'Influencer {i}', 'role': 'influencer'})
+        conversation_ids.append(db.get_or_create_conversation(
+            thread_id, 'bench_client', influencer_id, 'Client', f'Influencer {i}'))
+
+    with db.connection() as conn:
+        rows = []
+        for conversation_id in conversation_ids:
+            for j in range(messages_per_conversation):
+                rows.append((f"m{uuid.uuid4().hex[:12]}", conversation_id, thread_id, 'bench_client', 'client',
+                             'Client', 'text', f'seed {j}', f'seed {j}', f'2025-01-01T00:{j // 60:02d}:{j % 60:02d}Z'))
+        conn.executemany('''
+            INSERT INTO messages (id, conversation_id, thread_id, sender_id, sender_type, sender_name,
+                                  type, content, text_content, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+    return thread_id, conversation_ids
+
+
+def run_profile(profile: str, duration: float, writers: int, readers: int,
+                conversations: int, history: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f'bench_{profile}_')
+    db = MessagingDatabase(os.path.join(workdir, 'messaging.db'), storage_profile=profile)
+    thread_id, conversation_ids = seed(db, conversations, history)
+
+    counters = {'reads': 0, 'writes': 0, 'locked': 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def count(key):
+        with lock:
+            counters[key] += 1
+
+    def writer(n):
+        i = 0
+        while not stop.is_set():
+            conversation_id = conversation_ids[(n + i) % len(conversation_ids)]
+            try:
+                db.create_message({
+                    'conversation_id': conversation_id, 'thread_id': thread_id,
+                    'sender_id': f'bench_influencer_{n % conversations}', 'sender_type': 'influencer',
+                    'sender_name': 'Influencer', 'type': 'text', 'content': f'load {i}',
+                    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S') + f'.{i:06d}Z'
+                })
+                count('writes')
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                count('locked')
+            i += 1
+
+    def reader(n):
+        i = 0
+        while not stop.is_set():
+            conversation_id = conversation_ids[(n + i) % len(conversation_ids)]
+            try:
+                # The same per-conversation reads GET /messages/threads performs
+                db.get_conversations_by_thread(thread_id, user_id='bench_client')
+                db.get_last_message(conversation_id)
+                db.get_unread_count_for_user(conversation_id, 'bench_client')
+                count('reads')
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                count('locked')
+            i += 1
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+    db.close()
+
+    return {
+        'profile': profile,
+        'reads_per_sec': counters['reads'] / elapsed,
+        'writes_per_sec': counters['writes'] / elapsed,
+        'locked_errors': counters['locked']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per profile')
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--conversations', type=int, default=20)
+    parser.add_argument('--history', type=int, default=500, help='seed messages per conversation')
+    parser.add_argument('--profiles', default=','.join(STORAGE_PROFILES))
+    args = parser.parse_args()
+
+    print(f"{args.writers} writers / {args.readers} readers, {args.duration:.0f}s per profile, "
+          f"{args.conversations} conversations x {args.history} seed messages\n")
+    print('| Profile | Reads/s (thread-list reads) | Writes/s (create_message) | "database is locked" |')
+    print('|---|---|---|---|')
+    for profile in args.profiles.split(','):
+        result = run_profile(profile, args.duration, args.writers, args.readers,
+                             args.conversations, args.history)
+        print(f"| {result['profile']} | {result['reads_per_sec']:.0f} | "
+              f"{result['writes_per_sec']:.0f} | {result['locked_errors']} |")
+
+
+if __name__ == '__main__':
+    main()
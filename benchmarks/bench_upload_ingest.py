@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Upload ingest benchmark
+Posts the same multipart upload through three ingest paths and reports throughput,
+peak RSS and bytes read/written by the process:
+
+- legacy: werkzeug spools the part to a temporary file, file.save() copies it to
+  the upload folder, os.path.getsize() and a reopen for the dimension probe follow
+  (process_file_upload before the blob store)
+- spooled put: werkzeug spools the part, blob_store.put() reads the spool once while
+  hashing and writing the blob (blob store without streaming ingest)
+- streaming ingest: upload_ingest writes the part straight into the blob store while
+  hashing, sizing and sniffing it; the blob is renamed into place
+
+Each path runs in a fresh process so peak RSS is its own.
+
+Usage:
+    python3 benchmarks/bench_upload_ingest.py [--size-mb 100] [--runs 3]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+MODES = ('legacy', 'spooled', 'streaming')
+BOUNDARY = 'benchboundary'
+CHUNK = 1024 * 1024
+
+
+def write_body(path: str, size: int) -> int:
+    """Multipart body with one file part of `size` random bytes; returns its length"""
+    with open(path, 'wb') as body:
+        body.write(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="video.mp4"\r\n'
+                   f'Content-Type: video/mp4\r\n\r\n'.encode())
+        # MP4 signature, so the sniffer has something to recognise
+        body.write(b'\x00\x00\x00\x18ftypmp42')
+        remaining = size - 12
+        while remaining > 0:
+            body.write(os.urandom(min(CHUNK, remaining)))
+            remaining -= CHUNK
+        body.write(f'\r\n--{BOUNDARY}--\r\n'.encode())
+        return body.tell()
+
+
+def process_io() -> dict:
+    """Bytes read/written through syscalls by this process (Linux /proc/self/io)"""
+    try:
+        with open('/proc/self/io') as io_stats:
+            values = dict(line.split(': ') for line in io_stats.read().splitlines())
+        return {'read': int(values['rchar']), 'written': int(values['wchar'])}
+    except (OSError, KeyError, ValueError):
+        return {'read': 0, 'written': 0}
+
+
+def worker(mode: str, body_path: str, workdir: str):
+    """Run one upload through `mode` in this process and print its measurements as JSON"""
+    os.environ['BLOB_STORE_PATH'] = os.path.join(workdir, 'blobs')
+    from flask import Flask, request, jsonify
+    from blob_store import BlobStore
+    from db import MessagingDatabase
+    from upload_ingest import IngestStream, ingest_request_class
+
+    store = BlobStore(os.path.join(workdir, 'blobs'), db=MessagingDatabase(os.path.join(workdir, 'bench.db')))
+    upload_folder = os.path.join(workdir, 'uploads')
+    os.makedirs(upload_folder, exist_ok=True)
+
+    app = Flask(__name__)
+    if mode == 'streaming':
+        app.request_class = ingest_request_class(store=store)
+
+    @app.route('/upload', methods=['POST'])
+    def upload():
+        file = request.files['file']
+        if mode == 'legacy':
+            path = os.path.join(upload_folder, file.filename)
+            file.save(path)
+            size = os.path.getsize(path)
+            with open(path, 'rb') as probe:
+                probe.read(CHUNK)
+            return jsonify({'size': size})
+        if mode == 'spooled':
+            blob = store.put(file.stream)
+        else:
+            stream = file.stream
+            assert isinstance(stream, IngestStream)
+            blob = store.adopt(stream.detach(), stream.sha256, stream.size)
+        return jsonify({'size': blob['size']})
+
+    client = app.test_client()
+    body_size = os.path.getsize(body_path)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    io_before = process_io()
+    with open(body_path, 'rb') as body:
+        started = time.perf_counter()
+        response = client.post('/upload', input_stream=body, content_length=body_size,
+                               content_type=f'multipart/form-data; boundary={BOUNDARY}')
+        elapsed = time.perf_counter() - started
+    io_after = process_io()
+    assert response.status_code == 200, response.data
+    print(json.dumps({
+        'seconds': elapsed,
+        'size': response.get_json()['size'],
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'base_rss_kb': base_rss,
+        'read': io_after['read'] - io_before['read'],
+        'written': io_after['written'] - io_before['written']
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=100)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--worker', nargs=3, metavar=('MODE', 'BODY', 'WORKDIR'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(*args.worker)
+        return
+
+    tmpdir = tempfile.mkdtemp(prefix='bench_upload_ingest_')
+    body_path = os.path.join(tmpdir, 'body.multipart')
+    size = args.size_mb * 1024 * 1024
+    write_body(body_path, size)
+    print(f"{args.size_mb}MB upload, {args.runs} runs per path\n")
+
+    results = {}
+    try:
+        for mode in MODES:
+            runs = []
+            for run in range(args.runs):
+                workdir = os.path.join(tmpdir, f'{mode}{run}')
+                os.makedirs(workdir)
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', mode, body_path, workdir],
+                                        check=True, capture_output=True, text=True).stdout
+                runs.append(json.loads(output.strip().splitlines()[-1]))
+                shutil.rmtree(workdir)
+            results[mode] = runs
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    mb = size / (1024 * 1024)
+    print('| Path | MB/s (median) | Peak RSS (MB) | RSS growth (MB) | Read (MB) | Written (MB) |')
+    print('|---|---|---|---|---|---|')
+    for mode, runs in results.items():
+        throughput = statistics.median(mb / run['seconds'] for run in runs)
+        peak = max(run['peak_rss_kb'] for run in runs) / 1024
+        growth = max(run['peak_rss_kb'] - run['base_rss_kb'] for run in runs) / 1024
+        read = statistics.median(run['read'] for run in runs) / (1024 * 1024)
+        written = statistics.median(run['written'] for run in runs) / (1024 * 1024)
+        print(f"| {mode} | {throughput:.0f} | {peak:.1f} | {growth:.1f} | {read:.0f} | {written:.0f} |")
+
+
+if __name__ == '__main__':
+    main()
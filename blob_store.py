@@ -0,0 +1,236 @@
+"""
+Blob Store Module
+Content-addressed storage for uploaded files: one copy per distinct content,
+named by its SHA-256 and referenced from message attachments
+"""
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from db import get_db
+from logger_config import logger
+
+# Root of the blob tree (blobs live in <root>/<aa>/<bb>/<sha256>)
+BLOB_STORE_PATH = os.getenv('BLOB_STORE_PATH', os.path.join(os.getenv('UPLOAD_FOLDER', 'uploads'), 'blobs'))
+# Unreferenced blobs (uploaded but never sent, or whose messages were all deleted)
+# are kept this long after their last upload before garbage collection (seconds)
+BLOB_GC_GRACE = int(os.getenv('BLOB_GC_GRACE', 86400))
+# Read/hash/write chunk size (bytes)
+BLOB_CHUNK_SIZE = 1024 * 1024
+
+
+def is_sha256(value: str) -> bool:
+    """Whether value is a lowercase hex SHA-256 (safe to use as a blob path)"""
+    return len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+
+class BlobStore:
+    """
+    Files stored under the SHA-256 of their content.
+
+    put() streams an upload into a temporary file while hashing it, fsyncs it and
+    moves it to its content address, so a file is read once, never held in
+    memory, and is durable when put() returns (media probing happens later, see
+    media_pipeline).
+    If the content is already stored the temporary copy is dropped: a duplicate
+    upload (or a forward of a message with attachments) only adds metadata.
+    Blobs are immutable, so their URLs can be cached forever. Files derived from
+    a blob (thumbnails.py) live in <blob path>.variants/ and share its lifetime.
+
+    The blobs table holds each blob's size, probed metadata (dimensions etc.) and
+    ref_count, which triggers on messages keep equal to the number of live
+    message attachments pointing at it; collect_garbage() removes blobs that
+    have been unreferenced for longer than the grace period.
+    """
+
+    def __init__(self, root: str = BLOB_STORE_PATH, db=None, gc_grace: int = BLOB_GC_GRACE):
+        self.root = root
+        self._db = db
+        self.gc_grace = gc_grace
+        self._tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        # Resumable uploads are staged here, on the same filesystem as the blobs
+        # so finishing one is a rename (see upload_sessions.py)
+        self.staging_dir = os.path.join(root, 'staging')
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._uploads = 0
+        self._duplicates = 0
+        self._bytes_received = 0
+
+    @property
+    def db(self):
+        return self._db or get_db()
+
+    def path(self, sha256: str) -> str:
+        """Filesystem path of a blob (sharded by the first two byte pairs)"""
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.isfile(self.path(sha256))
+
+    def variant_path(self, sha256: str, name: str) -> str:
+        """Path of a derived file (thumbnail, poster) kept beside the blob"""
+        return f"{self.path(sha256)}.variants{os.sep}{name}"
+
+    def put(self, stream) -> Dict:
+        """
+        Store the content of a readable binary stream
+
+        Args:
+            stream: File-like object (e.g. werkzeug FileStorage.stream)
+
+        Returns:
+            Blob row (sha256, size, metadata, ref_count, ...) plus `duplicate`
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = stream.read(BLOB_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return self.adopt(tmp_path, digest.hexdigest(), size)
+
+    def adopt(self, path: str, sha256: str, size: int) -> Dict:
+        """
+        Store a complete, durable file whose hash is known by renaming it to its
+        content address (no copy). The file is consumed: moved into place, or
+        deleted if the content is already stored.
+
+        Args:
+            path: File on the blob store's filesystem (its tmp or staging directory)
+            sha256: Hash of the file's content
+            size: File size in bytes
+
+        Returns:
+            Blob row (sha256, size, metadata, ref_count, ...) plus `duplicate`
+        """
+        try:
+            # Register first: a re-upload refreshes last_uploaded_at, which keeps
+            # collect_garbage away from the file we are about to rely on. A new
+            # row means any file still at the address belongs to a blob that
+            # collect_garbage has already deleted, so ours always replaces it
+            blob, created = self.db.register_blob(sha256, size)
+            final_path = self.path(sha256)
+            duplicate = not created and os.path.isfile(final_path)
+            if duplicate:
+                os.unlink(path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(path, final_path)
+        except BaseException:
+            if os.path.exists(path):
+                os.unlink(path)
+            raise
+
+        with self._lock:
+            self._uploads += 1
+            self._duplicates += 1 if duplicate else 0
+            self._bytes_received += size
+        blob['duplicate'] = duplicate
+        if duplicate:
+            logger.debug(f"Upload deduplicated against blob {sha256} ({size} bytes)")
+        return blob
+
+    def get(self, sha256: str) -> Optional[Dict]:
+        """Blob row of stored content, or None if unknown or its file is missing"""
+        blob = self.db.get_blob(sha256)
+        if not blob or not self.exists(sha256):
+            return None
+        return blob
+
+    def pin(self, sha256: str):
+        """Keep stored content regardless of message references (its URL was handed out on its own)"""
+        self.db.pin_blob(sha256)
+
+    def collect_garbage(self) -> int:
+        """Delete blobs unreferenced for longer than the grace period; returns the number removed"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=self.gc_grace)).strftime('%Y-%m-%d %H:%M:%S')
+        removed = 0
+        while True:
+            deleted = self.db.delete_unreferenced_blobs(cutoff)
+            for sha256 in deleted:
+                if self._remove_file(sha256):
+                    removed += 1
+            if len(deleted) < 1000:
+                break
+        if removed:
+            logger.info(f"Removed {removed} unreferenced blobs")
+        return removed
+
+    def _remove_file(self, sha256: str) -> bool:
+        """
+        Remove the file of a blob whose row collect_garbage has deleted
+
+        The same content may be uploaded again meanwhile (adopt() then registers a
+        new row and moves its copy into place), so the file is moved aside first
+        and only deleted if the row is still gone; otherwise it is put back.
+
+        Returns:
+            Whether a file was deleted
+        """
+        final_path = self.path(sha256)
+        aside_path = os.path.join(self._tmp_dir, f"{sha256}.gc")
+        try:
+            os.replace(final_path, aside_path)
+        except FileNotFoundError:
+            aside_path = None
+
+        if self.db.get_blob(sha256):
+            if aside_path:
+                if os.path.isfile(final_path):
+                    os.unlink(aside_path)
+                else:
+                    os.replace(aside_path, final_path)
+            return False
+
+        shutil.rmtree(f"{final_path}.variants", ignore_errors=True)
+        if not aside_path:
+            return False
+        os.unlink(aside_path)
+        return True
+
+    def stats(self) -> Dict:
+        """Store metrics snapshot"""
+        with self._lock:
+            stats = {
+                'root': self.root,
+                'uploads': self._uploads,
+                'duplicate_uploads': self._duplicates,
+                'bytes_received': self._bytes_received
+            }
+        stats.update(self.db.get_blob_stats())
+        return stats
+
+
+# Global blob store
+blob_store = BlobStore()
+
+
+if __name__ == '__main__':
+    # python3 blob_store.py gc   - remove unreferenced blobs past the grace period
+    # python3 blob_store.py stats
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    if command == 'gc':
+        print(f"Removed {blob_store.collect_garbage()} blobs")
+    else:
+        for key, value in blob_store.stats().items():
+            print(f"{key}: {value}")
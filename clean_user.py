@@ -41,8 +41,8 @@ def clean_user(email):
         cursor.execute('SELECT COUNT(*) as count FROM threads WHERE created_by = ?', (user['firebase_uid'],))
         thread_count = cursor.fetchone()['count']
         
-        cursor.execute('SELECT COUNT(*) as count FROM conversations WHERE participant1_id = ? OR participant2_id = ?', 
-                      (user['firebase_uid'], user['firebase_uid']))
+        cursor.execute('SELECT COUNT(*) as count FROM conversation_members WHERE user_id = ?', 
+                      (user['firebase_uid'],))
         conv_count = cursor.fetchone()['count']
         
         cursor.execute('SELECT COUNT(*) as count FROM messages WHERE sender_id = ?', (user['firebase_uid'],))
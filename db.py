@@ -1,16 +1,67 @@
 import sqlite3
+import atexit
+import base64
+import html
+import json
+import re
+import threading
+import time
 from logger_config import logger
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import uuid
+from db_pool import ConnectionPool, DB_POOL_SIZE
+from db_storage import get_storage_profile, apply_storage_profile
 
 
 class MessagingDatabase:
-    def __init__(self, db_path="messaging.db"):
+    # Admin stats counters: name -> (table, one row's contribution, columns it depends on).
+    # Triggers add a row's contribution on insert, subtract it on delete and apply the
+    # difference when one of those columns is updated ({row} is NEW or OLD).
+    _STATS_COUNTERS = {
+        'total_users': ('users', '1', ()),
+        'total_threads': ('threads', "{row}.status = 'active'", ('status',)),
+        'total_conversations': ('conversations', "{row}.status = 'active'", ('status',)),
+        'unread_messages': ('conversation_unread_counters', '{row}.unread_count', ('unread_count',)),
+        'total_messages': ('messages', '{row}.deleted = FALSE', ('deleted',)),
+        'messages_with_attachments': ('messages', '{row}.deleted = FALSE AND {row}.has_attachment = TRUE',
+                                      ('deleted', 'has_attachment')),
+    }
+
+    # Space-separated original file names of a message's attachments ({row} is the row alias)
+    _FTS_ATTACHMENT_NAMES = '''
+        (SELECT group_concat(json_extract(a.value, '$.original_filename'), ' ')
+         FROM json_each(CASE WHEN json_valid({row}.attachments) THEN {row}.attachments ELSE '[]' END) a
+         WHERE a.type = 'object')
+    '''
+
+    # Parent columns derived from their messages by triggers. Updating only these
+    # does not re-stamp the parent for delta sync: the messages that caused the
+    # update are synced themselves, so a busy conversation is not re-sent per message.
+    _SYNC_DERIVED_COLUMNS = {
+        'threads': ('updated_at',),
+        'conversations': ('last_message', 'last_message_time', 'unread_count', 'updated_at'),
+    }
+
+    # sha256 of every blob a message's attachments reference, one row per attachment
+    _ATTACHMENT_BLOBS = '''
+        SELECT json_extract(a.value, '$.sha256') AS sha256
+        FROM json_each(CASE WHEN json_valid({row}.attachments) THEN {row}.attachments ELSE '[]' END) a
+        WHERE a.type = 'object' AND json_extract(a.value, '$.sha256') IS NOT NULL
+    '''
+
+    def __init__(self, db_path="messaging.db", storage_profile: str = None):
         self.db_path = db_path
+        self.storage_profile = get_storage_profile(storage_profile)
+        # An in-memory database only exists on the connection that created it
+        pool_size = 1 if db_path == ':memory:' else DB_POOL_SIZE
+        self._pool = ConnectionPool(self._open_connection, max_size=pool_size)
+        # Full-text search needs SQLite built with FTS5 (set by _create_tables)
+        self.fts_enabled = False
         self._create_tables()
-        self._create_triggers()
         self._migrate_db()
+        self._create_triggers()
+        self._start_checkpointer()
     
     def _migrate_db(self):
         """Run database migrations to add missing columns"""
@@ -41,16 +92,285 @@ class MessagingDatabase:
             if 'participant_type' not in conv_columns:
                 cursor.execute('ALTER TABLE conversations ADD COLUMN participant_type TEXT')
                 logger.info("Added participant_type column to conversations table")
+            
+            # Delta sync: change_seq on every synced table (existing rows start at 0)
+            for table in ('threads', 'conversations', 'messages', 'message_read_status',
+                          'conversation_read_cursors'):
+                cursor.execute(f"PRAGMA table_info({table})")
+                table_columns = [col[1] for col in cursor.fetchall()]
+                if 'change_seq' not in table_columns:
+                    cursor.execute(f'ALTER TABLE {table} ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0')
+                    logger.info(f"Added change_seq column to {table} table")
+                cursor.execute(f'''
+                    CREATE INDEX IF NOT EXISTS idx_{table}_change_seq
+                    ON {table}(change_seq)
+                ''')
+            
+            # Blobs: pinned marks standalone uploads kept regardless of messages (see pin_blob)
+            cursor.execute("PRAGMA table_info(blobs)")
+            if 'pinned' not in [col[1] for col in cursor.fetchall()]:
+                cursor.execute('ALTER TABLE blobs ADD COLUMN pinned BOOLEAN NOT NULL DEFAULT FALSE')
+                logger.info("Added pinned column to blobs table")
+            
+            # Media jobs: claimed_at leases running jobs (see requeue_running_media_jobs)
+            cursor.execute("PRAGMA table_info(media_jobs)")
+            if 'claimed_at' not in [col[1] for col in cursor.fetchall()]:
+                cursor.execute('ALTER TABLE media_jobs ADD COLUMN claimed_at REAL')
+                logger.info("Added claimed_at column to media_jobs table")
+            
+            # Read cursors: number messages per conversation, then fold the
+            # per-message read rows into one cursor per (conversation, user)
+            if 'msg_seq' not in columns:
+                cursor.execute('ALTER TABLE messages ADD COLUMN msg_seq INTEGER')
+                logger.info("Added msg_seq column to messages table")
+                self._backfill_read_cursors(cursor)
+            # Unread counts are range counts over this index (see _count_unread)
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_messages_conversation_seq
+                ON messages(conversation_id, msg_seq, sender_id, deleted)
+            ''')
+            
+            # Search index: filled once before _create_triggers adds its triggers
+            if self.fts_enabled:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'messages_fts_on_insert'")
+                if not cursor.fetchone():
+                    cursor.execute('DELETE FROM messages_fts')
+                    cursor.execute(f'''
+                        INSERT INTO messages_fts (rowid, text_content, caption, attachment_names)
+                        SELECT m.rowid, m.text_content, m.caption, {self._FTS_ATTACHMENT_NAMES.format(row='m')}
+                        FROM messages m
+                        WHERE m.deleted = FALSE
+                    ''')
+                    logger.info(f"Indexed {cursor.rowcount} messages for search")
+            
+            # Stats counters start from a full count; their triggers keep them current
+            self._init_stats_counters(cursor)
+            
+            # Conversation members: fill from the participant columns once
+            cursor.execute('SELECT 1 FROM conversation_members LIMIT 1')
+            if not cursor.fetchone():
+                self._add_conversation_members(cursor)
+                cursor.execute('SELECT COUNT(*) FROM conversation_members')
+                logger.info(f"Initialised {cursor.fetchone()[0]} conversation members")
+            
+            # Unread counters are kept up to date by triggers from the moment those
+            # exist; fill them once before _create_triggers adds them
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'messages_unread_on_insert'")
+            if not cursor.fetchone():
+                self._backfill_unread_counters(cursor)
+            
+            # Counter triggers used to find members through the participant columns;
+            # drop them so _create_triggers recreates them on conversation_members
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'conversations_unread_on_join'")
+            if cursor.fetchone():
+                cursor.execute('DROP TRIGGER conversations_unread_on_join')
+                cursor.execute('DROP TRIGGER IF EXISTS messages_unread_on_insert')
+                logger.info("Moved unread counter triggers to conversation_members")
+            
+            # Parent change_seq triggers used to fire on any update, re-sending a thread
+            # and conversation with every new message; _create_triggers recreates them
+            # limited to the parents' own columns
+            for table in self._SYNC_DERIVED_COLUMNS:
+                cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                               (f'{table}_change_seq_on_update',))
+                row = cursor.fetchone()
+                if row and 'UPDATE OF' not in row[0]:
+                    cursor.execute(f'DROP TRIGGER {table}_change_seq_on_update')
+                    logger.info(f"Limited {table} change_seq trigger to its own columns")
                 
             conn.commit()
         finally:
             conn.close()
     
-    def get_connection(self):
-        """Get database connection with row factory"""
-        conn = sqlite3.connect(self.db_path)
+    def _backfill_read_cursors(self, cursor):
+        """
+        One-off migration from message_read_status to conversation_read_cursors.
+
+        Existing messages get msg_seq 1..n per conversation in (timestamp, id)
+        order. A reader's cursor is placed just before the first message from
+        someone else they had not read, so nothing that was unread becomes read
+        (read rows past a gap are conservatively treated as unread again).
+        """
+        # Renumbering is not a content change; keep it out of the delta sync
+        # (_create_triggers recreates the trigger right after the migration)
+        cursor.execute('DROP TRIGGER IF EXISTS messages_change_seq_on_update')
+        changes_before = cursor.connection.total_changes
+        cursor.execute('''
+            WITH numbered AS (
+                SELECT rowid AS message_rowid,
+                       ROW_NUMBER() OVER (PARTITION BY conversation_id ORDER BY timestamp, id) AS seq
+                FROM messages
+            )
+            UPDATE messages
+            SET msg_seq = numbered.seq
+            FROM numbered
+            WHERE numbered.message_rowid = messages.rowid
+        ''')
+        logger.info(f"Numbered {cursor.connection.total_changes - changes_before} existing messages")
+
+        cursor.execute('''
+            WITH readers AS (
+                SELECT m.conversation_id, r.user_id, MAX(r.read_at) AS read_at
+                FROM message_read_status r
+                INNER JOIN messages m ON m.id = r.message_id
+                GROUP BY m.conversation_id, r.user_id
+            ),
+            first_unread AS (
+                SELECT rd.conversation_id, rd.user_id, MIN(m.msg_seq) AS msg_seq
+                FROM readers rd
+                INNER JOIN messages m
+                        ON m.conversation_id = rd.conversation_id
+                       AND m.sender_id != rd.user_id
+                       AND m.deleted = FALSE
+                LEFT JOIN message_read_status r
+                       ON r.message_id = m.id AND r.user_id = rd.user_id
+                WHERE r.message_id IS NULL
+                GROUP BY rd.conversation_id, rd.user_id
+            )
+            INSERT OR IGNORE INTO conversation_read_cursors (conversation_id, user_id, last_read_seq, read_at)
+            SELECT rd.conversation_id, rd.user_id,
+                   COALESCE(fu.msg_seq - 1,
+                            (SELECT MAX(msg_seq) FROM messages WHERE conversation_id = rd.conversation_id)),
+                   rd.read_at
+            FROM readers rd
+            LEFT JOIN first_unread fu
+                   ON fu.conversation_id = rd.conversation_id AND fu.user_id = rd.user_id
+        ''')
+        cursor.execute('SELECT COUNT(*) FROM conversation_read_cursors')
+        logger.info(f"Folded message_read_status into {cursor.fetchone()[0]} read cursors")
+
+    def _backfill_unread_counters(self, cursor):
+        """Compute every member's unread count from the read cursors (one-off migration)"""
+        cursor.execute('''
+            INSERT OR REPLACE INTO conversation_unread_counters (user_id, conversation_id, thread_id, unread_count)
+            SELECT member.user_id, c.id, c.thread_id,
+                   (SELECT COUNT(*) FROM messages m
+                    WHERE m.conversation_id = c.id
+                      AND m.sender_id != member.user_id
+                      AND m.deleted = FALSE
+                      AND m.msg_seq > COALESCE((SELECT r.last_read_seq FROM conversation_read_cursors r
+                                                WHERE r.conversation_id = c.id
+                                                  AND r.user_id = member.user_id), 0))
+            FROM conversation_members member
+            INNER JOIN conversations c ON c.id = member.conversation_id
+        ''')
+        cursor.execute('SELECT COUNT(*) FROM conversation_unread_counters')
+        logger.info(f"Initialised {cursor.fetchone()[0]} unread counters")
+
+    def _init_stats_counters(self, cursor):
+        """Count every stats counter that has no row yet (runs before _create_triggers)"""
+        cursor.execute('SELECT name FROM stats_counters')
+        existing = {row[0] for row in cursor.fetchall()}
+        for name, (table, contribution, _) in self._STATS_COUNTERS.items():
+            if name in existing:
+                continue
+            cursor.execute(f'''
+                INSERT OR IGNORE INTO stats_counters (name, value)
+                SELECT ?, COALESCE(SUM(COALESCE(({contribution.format(row=table)}), 0)), 0)
+                FROM {table}
+            ''', (name,))
+            logger.info(f"Initialised stats counter {name}")
+
+    @staticmethod
+    def _add_conversation_members(conn, conversation_ids: List[str] = None):
+        """
+        Insert the conversation_members rows of conversations from their participant
+        columns (all conversations if conversation_ids is None). Existing rows are kept.
+        """
+        query = '''
+            INSERT OR IGNORE INTO conversation_members (user_id, conversation_id, thread_id, role)
+            SELECT participant1_id, id, thread_id, 'participant1' FROM conversations
+            WHERE participant1_id IS NOT NULL {filter}
+            UNION ALL
+            SELECT participant2_id, id, thread_id, 'participant2' FROM conversations
+            WHERE participant2_id IS NOT NULL {filter}
+        '''
+        if conversation_ids is None:
+            conn.execute(query.format(filter=''))
+        else:
+            conn.executemany(query.format(filter='AND id = ?1'),
+                             [(conversation_id,) for conversation_id in conversation_ids])
+
+    def _open_connection(self):
+        """Open a new raw connection for the pool with the storage profile applied"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
         conn.row_factory = sqlite3.Row
+        apply_storage_profile(conn, self.storage_profile)
         return conn
+
+    def get_connection(self):
+        """Get pooled database connection with row factory (close() returns it to the pool)"""
+        return self._pool.acquire()
+
+    def connection(self):
+        """Context manager for a pooled connection: `with db.connection() as conn: ...`"""
+        return self._pool.connection()
+
+    def get_pool_stats(self) -> Dict:
+        """Get connection pool metrics"""
+        return self._pool.stats()
+
+    # WAL checkpoint policy
+    def _start_checkpointer(self):
+        """
+        Start the background WAL checkpointer for the active storage profile.
+        wal_autocheckpoint already checkpoints on commit once the WAL grows past
+        its threshold; the periodic PASSIVE checkpoint keeps the WAL short during
+        read-heavy periods when commits are rare, and a TRUNCATE checkpoint on
+        shutdown folds everything back into messaging.db.
+        """
+        self._checkpoint_stats = {'runs': 0, 'last_run': None, 'last_result': None}
+        self._checkpoint_stop = threading.Event()
+
+        interval = self.storage_profile.get('checkpoint_interval', 0)
+        if self.storage_profile.get('journal_mode') != 'WAL' or self.db_path == ':memory:':
+            return
+
+        atexit.register(self.close)
+        if interval <= 0:
+            return
+
+        def run():
+            while not self._checkpoint_stop.wait(interval):
+                try:
+                    self.checkpoint('PASSIVE')
+                except sqlite3.Error as e:
+                    logger.warning(f"WAL checkpoint failed: {e}")
+
+        thread = threading.Thread(target=run, name='wal-checkpointer', daemon=True)
+        thread.start()
+
+    def checkpoint(self, mode: str = 'PASSIVE') -> Dict:
+        """Run a WAL checkpoint (PASSIVE, FULL, RESTART or TRUNCATE)"""
+        mode = mode.upper()
+        if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+            raise ValueError(f'Invalid checkpoint mode: {mode}')
+
+        with self.connection() as conn:
+            row = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+
+        result = {'mode': mode, 'busy': row[0], 'wal_pages': row[1], 'checkpointed_pages': row[2]}
+        self._checkpoint_stats['runs'] += 1
+        self._checkpoint_stats['last_run'] = datetime.now().isoformat() + 'Z'
+        self._checkpoint_stats['last_result'] = result
+        return result
+
+    def get_storage_stats(self) -> Dict:
+        """Get the active storage profile and checkpoint activity"""
+        return {
+            'profile': self.storage_profile,
+            'checkpoints': dict(self._checkpoint_stats)
+        }
+
+    def close(self):
+        """Checkpoint the WAL into the main database file and close idle connections"""
+        self._checkpoint_stop.set()
+        if self.storage_profile.get('journal_mode') == 'WAL' and self.db_path != ':memory:':
+            try:
+                self.checkpoint('TRUNCATE')
+            except sqlite3.Error as e:
+                logger.warning(f"Final WAL checkpoint failed: {e}")
+        self._pool.close_all()
     
     def _create_tables(self):
         conn = self.get_connection()
@@ -84,6 +404,7 @@ class MessagingDatabase:
                     created_at TEXT DEFAULT CURRENT_TIMESTAMP,
                     updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
                     status TEXT DEFAULT 'active',
+                    change_seq INTEGER NOT NULL DEFAULT 0,
                     UNIQUE(campaign_id)
                 )
             ''')
@@ -108,6 +429,7 @@ class MessagingDatabase:
                     status TEXT DEFAULT 'active',
                     created_at TEXT DEFAULT CURRENT_TIMESTAMP,
                     updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    change_seq INTEGER NOT NULL DEFAULT 0,
                     FOREIGN KEY (thread_id) REFERENCES threads(id) ON DELETE CASCADE
                 )
             ''')
@@ -138,22 +460,165 @@ class MessagingDatabase:
                     original_message_id TEXT,
                     created_at TEXT DEFAULT CURRENT_TIMESTAMP,
                     updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    change_seq INTEGER NOT NULL DEFAULT 0,
+                    msg_seq INTEGER,
                     FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE,
                     FOREIGN KEY (thread_id) REFERENCES threads(id) ON DELETE CASCADE
                 )
             ''')
 
-            # Message read status table - tracks which users have read which messages
+            # Message read status table - legacy per-message read rows, no longer
+            # written; folded into conversation_read_cursors by _migrate_db
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS message_read_status (
                     message_id TEXT NOT NULL,
                     user_id TEXT NOT NULL,
                     read_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    change_seq INTEGER NOT NULL DEFAULT 0,
                     PRIMARY KEY (message_id, user_id),
                     FOREIGN KEY (message_id) REFERENCES messages(id) ON DELETE CASCADE
                 )
             ''')
             
+            # Read cursors - one row per (conversation, user): every message of the
+            # conversation with msg_seq <= last_read_seq counts as read by the user
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS conversation_read_cursors (
+                    conversation_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    last_read_seq INTEGER NOT NULL DEFAULT 0,
+                    read_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    change_seq INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (conversation_id, user_id),
+                    FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
+                )
+            ''')
+            
+            # Conversation members - one row per participant, user first so
+            # "conversations/threads of a user" is an index seek (the participant1_id /
+            # participant2_id columns stay on conversations for display)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS conversation_members (
+                    user_id TEXT NOT NULL,
+                    conversation_id TEXT NOT NULL,
+                    thread_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    joined_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, conversation_id),
+                    FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
+                )
+            ''')
+            
+            # Unread counters - each member's unread message count per conversation,
+            # maintained by triggers on messages, read cursors and conversation_members
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS conversation_unread_counters (
+                    user_id TEXT NOT NULL,
+                    conversation_id TEXT NOT NULL,
+                    thread_id TEXT NOT NULL,
+                    unread_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, conversation_id)
+                )
+            ''')
+            
+            # Sync sequence - single-row counter behind the change_seq columns.
+            # Every insert/update of a synced row takes the next value (see
+            # _create_triggers), giving clients a monotonic watermark for delta sync.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sync_sequence (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    value INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute('INSERT OR IGNORE INTO sync_sequence (id, value) VALUES (1, 0)')
+            
+            # Full-text index over message text, captions and attachment file
+            # names (rowid = messages.rowid), maintained by triggers
+            try:
+                cursor.execute('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                        text_content,
+                        caption,
+                        attachment_names,
+                        tokenize = 'unicode61 remove_diacritics 2'
+                    )
+                ''')
+                self.fts_enabled = True
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Message search disabled, SQLite has no FTS5: {e}")
+            
+            # Content-addressed upload blobs (see blob_store.py). ref_count is the number
+            # of live messages whose attachments point at the blob (kept by triggers), plus
+            # one if the blob is pinned (a standalone upload, see pin_blob)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    sha256 TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    metadata TEXT,
+                    ref_count INTEGER NOT NULL DEFAULT 0,
+                    pinned BOOLEAN NOT NULL DEFAULT FALSE,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    last_uploaded_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Media processing jobs (see media_pipeline.py): probe an uploaded blob
+            # and patch the attachment metadata of the message it was sent with
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS media_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sha256 TEXT NOT NULL,
+                    file_type TEXT NOT NULL,
+                    message_id TEXT,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    timings TEXT,
+                    enqueued_at REAL NOT NULL,
+                    claimed_at REAL,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TEXT
+                )
+            ''')
+            
+            # Resumable uploads in progress (see upload_sessions.py); received is the
+            # number of bytes staged so far, sha256 is set once the upload is finalized
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS upload_sessions (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    received INTEGER NOT NULL DEFAULT 0,
+                    expected_sha256 TEXT,
+                    sha256 TEXT,
+                    status TEXT NOT NULL DEFAULT 'active',
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            
+            # Admin stats counters (see _STATS_COUNTERS), so get_stats does not
+            # count whole tables
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stats_counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            
+            # Per-user Hyptrb campaign sync state (see thread_sync.py)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_sync_state (
+                    user_id TEXT PRIMARY KEY,
+                    last_synced_at TEXT,
+                    last_attempt_at TEXT,
+                    content_hash TEXT,
+                    campaign_count INTEGER DEFAULT 0,
+                    last_error TEXT
+                )
+            ''')
+            
             # Create indexes
             cursor.execute('''
                 CREATE INDEX IF NOT EXISTS idx_users_email 
@@ -179,6 +644,11 @@ class MessagingDatabase:
                 CREATE INDEX IF NOT EXISTS idx_messages_timestamp
                 ON messages(timestamp)
             ''')
+            # Keyset pagination of a conversation's history (see get_messages_page)
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_messages_conversation_timestamp
+                ON messages(conversation_id, timestamp, id)
+            ''')
             cursor.execute('''
                 CREATE INDEX IF NOT EXISTS idx_message_read_status_user
                 ON message_read_status(user_id)
@@ -187,6 +657,30 @@ class MessagingDatabase:
                 CREATE INDEX IF NOT EXISTS idx_message_read_status_message
                 ON message_read_status(message_id)
             ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_conversation_members_user_thread
+                ON conversation_members(user_id, thread_id)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_conversation_members_conversation
+                ON conversation_members(conversation_id)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_media_jobs_status
+                ON media_jobs(status, id)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_upload_sessions_expires
+                ON upload_sessions(expires_at)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced
+                ON blobs(last_uploaded_at) WHERE ref_count = 0
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_conversation_unread_counters_conversation
+                ON conversation_unread_counters(conversation_id)
+            ''')
 
             conn.commit()
         finally:
@@ -228,6 +722,211 @@ class MessagingDatabase:
                 END;
             ''')
             
+            # Per-conversation message sequence for inserts that do not set it
+            # (create_message assigns msg_seq in its INSERT)
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS messages_msg_seq_on_insert
+                AFTER INSERT ON messages
+                WHEN NEW.msg_seq IS NULL
+                BEGIN
+                    UPDATE messages
+                    SET msg_seq = (SELECT COALESCE(MAX(msg_seq), 0) + 1
+                                   FROM messages WHERE conversation_id = NEW.conversation_id)
+                    WHERE rowid = NEW.rowid;
+                END;
+            ''')
+            
+            # Unread counters: +1 for every other member when a message arrives,
+            # -1 when a message they had not read yet is deleted, recount of the
+            # (short) unread range when their read cursor moves, and a fresh count
+            # for a member who joins (e.g. participant2 of an existing conversation)
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS messages_unread_on_insert
+                AFTER INSERT ON messages
+                WHEN NEW.deleted = FALSE
+                BEGIN
+                    INSERT INTO conversation_unread_counters (user_id, conversation_id, thread_id, unread_count)
+                    SELECT user_id, NEW.conversation_id, NEW.thread_id, 1
+                    FROM conversation_members
+                    WHERE conversation_id = NEW.conversation_id AND user_id != NEW.sender_id
+                    ON CONFLICT (user_id, conversation_id) DO UPDATE SET unread_count = unread_count + 1;
+                END;
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS messages_unread_on_delete
+                AFTER UPDATE OF deleted ON messages
+                WHEN NEW.deleted = TRUE AND OLD.deleted = FALSE
+                BEGIN
+                    UPDATE conversation_unread_counters
+                    SET unread_count = MAX(unread_count - 1, 0)
+                    WHERE conversation_id = NEW.conversation_id
+                      AND user_id != NEW.sender_id
+                      AND NEW.msg_seq > COALESCE((SELECT r.last_read_seq FROM conversation_read_cursors r
+                                                  WHERE r.conversation_id = NEW.conversation_id
+                                                    AND r.user_id = conversation_unread_counters.user_id), 0);
+                END;
+            ''')
+            recount = '''
+                BEGIN
+                    UPDATE conversation_unread_counters
+                    SET unread_count = (SELECT COUNT(*) FROM messages
+                                        WHERE conversation_id = NEW.conversation_id
+                                          AND msg_seq > NEW.last_read_seq
+                                          AND sender_id != NEW.user_id
+                                          AND deleted = FALSE)
+                    WHERE user_id = NEW.user_id AND conversation_id = NEW.conversation_id;
+                END;
+            '''
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS read_cursors_unread_on_insert
+                AFTER INSERT ON conversation_read_cursors
+                {recount}
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS read_cursors_unread_on_update
+                AFTER UPDATE OF last_read_seq ON conversation_read_cursors
+                WHEN NEW.last_read_seq IS NOT OLD.last_read_seq
+                {recount}
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS conversation_members_unread_on_insert
+                AFTER INSERT ON conversation_members
+                BEGIN
+                    INSERT INTO conversation_unread_counters (user_id, conversation_id, thread_id, unread_count)
+                    SELECT NEW.user_id, NEW.conversation_id, NEW.thread_id, COUNT(*)
+                    FROM messages m
+                    WHERE m.conversation_id = NEW.conversation_id
+                      AND m.sender_id != NEW.user_id
+                      AND m.deleted = FALSE
+                      AND m.msg_seq > COALESCE((SELECT r.last_read_seq FROM conversation_read_cursors r
+                                                WHERE r.conversation_id = NEW.conversation_id
+                                                  AND r.user_id = NEW.user_id), 0)
+                    ON CONFLICT (user_id, conversation_id) DO UPDATE SET unread_count = excluded.unread_count;
+                END;
+            ''')
+            
+            # Search index: live messages only, so soft-deleted ones drop out
+            if self.fts_enabled:
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS messages_fts_on_insert
+                    AFTER INSERT ON messages
+                    WHEN NEW.deleted = FALSE
+                    BEGIN
+                        INSERT INTO messages_fts (rowid, text_content, caption, attachment_names)
+                        VALUES (NEW.rowid, NEW.text_content, NEW.caption,
+                                {self._FTS_ATTACHMENT_NAMES.format(row='NEW')});
+                    END;
+                ''')
+                cursor.execute('''
+                    CREATE TRIGGER IF NOT EXISTS messages_fts_on_soft_delete
+                    AFTER UPDATE OF deleted ON messages
+                    WHEN NEW.deleted = TRUE AND OLD.deleted = FALSE
+                    BEGIN
+                        DELETE FROM messages_fts WHERE rowid = NEW.rowid;
+                    END;
+                ''')
+                cursor.execute('''
+                    CREATE TRIGGER IF NOT EXISTS messages_fts_on_delete
+                    AFTER DELETE ON messages
+                    BEGIN
+                        DELETE FROM messages_fts WHERE rowid = OLD.rowid;
+                    END;
+                ''')
+            
+            # Blob reference counts: a live message holds one reference per attachment;
+            # soft delete (or a hard delete of a live message) releases them
+            release = '''
+                BEGIN
+                    UPDATE blobs
+                    SET ref_count = MAX(ref_count - (SELECT COUNT(*) FROM ({attachments}) r
+                                                     WHERE r.sha256 = blobs.sha256), 0)
+                    WHERE sha256 IN ({attachments});
+                END;
+            '''.format(attachments=self._ATTACHMENT_BLOBS.format(row='OLD'))
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS blobs_ref_on_message_insert
+                AFTER INSERT ON messages
+                WHEN NEW.deleted = FALSE AND NEW.attachments IS NOT NULL
+                BEGIN
+                    UPDATE blobs
+                    SET ref_count = ref_count + (SELECT COUNT(*) FROM ({attachments}) r
+                                                 WHERE r.sha256 = blobs.sha256)
+                    WHERE sha256 IN ({attachments});
+                END;
+            '''.format(attachments=self._ATTACHMENT_BLOBS.format(row='NEW')))
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS blobs_ref_on_message_soft_delete
+                AFTER UPDATE OF deleted ON messages
+                WHEN NEW.deleted = TRUE AND OLD.deleted = FALSE AND OLD.attachments IS NOT NULL
+                {release}
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS blobs_ref_on_message_delete
+                AFTER DELETE ON messages
+                WHEN OLD.deleted = FALSE AND OLD.attachments IS NOT NULL
+                {release}
+            ''')
+            
+            # Stats counters (see _STATS_COUNTERS)
+            for name, (table, contribution, columns) in self._STATS_COUNTERS.items():
+                new = f"COALESCE(({contribution.format(row='NEW')}), 0)"
+                old = f"COALESCE(({contribution.format(row='OLD')}), 0)"
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS stats_{name}_on_insert
+                    AFTER INSERT ON {table}
+                    WHEN {new} != 0
+                    BEGIN
+                        UPDATE stats_counters SET value = value + {new} WHERE name = '{name}';
+                    END;
+                ''')
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS stats_{name}_on_delete
+                    AFTER DELETE ON {table}
+                    WHEN {old} != 0
+                    BEGIN
+                        UPDATE stats_counters SET value = value - {old} WHERE name = '{name}';
+                    END;
+                ''')
+                if columns:
+                    cursor.execute(f'''
+                        CREATE TRIGGER IF NOT EXISTS stats_{name}_on_update
+                        AFTER UPDATE OF {', '.join(columns)} ON {table}
+                        WHEN {new} != {old}
+                        BEGIN
+                            UPDATE stats_counters SET value = value + {new} - {old} WHERE name = '{name}';
+                        END;
+                    ''')
+            
+            # Stamp synced rows with the next sync sequence value on every change.
+            # The update triggers skip the stamping UPDATE itself (change_seq differs).
+            for table in ('threads', 'conversations', 'messages', 'message_read_status',
+                          'conversation_read_cursors'):
+                stamp = f'''
+                    BEGIN
+                        UPDATE sync_sequence SET value = value + 1 WHERE id = 1;
+                        UPDATE {table}
+                        SET change_seq = (SELECT value FROM sync_sequence WHERE id = 1)
+                        WHERE rowid = NEW.rowid;
+                    END;
+                '''
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_change_seq_on_insert
+                    AFTER INSERT ON {table}
+                    {stamp}
+                ''')
+                update_of = ''
+                if table in self._SYNC_DERIVED_COLUMNS:
+                    cursor.execute(f'PRAGMA table_info({table})')
+                    own_columns = [col[1] for col in cursor.fetchall()
+                                   if col[1] not in self._SYNC_DERIVED_COLUMNS[table] + ('change_seq',)]
+                    update_of = f"OF {', '.join(own_columns)}"
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_change_seq_on_update
+                    AFTER UPDATE {update_of} ON {table}
+                    WHEN NEW.change_seq IS OLD.change_seq
+                    {stamp}
+                ''')
+            
             conn.commit()
         finally:
             conn.close()
@@ -365,6 +1064,81 @@ class MessagingDatabase:
             return cursor.rowcount > 0
         finally:
             conn.close()
+
+    def update_users_last_seen(self, updates: List[Tuple[str, str]]) -> int:
+        """
+        Batch-update last seen timestamps in one transaction
+
+        Args:
+            updates: (firebase_uid, last_seen ISO timestamp) pairs
+
+        Returns:
+            Number of users updated (a timestamp older than the stored one is ignored)
+        """
+        if not updates:
+            return 0
+        conn = self.get_connection()
+        try:
+            cursor = conn.executemany('''
+                UPDATE users
+                SET last_seen = ?1
+                WHERE firebase_uid = ?2 AND (last_seen IS NULL OR last_seen < ?1)
+            ''', [(last_seen, firebase_uid) for firebase_uid, last_seen in updates])
+            conn.commit()
+            return cursor.rowcount
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def get_user_sync_state(self, user_id: str) -> Optional[Dict]:
+        """Get a user's campaign thread sync state"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('SELECT * FROM user_sync_state WHERE user_id = ?', (user_id,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+    
+    def record_user_sync(self, user_id: str, content_hash: str = None,
+                         campaign_count: int = None, error: str = None):
+        """
+        Record a campaign thread sync attempt
+        
+        Args:
+            user_id: User's Firebase UID
+            content_hash: Hash of the fetched campaigns (successful sync)
+            campaign_count: Number of campaigns fetched (successful sync)
+            error: Error message (failed sync; keeps the last successful state)
+        """
+        now = datetime.now().isoformat() + 'Z'
+        conn = self.get_connection()
+        try:
+            if error:
+                conn.execute('''
+                    INSERT INTO user_sync_state (user_id, last_attempt_at, last_error)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        last_attempt_at = excluded.last_attempt_at,
+                        last_error = excluded.last_error
+                ''', (user_id, now, error))
+            else:
+                conn.execute('''
+                    INSERT INTO user_sync_state
+                    (user_id, last_synced_at, last_attempt_at, content_hash, campaign_count, last_error)
+                    VALUES (?, ?, ?, ?, ?, NULL)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        last_synced_at = excluded.last_synced_at,
+                        last_attempt_at = excluded.last_attempt_at,
+                        content_hash = excluded.content_hash,
+                        campaign_count = excluded.campaign_count,
+                        last_error = NULL
+                ''', (user_id, now, now, content_hash, campaign_count or 0))
+            conn.commit()
+        finally:
+            conn.close()
     
     def get_all_users(self, limit: int = 100, offset: int = 0) -> List[Dict]:
         """Get all users with pagination"""
@@ -437,20 +1211,26 @@ class MessagingDatabase:
                     ORDER BY t.updated_at DESC
                 ''')
             else:
-                # Non-admins see only their own threads
+                # Non-admins see only their own threads: created by them or with a
+                # conversation they are a member of (counting only those conversations
+                # unless they own the thread)
                 cursor = conn.execute('''
-                    SELECT DISTINCT t.*,
+                    SELECT t.*,
                            COUNT(DISTINCT c.id) as conversation_count,
                            SUM(c.unread_count) as total_unread
                     FROM threads t
-                    LEFT JOIN conversations c ON t.id = c.thread_id
+                    LEFT JOIN conversations c
+                           ON t.id = c.thread_id
+                          AND (t.created_by = :user_id
+                               OR c.id IN (SELECT conversation_id FROM conversation_members
+                                           WHERE user_id = :user_id))
                     WHERE t.status = 'active'
-                      AND (t.created_by = ? 
-                           OR c.participant1_id = ? 
-                           OR c.participant2_id = ?)
+                      AND t.id IN (SELECT id FROM threads WHERE created_by = :user_id
+                                   UNION
+                                   SELECT thread_id FROM conversation_members WHERE user_id = :user_id)
                     GROUP BY t.id
                     ORDER BY t.updated_at DESC
-                ''', (user_id, user_id, user_id))
+                ''', {'user_id': user_id})
             
             return [dict(row) for row in cursor.fetchall()]
         finally:
@@ -557,6 +1337,115 @@ class MessagingDatabase:
         finally:
             conn.close()
     
+    def upsert_campaign_threads(self, threads: List[Dict], conversations: List[Dict] = None) -> Dict[str, str]:
+        """
+        Create missing campaign threads and participant conversations in one transaction
+        
+        Same rules as create_thread and get_or_create_conversation (campaign_id is
+        the thread ID; a placeholder owner is replaced by a real UID; one
+        conversation per participant pair), batched for a whole campaign sync.
+        
+        Args:
+            threads: Thread dicts as for create_thread; campaign_id is required
+            conversations: Dicts with campaign_id, name, participant1_id/_name/_avatar
+                and participant2_id/_name/_avatar
+        
+        Returns:
+            Dict of campaign_id -> thread_id
+        """
+        campaign_ids = [t['campaign_id'] for t in threads if t.get('campaign_id')]
+        if not campaign_ids:
+            return {}
+        
+        conn = self.get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            
+            # Existing threads, matched by campaign_id or by ID (campaign_id is used as the ID)
+            cursor = conn.execute('''
+                SELECT id, campaign_id, created_by FROM threads
+                WHERE campaign_id IN (SELECT value FROM json_each(?))
+                   OR id IN (SELECT value FROM json_each(?))
+            ''', (json.dumps(campaign_ids), json.dumps(campaign_ids)))
+            by_campaign, by_id = {}, {}
+            for row in cursor.fetchall():
+                if row['campaign_id']:
+                    by_campaign[row['campaign_id']] = row
+                by_id[row['id']] = row
+            
+            thread_ids = {}
+            owner_updates = []
+            new_threads = []
+            for thread_data in threads:
+                campaign_id = thread_data.get('campaign_id')
+                if not campaign_id or campaign_id in thread_ids:
+                    continue
+                created_by = thread_data.get('created_by', '')
+                existing = by_campaign.get(campaign_id) or by_id.get(campaign_id)
+                
+                if existing:
+                    thread_ids[campaign_id] = existing['id']
+                    existing_creator = existing['created_by']
+                    if (created_by and existing_creator != created_by
+                            and existing_creator.startswith('placeholder_')
+                            and not created_by.startswith('placeholder_')):
+                        logger.info(f"Updating thread {existing['id']} owner from placeholder {existing_creator} to actual UID {created_by}")
+                        owner_updates.append((created_by, existing['id']))
+                else:
+                    thread_ids[campaign_id] = campaign_id
+                    new_threads.append((
+                        campaign_id,
+                        thread_data.get('title', 'New Thread'),
+                        thread_data.get('description', ''),
+                        campaign_id,
+                        created_by,
+                        thread_data.get('status', 'active')
+                    ))
+            
+            conn.executemany('UPDATE threads SET created_by = ? WHERE id = ?', owner_updates)
+            conn.executemany('''
+                INSERT INTO threads (id, title, description, campaign_id, created_by, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', new_threads)
+            
+            new_conversations = []
+            for conv in conversations or []:
+                thread_id = thread_ids.get(conv.get('campaign_id'))
+                if not thread_id or not conv.get('participant2_id'):
+                    continue
+                # Normalize participant order (smaller ID first) like get_or_create_conversation
+                p1 = (conv['participant1_id'], conv.get('participant1_name', ''), conv.get('participant1_avatar', ''))
+                p2 = (conv['participant2_id'], conv.get('participant2_name'), conv.get('participant2_avatar'))
+                if p1[0] > p2[0]:
+                    p1, p2 = p2, p1
+                new_conversations.append((
+                    f"c{uuid.uuid4().hex[:8]}", thread_id, conv.get('name'),
+                    p1[0], p1[1], p1[2], p2[0], p2[1], p2[2],
+                    thread_id, p1[0], p2[0]
+                ))
+            
+            conn.executemany('''
+                INSERT INTO conversations
+                (id, thread_id, name, participant1_id, participant1_name, participant1_avatar,
+                 participant2_id, participant2_name, participant2_avatar)
+                SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM conversations
+                    WHERE thread_id = ? AND participant1_id = ? AND participant2_id = ?
+                )
+            ''', new_conversations)
+            # Rows skipped as duplicates don't exist under the generated ID, so this only
+            # adds the members of conversations inserted above
+            self._add_conversation_members(conn, [row[0] for row in new_conversations])
+            
+            conn.commit()
+            return thread_ids
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    
     def thread_exists(self, thread_id: str) -> bool:
         """Check if thread exists"""
         conn = self.get_connection()
@@ -581,110 +1470,245 @@ class MessagingDatabase:
                 # Admins have access to all threads
                 cursor = conn.execute('SELECT 1 FROM threads WHERE id = ? LIMIT 1', (thread_id,))
             else:
-                # Non-admins need to be creator or participant
+                # Non-admins need to be creator or member of a conversation in it
                 cursor = conn.execute('''
-                    SELECT 1 FROM threads t
-                    LEFT JOIN conversations c ON t.id = c.thread_id
-                    WHERE t.id = ?
-                      AND (t.created_by = ? 
-                           OR c.participant1_id = ? 
-                           OR c.participant2_id = ?)
+                    SELECT 1 FROM threads WHERE id = :thread_id AND created_by = :user_id
+                    UNION ALL
+                    SELECT 1 FROM conversation_members WHERE user_id = :user_id AND thread_id = :thread_id
                     LIMIT 1
-                ''', (thread_id, user_id, user_id, user_id))
+                ''', {'thread_id': thread_id, 'user_id': user_id})
             
             return cursor.fetchone() is not None
         finally:
             conn.close()
     
     # Conversation operations
+    # Participant roles/emails are not stored on the conversation row, but are needed by the
+    # admin UI to correctly label participants (client vs influencer) especially for
+    # single-participant conversations created by a client. They are joined in from users.
+    _CONVERSATION_PARTICIPANT_COLUMNS = '''
+        u1.firebase_uid AS _participant1_user_uid,
+        u1.email AS _participant1_user_email,
+        u1.role AS _participant1_user_role,
+        u2.firebase_uid AS _participant2_user_uid,
+        u2.email AS _participant2_user_email,
+        u2.role AS _participant2_user_role
+    '''
+
+    @staticmethod
+    def _apply_participant_fields(conv: Dict) -> Dict:
+        """Move joined users columns onto the conversation (see _CONVERSATION_PARTICIPANT_COLUMNS)"""
+        p1_found = conv.pop('_participant1_user_uid', None) is not None
+        p1_email = conv.pop('_participant1_user_email', None)
+        p1_role = conv.pop('_participant1_user_role', None)
+        p2_found = conv.pop('_participant2_user_uid', None) is not None
+        p2_email = conv.pop('_participant2_user_email', None)
+        p2_role = conv.pop('_participant2_user_role', None)
+
+        if p1_found:
+            conv['participant1_email'] = p1_email
+            conv['participant1_role'] = p1_role
+
+        if p2_found:
+            conv['participant2_role'] = p2_role
+            # If participant2_email is missing but exists on user, expose it
+            # (helps admin UI matching for portal users).
+            if not conv.get('participant2_email') and p2_email:
+                conv['participant2_email'] = p2_email
+
+        return conv
+
     def get_conversations_by_thread(self, thread_id: str, user_id: str = None) -> List[Dict]:
         """Get all conversations in a thread, optionally filtered by user participation"""
         conn = self.get_connection()
         try:
+            query = f'''
+                SELECT c.*, {self._CONVERSATION_PARTICIPANT_COLUMNS}
+                FROM conversations c
+                LEFT JOIN users u1 ON u1.firebase_uid = c.participant1_id
+                LEFT JOIN users u2 ON u2.firebase_uid = c.participant2_id
+                WHERE c.thread_id = ? AND c.status = 'active'
+            '''
             if user_id:
                 # Only return conversations where the user is a participant
-                cursor = conn.execute('''
-                    SELECT * FROM conversations 
-                    WHERE thread_id = ? AND status = 'active'
-                    AND (participant1_id = ? OR participant2_id = ?)
-                    ORDER BY updated_at DESC
-                ''', (thread_id, user_id, user_id))
+                cursor = conn.execute(query + '''
+                    AND c.id IN (SELECT conversation_id FROM conversation_members
+                                 WHERE user_id = ? AND thread_id = ?)
+                    ORDER BY c.updated_at DESC
+                ''', (thread_id, user_id, thread_id))
             else:
                 # Return all conversations (admin use case)
-                cursor = conn.execute('''
-                    SELECT * FROM conversations 
-                    WHERE thread_id = ? AND status = 'active'
-                    ORDER BY updated_at DESC
+                cursor = conn.execute(query + '''
+                    ORDER BY c.updated_at DESC
                 ''', (thread_id,))
-            conversations = [dict(row) for row in cursor.fetchall()]
-
-            # Enrich with participant roles/emails for UI correctness.
-            # These fields are not stored on the conversation row, but are needed by the
-            # admin UI to correctly label participants (client vs influencer) especially
-            # for single-participant conversations created by a client.
-            for conv in conversations:
-                p1_id = conv.get('participant1_id')
-                p2_id = conv.get('participant2_id')
-
-                if p1_id:
-                    p1_user = self.get_user_by_firebase_uid(p1_id)
-                    if p1_user:
-                        conv['participant1_email'] = p1_user.get('email')
-                        conv['participant1_role'] = p1_user.get('role')
-
-                if p2_id:
-                    p2_user = self.get_user_by_firebase_uid(p2_id)
-                    if p2_user:
-                        conv['participant2_role'] = p2_user.get('role')
-                        # If participant2_email is missing but exists on user, expose it
-                        # (helps admin UI matching for portal users).
-                        if not conv.get('participant2_email') and p2_user.get('email'):
-                            conv['participant2_email'] = p2_user.get('email')
-
-            return conversations
+            return [self._apply_participant_fields(dict(row)) for row in cursor.fetchall()]
         finally:
             conn.close()
-    
-    def get_conversation_by_id(self, conversation_id: str) -> Optional[Dict]:
-        """Get conversation by ID"""
-        conn = self.get_connection()
-        try:
-            cursor = conn.execute('SELECT * FROM conversations WHERE id = ?', (conversation_id,))
-            row = cursor.fetchone()
-            if not row:
-                return None
-
-            conv = dict(row)
 
-            # Enrich with participant roles/emails (see get_conversations_by_thread).
-            p1_id = conv.get('participant1_id')
-            p2_id = conv.get('participant2_id')
-
-            if p1_id:
-                p1_user = self.get_user_by_firebase_uid(p1_id)
-                if p1_user:
-                    conv['participant1_email'] = p1_user.get('email')
-                    conv['participant1_role'] = p1_user.get('role')
-
-            if p2_id:
-                p2_user = self.get_user_by_firebase_uid(p2_id)
-                if p2_user:
-                    conv['participant2_role'] = p2_user.get('role')
-                    if not conv.get('participant2_email') and p2_user.get('email'):
-                        conv['participant2_email'] = p2_user.get('email')
-
-            return conv
-        finally:
-            conn.close()
-    
-    def get_or_create_conversation(self, thread_id: str, participant1_id: str, participant2_id: str = None, 
-                                   participant1_name: str = '', participant2_name: str = None,
-                                   participant1_avatar: str = '', participant2_avatar: str = None,
-                                   participant2_email: str = None, participant_type: str = None,
-                                   name: str = None) -> str:
+    def _get_enriched_conversations(self, conn, user_id: str, thread_id: str = None,
+                                    participant_only: bool = True) -> List[Dict]:
         """
-        Get existing conversation or create new one in a thread.
-        participant2 is optional - conversation can be created with only participant1.
+        Get active conversations (of one thread, or of all active threads) with participant roles/emails, the
+        last message and the user's unread count in a single set-based query.
+
+        Each conversation gets:
+        - last_message_data: the fields of the latest message needed to compute its type, or None
+        - user_unread_count: messages not sent by and not yet read by user_id (from its unread counter,
+          or counted past the user's read cursor in conversations they are not a member of)
+        """
+        params = {'user_id': user_id}
+        if thread_id:
+            filters = ['AND c.thread_id = :thread_id']
+            params['thread_id'] = thread_id
+        else:
+            filters = ["AND c.thread_id IN (SELECT id FROM threads WHERE status = 'active')"]
+        if participant_only:
+            filters.append('AND c.id IN (SELECT conversation_id FROM conversation_members WHERE user_id = :user_id)')
+
+        cursor = conn.execute(f'''
+            WITH visible AS (
+                SELECT c.*
+                FROM conversations c
+                WHERE c.status = 'active'
+                {' '.join(filters)}
+            )
+            SELECT c.*, {self._CONVERSATION_PARTICIPANT_COLUMNS},
+                   lm.id IS NOT NULL AS _has_last_message,
+                   lm.content AS _last_content,
+                   lm.text_content AS _last_text_content,
+                   lm.has_attachment AS _last_has_attachment,
+                   lm.attachments AS _last_attachments,
+                   lm.filename AS _last_filename,
+                   COALESCE(un.unread_count, (
+                       -- Not a member (admins): range count past the user's read cursor
+                       SELECT COUNT(*) FROM messages m
+                       WHERE m.conversation_id = c.id
+                         AND m.msg_seq > COALESCE((
+                             SELECT rc.last_read_seq FROM conversation_read_cursors rc
+                             WHERE rc.conversation_id = c.id AND rc.user_id = :user_id
+                         ), 0)
+                         AND m.sender_id != :user_id
+                         AND m.deleted = FALSE
+                   )) AS user_unread_count
+            FROM visible c
+            LEFT JOIN users u1 ON u1.firebase_uid = c.participant1_id
+            LEFT JOIN users u2 ON u2.firebase_uid = c.participant2_id
+            -- One seek per conversation on idx_messages_conversation_timestamp
+            LEFT JOIN messages lm ON lm.id = (
+                SELECT m.id FROM messages m
+                WHERE m.conversation_id = c.id
+                ORDER BY m.timestamp DESC, m.id DESC
+                LIMIT 1
+            )
+            LEFT JOIN conversation_unread_counters un
+                   ON un.user_id = :user_id AND un.conversation_id = c.id
+            ORDER BY c.updated_at DESC
+        ''', params)
+
+        conversations = []
+        for row in cursor.fetchall():
+            conv = self._apply_participant_fields(dict(row))
+            has_last_message = conv.pop('_has_last_message')
+            last_message_data = {
+                'content': conv.pop('_last_content'),
+                'text_content': conv.pop('_last_text_content'),
+                'has_attachment': bool(conv.pop('_last_has_attachment')),
+                'attachments': conv.pop('_last_attachments'),
+                'filename': conv.pop('_last_filename')
+            }
+            if last_message_data['attachments']:
+                try:
+                    last_message_data['attachments'] = json.loads(last_message_data['attachments'])
+                except (json.JSONDecodeError, TypeError):
+                    last_message_data['attachments'] = []
+            conv['last_message_data'] = last_message_data if has_last_message else None
+            conversations.append(conv)
+        return conversations
+
+    def _get_thread_unread_counts(self, conn, user_id: str, thread_id: str = None) -> Dict[str, int]:
+        """Per-thread unread totals for user_id over the conversations they participate in"""
+        thread_filter = 'AND thread_id = :thread_id' if thread_id else ''
+        cursor = conn.execute(f'''
+            SELECT thread_id, SUM(unread_count) AS unread_count
+            FROM conversation_unread_counters
+            WHERE user_id = :user_id
+              {thread_filter}
+            GROUP BY thread_id
+        ''', {'user_id': user_id, 'thread_id': thread_id})
+        return {row['thread_id']: row['unread_count'] for row in cursor.fetchall()}
+
+    def get_thread_tree_for_user(self, user_id: str, user_role: str = None) -> List[Dict]:
+        """
+        Get the threads visible to a user (see get_threads_for_user), each with:
+        - conversations: enriched conversations (see _get_enriched_conversations);
+          admins get every conversation, others only their own
+        - conversation_count: number of those conversations
+        - total_unread: user's unread total across the conversations they participate in
+
+        Runs three queries on one connection regardless of the number of threads.
+        """
+        is_admin = user_role in ['main_admin', 'billing_admin', 'campaign_admin']
+        conn = self.get_connection()
+        try:
+            threads = self.get_threads_for_user(user_id, user_role)
+            conversations = self._get_enriched_conversations(conn, user_id, participant_only=not is_admin)
+            unread_by_thread = self._get_thread_unread_counts(conn, user_id)
+        finally:
+            conn.close()
+
+        conversations_by_thread = {}
+        for conv in conversations:
+            conversations_by_thread.setdefault(conv['thread_id'], []).append(conv)
+
+        for thread in threads:
+            thread_conversations = conversations_by_thread.get(thread['id'], [])
+            thread['conversations'] = thread_conversations
+            thread['conversation_count'] = len(thread_conversations)
+            thread['total_unread'] = unread_by_thread.get(thread['id'], 0)
+        return threads
+
+    def get_thread_with_conversations(self, thread_id: str, user_id: str) -> Optional[Dict]:
+        """Get a thread with the user's own enriched conversations (see get_thread_tree_for_user)"""
+        conn = self.get_connection()
+        try:
+            thread = self.get_thread_by_id(thread_id)
+            if not thread:
+                return None
+            conversations = self._get_enriched_conversations(conn, user_id, thread_id=thread_id)
+        finally:
+            conn.close()
+
+        thread['conversations'] = conversations
+        thread['conversation_count'] = len(conversations)
+        return thread
+
+    def get_conversation_by_id(self, conversation_id: str) -> Optional[Dict]:
+        """Get conversation by ID"""
+        conn = self.get_connection()
+        try:
+            # Enrich with participant roles/emails (see get_conversations_by_thread).
+            cursor = conn.execute(f'''
+                SELECT c.*, {self._CONVERSATION_PARTICIPANT_COLUMNS}
+                FROM conversations c
+                LEFT JOIN users u1 ON u1.firebase_uid = c.participant1_id
+                LEFT JOIN users u2 ON u2.firebase_uid = c.participant2_id
+                WHERE c.id = ?
+            ''', (conversation_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            return self._apply_participant_fields(dict(row))
+        finally:
+            conn.close()
+    
+    def get_or_create_conversation(self, thread_id: str, participant1_id: str, participant2_id: str = None, 
+                                   participant1_name: str = '', participant2_name: str = None,
+                                   participant1_avatar: str = '', participant2_avatar: str = None,
+                                   participant2_email: str = None, participant_type: str = None,
+                                   name: str = None) -> str:
+        """
+        Get existing conversation or create new one in a thread.
+        participant2 is optional - conversation can be created with only participant1.
         """
         conn = self.get_connection()
         try:
@@ -734,6 +1758,7 @@ class MessagingDatabase:
                     participant1_id, participant1_name, participant1_avatar
                 ))
             
+            self._add_conversation_members(conn, [conversation_id])
             conn.commit()
             return conversation_id
         finally:
@@ -744,7 +1769,7 @@ class MessagingDatabase:
         """Add participant2 to an existing conversation that has only participant1"""
         conn = self.get_connection()
         try:
-            conn.execute('''
+            cursor = conn.execute('''
                 UPDATE conversations
                 SET participant2_id = ?,
                     participant2_name = ?,
@@ -753,7 +1778,10 @@ class MessagingDatabase:
                 WHERE id = ? AND participant2_id IS NULL
             ''', (participant2_id, participant2_name, participant2_avatar, conversation_id))
             
-            affected_rows = conn.total_changes
+            # total_changes is cumulative for the (pooled) connection, so use rowcount
+            affected_rows = cursor.rowcount
+            if affected_rows > 0:
+                self._add_conversation_members(conn, [conversation_id])
             conn.commit()
             return affected_rows > 0
         finally:
@@ -768,65 +1796,50 @@ class MessagingDatabase:
         finally:
             conn.close()
     
-    def update_conversation_read_status_detailed(self, conversation_id: str) -> Dict:
-        """Mark conversation as read with detailed status information"""
-        conn = self.get_connection()
-        try:
-            cursor = conn.execute(
-                'SELECT unread_count FROM conversations WHERE id = ?',
-                (conversation_id,)
-            )
-            row = cursor.fetchone()
-            
-            if not row:
-                return {
-                    'success': False,
-                    'reason': 'conversation_not_found',
-                    'message': 'Conversation not found',
-                    'updated': False
-                }
-            
-            current_unread_count = row[0]
-            
-            if current_unread_count > 0:
-                conn.execute(
-                    'UPDATE conversations SET unread_count = 0 WHERE id = ?',
-                    (conversation_id,)
-                )
-                conn.commit()
-                return {
-                    'success': True,
-                    'reason': 'marked_as_read',
-                    'message': f'Conversation marked as read ({current_unread_count} unread messages cleared)',
-                    'updated': True,
-                    'cleared_unread_count': current_unread_count
-                }
-            else:
-                return {
-                    'success': True,
-                    'reason': 'already_read',
-                    'message': 'Conversation was already marked as read',
-                    'updated': False
-                }
-        finally:
-            conn.close()
+    def update_conversation_read_status_detailed(self, conversation_id: str, user_id: str) -> Dict:
+        """
+        Mark conversation as read for one user with detailed status information
+
+        Unread state is per member (read cursor + unread counter); the legacy
+        conversations.unread_count column is no longer reset for everyone.
+        """
+        if not self.conversation_exists(conversation_id):
+            return {
+                'success': False,
+                'reason': 'conversation_not_found',
+                'message': 'Conversation not found',
+                'updated': False
+            }
+
+        result = self.mark_messages_as_read(conversation_id, user_id)
+        if result['marked_count']:
+            return {
+                'success': True,
+                'reason': 'marked_as_read',
+                'message': f"Conversation marked as read ({result['marked_count']} unread messages cleared)",
+                'updated': True,
+                'cleared_unread_count': result['marked_count']
+            }
+        return {
+            'success': True,
+            'reason': 'already_read',
+            'message': 'Conversation was already marked as read',
+            'updated': False
+        }
 
     def get_unread_count_for_user(self, conversation_id: str, user_id: str) -> int:
         """Get the number of unread messages for a specific user in a conversation"""
         conn = self.get_connection()
         try:
-            cursor = conn.execute('''
-                SELECT COUNT(*) as unread_count
-                FROM messages m
-                WHERE m.conversation_id = ?
-                  AND m.sender_id != ?
-                  AND m.deleted = FALSE
-                  AND m.id NOT IN (
-                      SELECT message_id FROM message_read_status WHERE user_id = ?
-                  )
-            ''', (conversation_id, user_id, user_id))
-            row = cursor.fetchone()
-            return row[0] if row else 0
+            row = conn.execute('''
+                SELECT unread_count FROM conversation_unread_counters
+                WHERE user_id = ? AND conversation_id = ?
+            ''', (user_id, conversation_id)).fetchone()
+            if row:
+                return row[0]
+            # Not a member (e.g. an admin viewing the conversation): count from the read cursor
+            return self._count_unread(conn, conversation_id, user_id,
+                                      self._read_cursor(conn, conversation_id, user_id))
         finally:
             conn.close()
 
@@ -834,71 +1847,144 @@ class MessagingDatabase:
         """Get the total number of unread messages for a specific user in a thread"""
         conn = self.get_connection()
         try:
-            cursor = conn.execute('''
-                SELECT COUNT(*) as unread_count
-                FROM messages m
-                INNER JOIN conversations c ON m.conversation_id = c.id
-                WHERE c.thread_id = ?
-                  AND m.sender_id != ?
-                  AND m.deleted = FALSE
-                  AND (c.participant1_id = ? OR c.participant2_id = ?)
-                  AND m.id NOT IN (
-                      SELECT message_id FROM message_read_status WHERE user_id = ?
-                  )
-            ''', (thread_id, user_id, user_id, user_id, user_id))
-            row = cursor.fetchone()
-            return row[0] if row else 0
+            return self._get_thread_unread_counts(conn, user_id, thread_id).get(thread_id, 0)
         finally:
             conn.close()
 
-    def mark_messages_as_read(self, conversation_id: str, user_id: str) -> Dict:
-        """Mark all messages in a conversation as read for a specific user"""
+    def get_unread_summary(self, user_id: str) -> Dict:
+        """
+        A user's unread badge counts from the unread counters
+
+        Returns:
+            Dict with total_unread and per-thread / per-conversation counts (non-zero only)
+        """
         conn = self.get_connection()
         try:
-            # Get all unread messages for this user in the conversation
             cursor = conn.execute('''
-                SELECT m.id
-                FROM messages m
-                WHERE m.conversation_id = ?
-                  AND m.sender_id != ?
-                  AND m.deleted = FALSE
-                  AND m.id NOT IN (
-                      SELECT message_id FROM message_read_status WHERE user_id = ?
-                  )
-            ''', (conversation_id, user_id, user_id))
+                SELECT conversation_id, thread_id, unread_count
+                FROM conversation_unread_counters
+                WHERE user_id = ? AND unread_count > 0
+            ''', (user_id,))
+            threads, conversations = {}, {}
+            for row in cursor.fetchall():
+                conversations[row['conversation_id']] = row['unread_count']
+                threads[row['thread_id']] = threads.get(row['thread_id'], 0) + row['unread_count']
+            return {
+                'total_unread': sum(conversations.values()),
+                'threads': threads,
+                'conversations': conversations
+            }
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _read_cursor(conn, conversation_id: str, user_id: str) -> int:
+        """The user's last read msg_seq in a conversation (0 if they never read it)"""
+        row = conn.execute('''
+            SELECT last_read_seq FROM conversation_read_cursors
+            WHERE conversation_id = ? AND user_id = ?
+        ''', (conversation_id, user_id)).fetchone()
+        return row[0] if row else 0
 
-            unread_messages = [row[0] for row in cursor.fetchall()]
+    @staticmethod
+    def _count_unread(conn, conversation_id: str, user_id: str, after_seq: int, up_to_seq: int = None) -> int:
+        """Range count of other users' live messages with after_seq < msg_seq <= up_to_seq"""
+        row = conn.execute('''
+            SELECT COUNT(*) FROM messages
+            WHERE conversation_id = ?
+              AND msg_seq > ?
+              AND msg_seq <= COALESCE(?, msg_seq)
+              AND sender_id != ?
+              AND deleted = FALSE
+        ''', (conversation_id, after_seq, up_to_seq, user_id)).fetchone()
+        return row[0] if row else 0
+
+    def mark_messages_as_read(self, conversation_id: str, user_id: str, up_to_seq: int = None) -> Dict:
+        """
+        Mark a conversation as read for a user by moving their read cursor
+
+        Args:
+            conversation_id: Conversation ID
+            user_id: Reader's Firebase UID
+            up_to_seq: Last msg_seq read (default: the conversation's latest message)
+
+        Returns:
+            Dict with success, reason, message, marked_count and the new last_read_seq
+        """
+        conn = self.get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            latest_seq = conn.execute(
+                'SELECT COALESCE(MAX(msg_seq), 0) FROM messages WHERE conversation_id = ?',
+                (conversation_id,)
+            ).fetchone()[0]
+            target_seq = latest_seq if up_to_seq is None else min(up_to_seq, latest_seq)
+            current_seq = self._read_cursor(conn, conversation_id, user_id)
 
-            if not unread_messages:
+            if target_seq <= current_seq:
+                conn.commit()
                 return {
                     'success': True,
                     'reason': 'already_read',
                     'message': 'All messages already read',
-                    'marked_count': 0
+                    'marked_count': 0,
+                    'last_read_seq': current_seq
                 }
 
-            # Mark each message as read
-            for message_id in unread_messages:
-                conn.execute('''
-                    INSERT OR IGNORE INTO message_read_status (message_id, user_id)
-                    VALUES (?, ?)
-                ''', (message_id, user_id))
-
+            marked_count = self._count_unread(conn, conversation_id, user_id, current_seq, target_seq)
+            conn.execute('''
+                INSERT INTO conversation_read_cursors (conversation_id, user_id, last_read_seq, read_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (conversation_id, user_id) DO UPDATE
+                SET last_read_seq = excluded.last_read_seq,
+                    read_at = excluded.read_at
+                WHERE excluded.last_read_seq > conversation_read_cursors.last_read_seq
+            ''', (conversation_id, user_id, target_seq, datetime.now().isoformat() + 'Z'))
             conn.commit()
 
+            if not marked_count:
+                # Only the user's own (or deleted) messages were past the cursor
+                return {
+                    'success': True,
+                    'reason': 'already_read',
+                    'message': 'All messages already read',
+                    'marked_count': 0,
+                    'last_read_seq': target_seq
+                }
             return {
                 'success': True,
                 'reason': 'marked_as_read',
-                'message': f'{len(unread_messages)} messages marked as read',
-                'marked_count': len(unread_messages)
+                'message': f'{marked_count} messages marked as read',
+                'marked_count': marked_count,
+                'last_read_seq': target_seq
             }
+        except Exception:
+            conn.rollback()
+            raise
         finally:
             conn.close()
 
     # Message operations
+    @staticmethod
+    def _row_to_message(row) -> Dict:
+        """Convert a messages row to a dict with booleans and parsed attachments"""
+        message = dict(row)
+        message['deleted'] = bool(message['deleted'])
+        message['has_attachment'] = bool(message.get('has_attachment', False))
+        message['is_forwarded'] = bool(message.get('is_forwarded', False))
+        message['original_message_id'] = message.get('original_message_id')
+        
+        # Parse attachments JSON if present
+        if message.get('attachments'):
+            try:
+                message['attachments'] = json.loads(message['attachments'])
+            except (json.JSONDecodeError, TypeError):
+                message['attachments'] = []
+        
+        return message
+
     def get_messages(self, conversation_id: str) -> List[Dict]:
-        """Get all messages for a conversation"""
-        import json
+        """Get all messages for a conversation (prefer get_messages_page for API responses)"""
         conn = self.get_connection()
         try:
             cursor = conn.execute('''
@@ -907,30 +1993,85 @@ class MessagingDatabase:
                 ORDER BY timestamp ASC
             ''', (conversation_id,))
             
-            messages = []
-            for row in cursor.fetchall():
-                message = dict(row)
-                message['deleted'] = bool(message['deleted'])
-                message['has_attachment'] = bool(message.get('has_attachment', False))
-                message['is_forwarded'] = bool(message.get('is_forwarded', False))
-                message['original_message_id'] = message.get('original_message_id')
-                
-                # Parse attachments JSON if present
-                if message.get('attachments'):
-                    try:
-                        message['attachments'] = json.loads(message['attachments'])
-                    except (json.JSONDecodeError, TypeError):
-                        message['attachments'] = []
-                
-                messages.append(message)
-            
-            return messages
+            return [self._row_to_message(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+    def get_messages_page(self, conversation_id: str, before: tuple = None, after: tuple = None,
+                          limit: int = 50) -> Dict:
+        """
+        Get one page of a conversation's messages using keyset pagination over
+        (conversation_id, timestamp, id).
+
+        Args:
+            conversation_id: Conversation to page through
+            before: (timestamp, id) key; only messages strictly older are returned
+            after: (timestamp, id) key; only messages strictly newer are returned
+            limit: Maximum number of messages in the page
+
+        Without `after` the page holds the newest messages older than `before`
+        (or the newest overall); with only `after` it holds the oldest messages
+        newer than `after`. Messages are always returned oldest first.
+
+        Returns:
+            Dict with messages, has_more_before and has_more_after
+        """
+        conn = self.get_connection()
+        try:
+            conditions = ['conversation_id = ?']
+            params = [conversation_id]
+            if before:
+                conditions.append('(timestamp, id) < (?, ?)')
+                params.extend(before)
+            if after:
+                conditions.append('(timestamp, id) > (?, ?)')
+                params.extend(after)
+            where = ' AND '.join(conditions)
+
+            # Walk the index towards the requested edge and fetch one extra row
+            # to learn whether more messages exist in that direction
+            newest_first = not after
+            order = 'DESC' if newest_first else 'ASC'
+            cursor = conn.execute(f'''
+                SELECT * FROM messages
+                WHERE {where}
+                ORDER BY timestamp {order}, id {order}
+                LIMIT ?
+            ''', params + [limit + 1])
+            rows = cursor.fetchall()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            if newest_first:
+                rows.reverse()
+            messages = [self._row_to_message(row) for row in rows]
+
+            def exists(comparison, key):
+                cursor = conn.execute(f'''
+                    SELECT 1 FROM messages
+                    WHERE conversation_id = ? AND (timestamp, id) {comparison} (?, ?)
+                    LIMIT 1
+                ''', (conversation_id, *key))
+                return cursor.fetchone() is not None
+
+            if newest_first:
+                has_more_before = has_more
+                edge = (messages[-1]['timestamp'], messages[-1]['id']) if messages else before
+                has_more_after = bool(edge) and exists('>', edge)
+            else:
+                has_more_after = has_more
+                edge = (messages[0]['timestamp'], messages[0]['id']) if messages else after
+                has_more_before = exists('<', edge)
+
+            return {
+                'messages': messages,
+                'has_more_before': has_more_before,
+                'has_more_after': has_more_after
+            }
         finally:
             conn.close()
     
     def get_messages_by_thread(self, thread_id: str) -> List[Dict]:
         """Get all messages in a thread"""
-        import json
         conn = self.get_connection()
         try:
             cursor = conn.execute('''
@@ -939,30 +2080,89 @@ class MessagingDatabase:
                 ORDER BY timestamp ASC
             ''', (thread_id,))
             
-            messages = []
-            for row in cursor.fetchall():
-                message = dict(row)
-                message['deleted'] = bool(message['deleted'])
-                message['has_attachment'] = bool(message.get('has_attachment', False))
-                message['is_forwarded'] = bool(message.get('is_forwarded', False))
-                message['original_message_id'] = message.get('original_message_id')
-                
-                # Parse attachments JSON if present
-                if message.get('attachments'):
-                    try:
-                        message['attachments'] = json.loads(message['attachments'])
-                    except (json.JSONDecodeError, TypeError):
-                        message['attachments'] = []
-                
-                messages.append(message)
-            
-            return messages
+            return [self._row_to_message(row) for row in cursor.fetchall()]
         finally:
             conn.close()
     
+    def search_messages(self, query: str, user_id: str, user_role: str = None, thread_id: str = None,
+                        conversation_id: str = None, after: tuple = None, limit: int = 20) -> Dict:
+        """
+        Full-text search over live messages, best matches first.
+
+        Args:
+            query: Search text (see build_fts_query)
+            user_id: Firebase UID of the caller
+            user_role: Caller's role (admins search every conversation, others only their own)
+            thread_id: Optional thread filter
+            conversation_id: Optional conversation filter
+            after: (rank, rowid, max_rowid) key of the last result of the previous page
+            limit: Maximum number of results
+
+        Returns:
+            Dict with results (messages with snippet, rank and _search_key) and has_more
+
+        Pages are best-effort stable: the first page records the highest message
+        rowid and later pages only consider messages up to it, so messages sent
+        while paging cannot push earlier results onto the next page. bm25 ranks
+        still depend on corpus statistics, so edits, deletes and new messages
+        can move a result across a page boundary (it may be skipped or repeated).
+        """
+        match = build_fts_query(query)
+        if not match:
+            return {'results': [], 'has_more': False}
+
+        filters = []
+        params = {'match': match, 'limit': limit + 1}
+        if user_role not in ['main_admin', 'billing_admin', 'campaign_admin']:
+            filters.append('AND m.conversation_id IN (SELECT conversation_id FROM conversation_members WHERE user_id = :user_id)')
+            params['user_id'] = user_id
+        if thread_id:
+            filters.append('AND m.thread_id = :thread_id')
+            params['thread_id'] = thread_id
+        if conversation_id:
+            filters.append('AND m.conversation_id = :conversation_id')
+            params['conversation_id'] = conversation_id
+        if after:
+            filters.append('AND (bm25(messages_fts), m.rowid) > (:after_rank, :after_rowid)')
+            params['after_rank'], params['after_rowid'], params['max_rowid'] = after
+
+        conn = self.get_connection()
+        try:
+            if not after:
+                params['max_rowid'] = conn.execute('SELECT COALESCE(MAX(rowid), 0) FROM messages').fetchone()[0]
+            # \x02/\x03 mark the hits so the snippet can be HTML-escaped before
+            # they become <mark> tags
+            cursor = conn.execute(f'''
+                SELECT m.*,
+                       m.rowid AS _search_rowid,
+                       bm25(messages_fts) AS _search_rank,
+                       snippet(messages_fts, -1, char(2), char(3), '…', 16) AS _search_snippet
+                FROM messages_fts
+                INNER JOIN messages m ON m.rowid = messages_fts.rowid
+                WHERE messages_fts MATCH :match
+                  AND m.rowid <= :max_rowid
+                  AND m.deleted = FALSE
+                  {' '.join(filters)}
+                ORDER BY _search_rank, m.rowid
+                LIMIT :limit
+            ''', params)
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        results = []
+        for row in rows[:limit]:
+            message = self._row_to_message(row)
+            rowid = message.pop('_search_rowid')
+            message['rank'] = message.pop('_search_rank')
+            message['_search_key'] = (message['rank'], rowid, params['max_rowid'])
+            message['snippet'] = (html.escape(message.pop('_search_snippet') or '')
+                                  .replace('\x02', '<mark>').replace('\x03', '</mark>'))
+            results.append(message)
+        return {'results': results, 'has_more': len(rows) > limit}
+
     def get_last_message(self, conversation_id: str) -> Optional[Dict]:
         """Get the last message in a conversation"""
-        import json
         conn = self.get_connection()
         try:
             cursor = conn.execute('''
@@ -973,22 +2173,7 @@ class MessagingDatabase:
             ''', (conversation_id,))
             
             row = cursor.fetchone()
-            if row:
-                message = dict(row)
-                message['deleted'] = bool(message['deleted'])
-                message['has_attachment'] = bool(message.get('has_attachment', False))
-                message['is_forwarded'] = bool(message.get('is_forwarded', False))
-                message['original_message_id'] = message.get('original_message_id')
-                
-                # Parse attachments JSON if present
-                if message.get('attachments'):
-                    try:
-                        message['attachments'] = json.loads(message['attachments'])
-                    except (json.JSONDecodeError, TypeError):
-                        message['attachments'] = []
-                
-                return message
-            return None
+            return self._row_to_message(row) if row else None
         finally:
             conn.close()
     
@@ -997,7 +2182,6 @@ class MessagingDatabase:
         message_id = message_data.get('id', f"m{uuid.uuid4().hex[:8]}")
         
         # Handle attachments
-        import json
         attachments_json = None
         if message_data.get('attachments'):
             attachments_json = json.dumps(message_data['attachments'])
@@ -1008,8 +2192,9 @@ class MessagingDatabase:
                 INSERT INTO messages 
                 (id, conversation_id, thread_id, sender_id, sender_type, sender_name, type, 
                  content, text_content, caption, filename, file_size, has_attachment, attachments,
-                 timestamp, status, is_forwarded, original_message_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                 timestamp, status, is_forwarded, original_message_id, msg_seq)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                        (SELECT COALESCE(MAX(msg_seq), 0) + 1 FROM messages WHERE conversation_id = ?))
             ''', (
                 message_id,
                 message_data['conversation_id'],
@@ -1028,7 +2213,8 @@ class MessagingDatabase:
                 message_data['timestamp'],
                 message_data.get('status', 'delivered'),
                 message_data.get('is_forwarded', False),
-                message_data.get('original_message_id')
+                message_data.get('original_message_id'),
+                message_data['conversation_id']
             ))
             conn.commit()
             return message_id
@@ -1069,29 +2255,335 @@ class MessagingDatabase:
         
         return self.create_message(forward_data)
 
+    # Blob operations (see blob_store.py)
+    @staticmethod
+    def _row_to_blob(row) -> Dict:
+        blob = dict(row)
+        blob['metadata'] = json.loads(blob['metadata']) if blob.get('metadata') else {}
+        return blob
+
+    def get_blob(self, sha256: str) -> Optional[Dict]:
+        """Get a blob's row (metadata parsed) or None"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('SELECT * FROM blobs WHERE sha256 = ?', (sha256,))
+            row = cursor.fetchone()
+            return self._row_to_blob(row) if row else None
+        finally:
+            conn.close()
+
+    def register_blob(self, sha256: str, size: int, metadata: Dict = None) -> Tuple[Dict, bool]:
+        """
+        Record an uploaded blob, or refresh last_uploaded_at if it is already known
+        (keeping its stored metadata)
+
+        Returns:
+            (blob row, created)
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('''
+                INSERT INTO blobs (sha256, size, metadata) VALUES (?, ?, ?)
+                ON CONFLICT (sha256) DO NOTHING
+            ''', (sha256, size, json.dumps(metadata) if metadata else None))
+            created = cursor.rowcount > 0
+            if not created:
+                conn.execute('''
+                    UPDATE blobs SET last_uploaded_at = CURRENT_TIMESTAMP WHERE sha256 = ?
+                ''', (sha256,))
+            row = conn.execute('SELECT * FROM blobs WHERE sha256 = ?', (sha256,)).fetchone()
+            conn.commit()
+            return self._row_to_blob(row), created
+        finally:
+            conn.close()
+
+    def update_blob_metadata(self, sha256: str, metadata: Dict):
+        """Replace the stored metadata (dimensions, ...) of a blob"""
+        conn = self.get_connection()
+        try:
+            conn.execute('UPDATE blobs SET metadata = ? WHERE sha256 = ?', (json.dumps(metadata), sha256))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def pin_blob(self, sha256: str) -> bool:
+        """
+        Keep a blob whether or not messages reference it. The pin counts as one
+        reference (once), so garbage collection never sees the blob as unreferenced.
+
+        Returns:
+            True if the blob was pinned by this call
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('''
+                UPDATE blobs SET pinned = TRUE, ref_count = ref_count + 1
+                WHERE sha256 = ? AND pinned = FALSE
+            ''', (sha256,))
+            conn.commit()
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def delete_unreferenced_blobs(self, older_than: str, limit: int = 1000) -> List[str]:
+        """
+        Delete blob rows no message references that were last uploaded before older_than
+        (a CURRENT_TIMESTAMP-style 'YYYY-MM-DD HH:MM:SS' string)
+
+        Returns:
+            sha256 of the deleted rows (the caller removes the files)
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('''
+                DELETE FROM blobs
+                WHERE sha256 IN (SELECT sha256 FROM blobs
+                                 WHERE ref_count = 0 AND last_uploaded_at < ?
+                                 LIMIT ?)
+                RETURNING sha256
+            ''', (older_than, limit))
+            deleted = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+            return deleted
+        finally:
+            conn.close()
+
+    # Media job queue (see media_pipeline.py)
+    def enqueue_media_job(self, sha256: str, file_type: str, message_id: str = None) -> int:
+        """Queue a media processing job; returns its ID"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('''
+                INSERT INTO media_jobs (sha256, file_type, message_id, enqueued_at)
+                VALUES (?, ?, ?, ?)
+            ''', (sha256, file_type, message_id, time.time()))
+            conn.commit()
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def claim_media_jobs(self, limit: int) -> List[Dict]:
+        """Mark up to limit queued jobs as running (oldest first) and return them"""
+        conn = self.get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.execute('''
+                UPDATE media_jobs
+                SET status = 'running', attempts = attempts + 1, claimed_at = ?
+                WHERE id IN (SELECT id FROM media_jobs WHERE status = 'queued' ORDER BY id LIMIT ?)
+                RETURNING *
+            ''', (time.time(), limit))
+            jobs = [dict(row) for row in cursor.fetchall()]
+            conn.commit()
+            return sorted(jobs, key=lambda job: job['id'])
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def finish_media_job(self, job_id: int, status: str, error: str = None, timings: Dict = None):
+        """Record a job's outcome: 'done', 'failed', or 'queued' to retry it"""
+        conn = self.get_connection()
+        try:
+            conn.execute('''
+                UPDATE media_jobs
+                SET status = ?, error = ?, timings = ?,
+                    finished_at = CASE WHEN ? = 'queued' THEN NULL ELSE CURRENT_TIMESTAMP END
+                WHERE id = ?
+            ''', (status, error, json.dumps(timings) if timings else None, status, job_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def requeue_running_media_jobs(self, claimed_before: float) -> int:
+        """
+        Put running jobs claimed before claimed_before back in the queue
+
+        Several server processes share the queue, so a running job is only
+        presumed abandoned (its process crashed or restarted) once its claim is
+        older than the job timeout.
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('''
+                UPDATE media_jobs SET status = 'queued'
+                WHERE status = 'running' AND (claimed_at IS NULL OR claimed_at < ?)
+            ''', (claimed_before,))
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def get_media_job_counts(self) -> Dict:
+        """Number of media jobs per status"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('SELECT status, COUNT(*) AS count FROM media_jobs GROUP BY status')
+            return {row['status']: row['count'] for row in cursor.fetchall()}
+        finally:
+            conn.close()
+
+    def update_message_attachments(self, message_id: str, sha256: str, metadata: Dict,
+                                   processing: str) -> Optional[Dict]:
+        """
+        Merge metadata into a message's attachments with the given sha256 and set
+        their processing state
+
+        Returns:
+            The updated message, or None if the message has no such attachment
+        """
+        conn = self.get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT attachments FROM messages WHERE id = ?', (message_id,)).fetchone()
+            try:
+                attachments = json.loads(row['attachments']) if row and row['attachments'] else []
+            except (json.JSONDecodeError, TypeError):
+                attachments = []
+            patched = False
+            for attachment in attachments:
+                if isinstance(attachment, dict) and attachment.get('sha256') == sha256:
+                    attachment.update(metadata)
+                    attachment['processing'] = processing
+                    patched = True
+            if not patched:
+                conn.rollback()
+                return None
+            conn.execute('UPDATE messages SET attachments = ? WHERE id = ?',
+                         (json.dumps(attachments), message_id))
+            row = conn.execute('SELECT * FROM messages WHERE id = ?', (message_id,)).fetchone()
+            conn.commit()
+            return self._row_to_message(row)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def create_upload_session(self, session_id: str, user_id: str, filename: str, size: int,
+                              expected_sha256: str = None, expires_at: float = None) -> Dict:
+        """Record a new resumable upload; returns the session row"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute('''
+                INSERT INTO upload_sessions (id, user_id, filename, size, expected_sha256, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                RETURNING *
+            ''', (session_id, user_id, filename, size, expected_sha256, expires_at)).fetchone()
+            conn.commit()
+            return dict(row)
+        finally:
+            conn.close()
+
+    def get_upload_session(self, session_id: str) -> Optional[Dict]:
+        """Get a resumable upload session by ID"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute('SELECT * FROM upload_sessions WHERE id = ?', (session_id,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def advance_upload_session(self, session_id: str, offset: int, received: int, expires_at: float) -> bool:
+        """
+        Move an active session from offset to received bytes and extend its expiry
+
+        Returns:
+            False if the session is no longer active at offset (another append won)
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('''
+                UPDATE upload_sessions SET received = ?, expires_at = ?
+                WHERE id = ? AND received = ? AND status = 'active'
+            ''', (received, expires_at, session_id, offset))
+            conn.commit()
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def complete_upload_session(self, session_id: str, sha256: str, expires_at: float) -> bool:
+        """Mark a fully received session as finalized into blob sha256"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('''
+                UPDATE upload_sessions SET status = 'completed', sha256 = ?, expires_at = ?
+                WHERE id = ? AND status = 'active' AND received = size
+            ''', (sha256, expires_at, session_id))
+            conn.commit()
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def delete_upload_session(self, session_id: str) -> bool:
+        """Remove a session (the caller removes its staged file)"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('DELETE FROM upload_sessions WHERE id = ?', (session_id,))
+            conn.commit()
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def delete_expired_upload_sessions(self, now: float, limit: int = 1000) -> List[Dict]:
+        """
+        Delete sessions that expired before now
+
+        Returns:
+            id and status of the deleted rows (the caller removes staged files)
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('''
+                DELETE FROM upload_sessions
+                WHERE id IN (SELECT id FROM upload_sessions WHERE expires_at < ? LIMIT ?)
+                RETURNING id, status
+            ''', (now, limit))
+            deleted = [dict(row) for row in cursor.fetchall()]
+            conn.commit()
+            return deleted
+        finally:
+            conn.close()
+
+    def get_upload_session_counts(self) -> Dict:
+        """Number of upload sessions per status and bytes staged by active ones"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('''
+                SELECT status, COUNT(*) AS count, COALESCE(SUM(received), 0) AS received
+                FROM upload_sessions GROUP BY status
+            ''')
+            rows = cursor.fetchall()
+            counts = {row['status']: row['count'] for row in rows}
+            counts['staged_bytes'] = sum(row['received'] for row in rows if row['status'] == 'active')
+            return counts
+        finally:
+            conn.close()
+
+    def get_blob_stats(self) -> Dict:
+        """Blob count, stored bytes and bytes saved by deduplication"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('''
+                SELECT COUNT(*) AS blobs,
+                       COALESCE(SUM(size), 0) AS stored_bytes,
+                       COALESCE(SUM(size * MAX(ref_count - pinned - 1, 0)), 0) AS deduplicated_bytes,
+                       COALESCE(SUM(ref_count = 0), 0) AS unreferenced_blobs,
+                       COALESCE(SUM(pinned), 0) AS pinned_blobs
+                FROM blobs
+            ''')
+            return dict(cursor.fetchone())
+        finally:
+            conn.close()
+
     def get_message_by_id(self, message_id: str) -> Optional[Dict]:
         """Get message by ID"""
         conn = self.get_connection()
         try:
             cursor = conn.execute('SELECT * FROM messages WHERE id = ?', (message_id,))
             row = cursor.fetchone()
-            if row:
-                message = dict(row)
-                message['deleted'] = bool(message['deleted'])
-                message['has_attachment'] = bool(message.get('has_attachment', False))
-                message['is_forwarded'] = bool(message.get('is_forwarded', False))
-                message['original_message_id'] = message.get('original_message_id')
-                
-                # Parse attachments JSON
-                if message.get('attachments'):
-                    import json
-                    try:
-                        message['attachments'] = json.loads(message['attachments'])
-                    except:
-                        message['attachments'] = []
-                
-                return message
-            return None
+            return self._row_to_message(row) if row else None
         finally:
             conn.close()
     
@@ -1113,54 +2605,179 @@ class MessagingDatabase:
         finally:
             conn.close()
     
+    # Delta sync
+    def get_changes_since(self, user_id: str, user_role: str = None, since: int = 0, limit: int = 200,
+                          thread_id: str = None, conversation_id: str = None) -> Dict:
+        """
+        Get everything visible to a user that changed after a sync watermark.
+
+        Visibility follows the thread list: admins see every conversation, others
+        only conversations they participate in (plus threads they own).
+
+        Args:
+            user_id: Firebase UID of the caller
+            user_role: Caller's role (admins see all conversations)
+            since: Watermark from a previous call (0 for everything since sync was enabled)
+            limit: Maximum rows per change type
+            thread_id: Optional thread filter
+            conversation_id: Optional conversation filter
+
+        Returns:
+            Dict with threads, conversations, messages (including soft deletes),
+            read_receipts, the new watermark and has_more (call again with the
+            watermark to fetch the rest)
+        """
+        is_admin = user_role in ['main_admin', 'billing_admin', 'campaign_admin']
+
+        conv_filters = []
+        params = {'user_id': user_id, 'since': since, 'limit': limit + 1}
+        if not is_admin:
+            conv_filters.append('AND c.id IN (SELECT conversation_id FROM conversation_members WHERE user_id = :user_id)')
+        if thread_id:
+            conv_filters.append('AND c.thread_id = :thread_id')
+            params['thread_id'] = thread_id
+        if conversation_id:
+            conv_filters.append('AND c.id = :conversation_id')
+            params['conversation_id'] = conversation_id
+        visible_conversations = f"SELECT c.id FROM conversations c WHERE 1 = 1 {' '.join(conv_filters)}"
+
+        thread_filters = []
+        if not is_admin:
+            thread_filters.append(f'''
+                AND (t.created_by = :user_id
+                     OR t.id IN (SELECT thread_id FROM conversation_members WHERE user_id = :user_id))
+            ''')
+        if thread_id:
+            thread_filters.append('AND t.id = :thread_id')
+        if conversation_id:
+            thread_filters.append('AND t.id = (SELECT thread_id FROM conversations WHERE id = :conversation_id)')
+
+        conn = self.get_connection()
+        try:
+            # One read transaction so the watermark and every change list come
+            # from the same snapshot
+            conn.execute('BEGIN')
+            watermark = conn.execute('SELECT value FROM sync_sequence WHERE id = 1').fetchone()[0]
+            params['watermark'] = watermark
+
+            queries = {
+                'threads': f'''
+                    SELECT t.* FROM threads t
+                    WHERE t.change_seq > :since AND t.change_seq <= :watermark
+                    {' '.join(thread_filters)}
+                    ORDER BY t.change_seq LIMIT :limit
+                ''',
+                'conversations': f'''
+                    SELECT c.*, {self._CONVERSATION_PARTICIPANT_COLUMNS}
+                    FROM conversations c
+                    LEFT JOIN users u1 ON u1.firebase_uid = c.participant1_id
+                    LEFT JOIN users u2 ON u2.firebase_uid = c.participant2_id
+                    WHERE c.change_seq > :since AND c.change_seq <= :watermark
+                    AND c.id IN ({visible_conversations})
+                    ORDER BY c.change_seq LIMIT :limit
+                ''',
+                'messages': f'''
+                    SELECT m.* FROM messages m
+                    WHERE m.change_seq > :since AND m.change_seq <= :watermark
+                    AND m.conversation_id IN ({visible_conversations})
+                    ORDER BY m.change_seq LIMIT :limit
+                ''',
+                'read_receipts': f'''
+                    SELECT rc.conversation_id, rc.user_id, rc.last_read_seq, rc.read_at, rc.change_seq
+                    FROM conversation_read_cursors rc
+                    WHERE rc.change_seq > :since AND rc.change_seq <= :watermark
+                    AND rc.conversation_id IN ({visible_conversations})
+                    ORDER BY rc.change_seq LIMIT :limit
+                '''
+            }
+            changes = {key: [dict(row) for row in conn.execute(query, params).fetchall()]
+                       for key, query in queries.items()}
+            conn.commit()
+        finally:
+            conn.close()
+
+        # If any list overflowed, only report up to the lowest sequence that is
+        # complete in every list; the client resumes from there.
+        has_more = False
+        for rows in changes.values():
+            if len(rows) > limit:
+                has_more = True
+                watermark = min(watermark, rows[limit - 1]['change_seq'])
+        for key, rows in changes.items():
+            changes[key] = [row for row in rows if row['change_seq'] <= watermark]
+
+        changes['conversations'] = [self._apply_participant_fields(conv) for conv in changes['conversations']]
+        changes['messages'] = [self._row_to_message(message) for message in changes['messages']]
+        changes['watermark'] = watermark
+        changes['has_more'] = has_more
+        return changes
+
     # Statistics
     def get_stats(self) -> Dict:
-        """Get messaging statistics"""
+        """Get messaging statistics (trigger-maintained counters, see _STATS_COUNTERS)"""
         conn = self.get_connection()
         try:
-            cursor = conn.execute('''
-                SELECT COUNT(*) as total_users
-                FROM users
-            ''')
-            stats = dict(cursor.fetchone())
-            
-            cursor = conn.execute('''
-                SELECT 
-                    COUNT(*) as total_threads
-                FROM threads
-                WHERE status = 'active'
-            ''')
-            stats.update(dict(cursor.fetchone()))
-            
-            cursor = conn.execute('''
-                SELECT 
-                    COUNT(*) as total_conversations,
-                    COALESCE(SUM(unread_count), 0) as unread_messages
-                FROM conversations
-                WHERE status = 'active'
-            ''')
-            stats.update(dict(cursor.fetchone()))
-            
-            cursor = conn.execute('''
-                SELECT COUNT(*) as total_messages
-                FROM messages
-                WHERE deleted = FALSE
-            ''')
-            stats.update(dict(cursor.fetchone()))
-            
-            cursor = conn.execute('''
-                SELECT COUNT(DISTINCT id) as messages_with_attachments
-                FROM messages
-                WHERE deleted = FALSE
-                AND has_attachment = TRUE
-            ''')
-            stats.update(dict(cursor.fetchone()))
-            
-            return stats
+            cursor = conn.execute('SELECT name, value FROM stats_counters')
+            counters = {row['name']: row['value'] for row in cursor.fetchall()}
+            return {name: counters.get(name, 0) for name in self._STATS_COUNTERS}
         finally:
             conn.close()
 
 
+def encode_message_cursor(message: Dict) -> str:
+    """Encode a message's (timestamp, id) keyset position as an opaque cursor"""
+    raw = json.dumps([message['timestamp'], message['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_message_cursor(cursor: str) -> tuple:
+    """Decode a cursor from encode_message_cursor; raises ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, message_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+    if not isinstance(timestamp, str) or not isinstance(message_id, str):
+        raise ValueError(f'Invalid cursor: {cursor}')
+    return timestamp, message_id
+
+
+def build_fts_query(text: str, max_terms: int = 16) -> Optional[str]:
+    """
+    Turn user search text into an FTS5 query: every word must match, the last
+    one as a prefix (search as you type). Words are quoted, so FTS5 operators
+    and punctuation in the input are treated as text.
+
+    Returns:
+        The MATCH expression, or None if the text has no words
+    """
+    terms = re.findall(r'\w+', text or '')[:max_terms]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def encode_search_cursor(key: tuple) -> str:
+    """Encode a search result's (rank, rowid, max_rowid) position as an opaque cursor"""
+    raw = json.dumps(list(key), separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_search_cursor(cursor: str) -> tuple:
+    """Decode a cursor from encode_search_cursor; raises ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        rank, rowid, max_rowid = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+    if (not isinstance(rank, (int, float)) or isinstance(rank, bool)
+            or not all(isinstance(value, int) and not isinstance(value, bool) for value in (rowid, max_rowid))):
+        raise ValueError(f'Invalid cursor: {cursor}')
+    return float(rank), rowid, max_rowid
+
+
 # Global database instance
 _db_instance = None
 
@@ -1171,8 +2788,8 @@ def get_db() -> MessagingDatabase:
         _db_instance = MessagingDatabase()
     return _db_instance
 
-def init_db(db_path: str = "messaging.db"):
+def init_db(db_path: str = "messaging.db", storage_profile: str = None):
     """Initialize database with custom path"""
     global _db_instance
-    _db_instance = MessagingDatabase(db_path)
+    _db_instance = MessagingDatabase(db_path, storage_profile)
     return _db_instance
@@ -0,0 +1,283 @@
+"""
+SQLite Connection Pool Module
+Reuses connections across MessagingDatabase calls instead of opening one per query
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from logger_config import logger
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', 60))
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available in time"""
+    pass
+
+
+class PooledConnection:
+    """
+    Proxy handed out by the pool.
+
+    Behaves like a sqlite3.Connection, except that close() hands the
+    connection back to the pool instead of closing it. This keeps the
+    existing `conn = get_connection() ... finally: conn.close()` pattern
+    working unchanged.
+
+    A nested checkout taken while the outer one has a transaction open runs
+    inside a SAVEPOINT: its commit() releases the savepoint (the outer
+    transaction decides whether the work is kept), its rollback() only undoes
+    its own statements, and a BEGIN it issues is absorbed by the savepoint.
+    """
+
+    def __init__(self, pool, conn: sqlite3.Connection, savepoint: str = None):
+        self._pool = pool
+        self._conn = conn
+        self._savepoint = savepoint
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        if not self._savepoint:
+            self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._savepoint:
+            return self._conn.__exit__(exc_type, exc, tb)
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def execute(self, sql: str, *args):
+        if self._savepoint and sql.lstrip()[:5].upper() == 'BEGIN':
+            # Already inside the outer transaction: the savepoint is this checkout's transaction
+            return self._conn.cursor()
+        return self._conn.execute(sql, *args)
+
+    def commit(self):
+        if not self._savepoint:
+            return self._conn.commit()
+        # Fold the work into the outer transaction and keep isolating what follows
+        self._conn.execute(f'RELEASE SAVEPOINT {self._savepoint}')
+        self._conn.execute(f'SAVEPOINT {self._savepoint}')
+
+    def rollback(self):
+        if not self._savepoint:
+            return self._conn.rollback()
+        self._conn.execute(f'ROLLBACK TO SAVEPOINT {self._savepoint}')
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            if self._savepoint:
+                try:
+                    self._conn.execute(f'RELEASE SAVEPOINT {self._savepoint}')
+                except sqlite3.Error as e:
+                    # The outer checkout ended its transaction underneath us
+                    logger.warning(f"Could not release savepoint {self._savepoint}: {e}")
+            self._pool._release(self._conn)
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections with per-thread reuse.
+
+    - A thread that already holds a connection gets the same one back on
+      nested checkouts (e.g. create_or_update_user -> get_user_by_firebase_uid),
+      so a request never needs more than one connection per thread. If the
+      outer checkout has a transaction open, the nested one runs in a SAVEPOINT
+      so its commit/rollback cannot end the outer transaction.
+    - At most `max_size` connections are open; extra callers wait up to
+      `timeout` seconds and then get PoolTimeoutError.
+    - Idle connections are health checked with `SELECT 1` before reuse once
+      they have been idle longer than `health_check_interval`.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], max_size: int = DB_POOL_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT,
+                 health_check_interval: float = DB_POOL_HEALTH_CHECK_INTERVAL):
+        self._connect = connect
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        self._lock = threading.Condition(threading.Lock())
+        self._idle = deque()  # (connection, last_used)
+        self._open_count = 0
+        self._local = threading.local()
+
+        # Metrics
+        self._checkouts = 0
+        self._reentrant_checkouts = 0
+        self._savepoints = 0
+        self._created = 0
+        self._discarded = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+
+    def acquire(self) -> PooledConnection:
+        """Check out a connection (reusing the calling thread's one if held)"""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            savepoint = None
+            if held.in_transaction:
+                savepoint = f'pool_checkout_{self._local.depth}'
+                try:
+                    held.execute(f'SAVEPOINT {savepoint}')
+                except sqlite3.Error:
+                    self._local.depth -= 1
+                    raise
+            with self._lock:
+                self._checkouts += 1
+                self._reentrant_checkouts += 1
+                if savepoint:
+                    self._savepoints += 1
+            return PooledConnection(self, held, savepoint)
+
+        conn = self._checkout()
+        self._local.conn = conn
+        self._local.depth = 1
+        return PooledConnection(self, conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager API: `with pool.connection() as conn: ...`"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _checkout(self) -> sqlite3.Connection:
+        started = time.monotonic()
+        waited = False
+
+        with self._lock:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._open_count < self.max_size:
+                    self._open_count += 1
+                    conn, last_used = None, None
+                    break
+
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"Timed out after {self.timeout}s waiting for a database connection "
+                        f"(pool size {self.max_size})"
+                    )
+                waited = True
+                self._lock.wait(remaining)
+
+            self._checkouts += 1
+            if waited:
+                wait_time = time.monotonic() - started
+                self._waits += 1
+                self._wait_time_total += wait_time
+                self._wait_time_max = max(self._wait_time_max, wait_time)
+
+        if conn is not None and not self._is_healthy(conn, last_used):
+            self._discard(conn, reopen=True)
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._open_count -= 1
+                    self._lock.notify()
+                raise
+            with self._lock:
+                self._created += 1
+
+        return conn
+
+    def _is_healthy(self, conn: sqlite3.Connection, last_used: float) -> bool:
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"Discarding unhealthy pooled connection: {e}")
+            return False
+
+    def _discard(self, conn: sqlite3.Connection, reopen: bool = False):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._discarded += 1
+            if not reopen:
+                self._open_count -= 1
+                self._lock.notify()
+
+    def _release(self, conn: sqlite3.Connection):
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        self._local.conn = None
+
+        # Never hand a connection with a dangling transaction to the next caller
+        try:
+            if conn.in_transaction:
+                logger.warning("Rolling back uncommitted transaction on pooled connection release")
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._lock:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+                self._open_count -= 1
+
+    def stats(self) -> Dict:
+        """Pool metrics snapshot"""
+        with self._lock:
+            idle = len(self._idle)
+            return {
+                'max_size': self.max_size,
+                'open': self._open_count,
+                'idle': idle,
+                'in_use': self._open_count - idle,
+                'checkouts': self._checkouts,
+                'reentrant_checkouts': self._reentrant_checkouts,
+                'nested_savepoints': self._savepoints,
+                'connections_created': self._created,
+                'connections_discarded': self._discarded,
+                'waits': self._waits,
+                'wait_time_total_ms': round(self._wait_time_total * 1000, 3),
+                'wait_time_max_ms': round(self._wait_time_max * 1000, 3),
+                'timeouts': self._timeouts
+            }
@@ -0,0 +1,79 @@
+"""
+SQLite Storage Profile Module
+PRAGMA presets applied to every connection opened for messaging.db
+"""
+import os
+import sqlite3
+from typing import Dict
+
+from logger_config import logger
+
+# Each profile lists the PRAGMAs applied to every new connection plus the
+# WAL checkpoint policy. See README "Storage Profiles" for benchmark numbers.
+STORAGE_PROFILES = {
+    # SQLite defaults (rollback journal). Kept for comparison and as an escape hatch.
+    'legacy': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+        'checkpoint_interval': 0
+    },
+    # WAL so readers never block on the writer, but every commit is fsynced.
+    # Survives power loss without losing committed messages.
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -16000,           # 16MB page cache
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,
+        'wal_autocheckpoint': 1000,     # pages (~4MB WAL)
+        'journal_size_limit': 67108864, # truncate WAL back to 64MB after checkpoints
+        'checkpoint_interval': 60       # seconds between background PASSIVE checkpoints
+    },
+    # WAL with fsync only at checkpoints. A power loss can drop the last few
+    # commits (never corrupts the file); an application crash loses nothing.
+    'throughput': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,           # 64MB page cache
+        'mmap_size': 268435456,         # 256MB memory-mapped reads
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000,
+        'wal_autocheckpoint': 4000,     # pages (~16MB WAL)
+        'journal_size_limit': 134217728,
+        'checkpoint_interval': 30
+    }
+}
+
+DEFAULT_STORAGE_PROFILE = 'durable'
+
+# Per-connection PRAGMAs in the order they are applied
+_CONNECTION_PRAGMAS = ['journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store',
+                       'busy_timeout', 'wal_autocheckpoint', 'journal_size_limit']
+
+
+def get_storage_profile(name: str = None) -> Dict:
+    """
+    Resolve a storage profile by name (falls back to DB_STORAGE_PROFILE env var)
+
+    Args:
+        name: Profile name (legacy, durable, throughput)
+
+    Returns:
+        Dict with the profile name and its settings
+    """
+    name = (name or os.getenv('DB_STORAGE_PROFILE') or DEFAULT_STORAGE_PROFILE).lower()
+    if name not in STORAGE_PROFILES:
+        logger.warning(f"Unknown DB_STORAGE_PROFILE '{name}', using '{DEFAULT_STORAGE_PROFILE}'")
+        name = DEFAULT_STORAGE_PROFILE
+    return dict(STORAGE_PROFILES[name], name=name)
+
+
+def apply_storage_profile(conn: sqlite3.Connection, profile: Dict):
+    """Apply a storage profile's PRAGMAs to a freshly opened connection"""
+    for pragma in _CONNECTION_PRAGMAS:
+        if pragma in profile:
+            # PRAGMA values cannot be bound as parameters; they come from the
+            # static profile table above, never from user input.
+            conn.execute(f"PRAGMA {pragma} = {profile[pragma]}").fetchall()
@@ -8,8 +8,10 @@ from logger_config import logger
 import json
 from functools import wraps
 from flask import request, jsonify
+from werkzeug.exceptions import HTTPException
 import firebase_admin
 from firebase_admin import credentials, auth
+from token_cache import token_cache
 
 # Initialize Firebase Admin SDK
 _firebase_initialized = False
@@ -53,6 +55,10 @@ def verify_firebase_token(id_token):
     """
     Verify Firebase ID token and return decoded token
     
+    Tokens that verified successfully are cached until their `exp` claim
+    (see token_cache.py), so repeat requests with the same token skip the
+    signature check.
+    
     Args:
         id_token (str): Firebase ID token from client
         
@@ -65,9 +71,13 @@ def verify_firebase_token(id_token):
     if not _firebase_initialized:
         raise Exception("Firebase Admin SDK not initialized. Check service account credentials.")
     
+    return token_cache.get_or_verify(id_token, _verify_id_token)
+
+def _verify_id_token(id_token, check_revoked=False):
+    """Verify a token with the Firebase Admin SDK (uncached)"""
     try:
         # Verify the ID token
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = auth.verify_id_token(id_token, check_revoked=check_revoked)
         return decoded_token
     except auth.InvalidIdTokenError as e:
         logger.error(f"Invalid Firebase ID token: {str(e)}")
@@ -82,10 +92,14 @@ def verify_firebase_token(id_token):
         logger.error(f"Token verification failed: {str(e)}")
         raise Exception(f"Token verification failed: {str(e)}")
 
-def get_token_from_request():
+def get_token_from_request(allow_query_param=False):
     """
     Extract Firebase ID token from request headers
     
+    Args:
+        allow_query_param (bool): Also accept ?access_token= (for EventSource
+            clients, which cannot set request headers)
+    
     Returns:
         str: Firebase ID token or None
     """
@@ -99,6 +113,9 @@ def get_token_from_request():
     if firebase_token:
         return firebase_token
     
+    if allow_query_param:
+        return request.args.get('access_token') or None
+    
     return None
 
 def require_auth(f):
@@ -114,10 +131,22 @@ def require_auth(f):
             user_email = request.user['email']
             return jsonify({'message': 'Success'})
     """
+    return _require_auth(f, allow_query_param=False)
+
+def require_stream_auth(f):
+    """
+    Like require_auth, but also accepts the token as ?access_token=
+    
+    Only use this for streaming endpoints consumed by the browser EventSource
+    API, which cannot send an Authorization header.
+    """
+    return _require_auth(f, allow_query_param=True)
+
+def _require_auth(f, allow_query_param):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         # Get token from request
-        id_token = get_token_from_request()
+        id_token = get_token_from_request(allow_query_param)
         
         if not id_token:
             return jsonify({
@@ -142,6 +171,10 @@ def require_auth(f):
             # Call the original function
             return f(*args, **kwargs)
             
+        except HTTPException:
+            # Raised by the view or request parsing (e.g. 413 for an oversized upload),
+            # not an authentication problem
+            raise
         except Exception as e:
             import traceback
             error_details = traceback.format_exc()
@@ -1,11 +1,16 @@
 """
 Hyptrb API Integration Module
 Handles all interactions with the Hyptrb API for user profile fetching
+(lookups are cached, see hyptrb_cache.py; HTTP goes through hyptrb_client.py)
 """
 import requests
 import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
 from urllib.parse import quote as _quote
 from typing import Optional, Dict
+from hyptrb_cache import cached, NotFound
+from hyptrb_client import client
 
 def quote(s):
     """URL encode string, encoding slashes as well"""
@@ -16,6 +21,13 @@ def quote(s):
 HYPTRB_BASE_URL = os.getenv('HYPTRB_API_BASE_URL', "https://hyptrb-service-mzr8k.ondigitalocean.app/")
 HYPTRB_INTERNAL_TOKEN = os.getenv('HYPTRB_INTERNAL_TOKEN')
 
+# Concurrent page fetching (fetch_all_influencer_jobs)
+HYPTRB_PAGE_WORKERS = int(os.getenv('HYPTRB_PAGE_WORKERS', 4))
+HYPTRB_PAGE_TIMEOUT = float(os.getenv('HYPTRB_PAGE_TIMEOUT', 15))
+
+# Shared and bounded, so concurrent syncs cannot flood Hyptrb with page requests
+_page_executor = ThreadPoolExecutor(max_workers=max(1, HYPTRB_PAGE_WORKERS), thread_name_prefix='hyptrb-pages')
+
 def _auth_headers():
     headers = {
         'Accept': 'application/json'
@@ -43,6 +55,13 @@ class HyptrbAPIError(Exception):
     """Custom exception for Hyptrb API errors"""
     pass
 
+class HyptrbPartialResult(HyptrbAPIError):
+    """Raised when only part of a multi-page result could be fetched; `result` holds what was fetched"""
+    def __init__(self, message, result):
+        super().__init__(message)
+        self.result = result
+
+@cached('user_role')
 def fetch_user_role(email: str) -> Optional[Dict]:
     """
     Fetch user role from Hyptrb API
@@ -58,10 +77,10 @@ def fetch_user_role(email: str) -> Optional[Dict]:
     """
     try:
         url = f"{HYPTRB_BASE_URL}roles/{quote(email)}"
-        response = requests.get(url, timeout=10, headers=_auth_headers())
+        response = client.get('user_role', url, headers=_auth_headers())
         
         if response.status_code == 404:
-            return None
+            return NotFound(None)
         
         if response.status_code != 200:
             raise HyptrbAPIError(f"Failed to fetch user role: {response.status_code}")
@@ -70,6 +89,7 @@ def fetch_user_role(email: str) -> Optional[Dict]:
     except requests.exceptions.RequestException as e:
         raise HyptrbAPIError(f"Network error fetching user role: {str(e)}")
 
+@cached('client_profile')
 def fetch_client_profile(email: str) -> Optional[Dict]:
     """
     Fetch client profile from Hyptrb API
@@ -85,10 +105,10 @@ def fetch_client_profile(email: str) -> Optional[Dict]:
     """
     try:
         url = f"{HYPTRB_BASE_URL}internal-endpoints/get/client-profile/{quote(email)}"
-        response = requests.get(url, timeout=10, headers=_auth_headers())
+        response = client.get('client_profile', url, headers=_auth_headers())
         
         if response.status_code == 404:
-            return None
+            return NotFound(None)
         
         if response.status_code != 200:
             raise HyptrbAPIError(f"Failed to fetch client profile: {response.status_code}")
@@ -97,6 +117,7 @@ def fetch_client_profile(email: str) -> Optional[Dict]:
     except requests.exceptions.RequestException as e:
         raise HyptrbAPIError(f"Network error fetching client profile: {str(e)}")
 
+@cached('admin_profile')
 def fetch_admin_profile(email: str) -> Optional[Dict]:
     """
     Fetch admin profile from Hyptrb API
@@ -112,10 +133,10 @@ def fetch_admin_profile(email: str) -> Optional[Dict]:
     """
     try:
         url = f"{HYPTRB_BASE_URL}internal-endpoints/get/admin-profile/{quote(email)}"
-        response = requests.get(url, timeout=10, headers=_auth_headers())
+        response = client.get('admin_profile', url, headers=_auth_headers())
         
         if response.status_code == 404:
-            return None
+            return NotFound(None)
         
         if response.status_code != 200:
             raise HyptrbAPIError(f"Failed to fetch admin profile: {response.status_code}")
@@ -124,6 +145,7 @@ def fetch_admin_profile(email: str) -> Optional[Dict]:
     except requests.exceptions.RequestException as e:
         raise HyptrbAPIError(f"Network error fetching admin profile: {str(e)}")
 
+@cached('influencer_profile')
 def fetch_influencer_profile(influencer_uid: str) -> Optional[Dict]:
     """
     Fetch influencer profile from Hyptrb API
@@ -139,10 +161,10 @@ def fetch_influencer_profile(influencer_uid: str) -> Optional[Dict]:
     """
     try:
         url = f"{HYPTRB_BASE_URL}internal-endpoints/get/influencer-profile/{quote(influencer_uid)}"
-        response = requests.get(url, timeout=10, headers=_auth_headers())
+        response = client.get('influencer_profile', url, headers=_auth_headers())
         
         if response.status_code == 404:
-            return None
+            return NotFound(None)
         
         if response.status_code != 200:
             raise HyptrbAPIError(f"Failed to fetch influencer profile: {response.status_code}")
@@ -201,6 +223,7 @@ def extract_display_name(profile: Dict, role: str) -> str:
     else:
         return 'Unknown User'
 
+@cached('client_campaigns')
 def fetch_client_campaigns(client_email: str) -> list:
     """
     Fetch all campaigns for a client from Hyptrb API
@@ -216,10 +239,10 @@ def fetch_client_campaigns(client_email: str) -> list:
     """
     try:
         url = f"{HYPTRB_BASE_URL}internal-endpoints/get-client/campaign/{quote(client_email)}"
-        response = requests.get(url, timeout=10, headers=_auth_headers())
+        response = client.get('client_campaigns', url, headers=_auth_headers())
         
         if response.status_code == 404:
-            return []
+            return NotFound([])
         
         if response.status_code != 200:
             raise HyptrbAPIError(f"Failed to fetch client campaigns: {response.status_code}")
@@ -236,6 +259,7 @@ def fetch_client_campaigns(client_email: str) -> list:
     except requests.exceptions.RequestException as e:
         raise HyptrbAPIError(f"Network error fetching client campaigns: {str(e)}")
 
+@cached('influencer_collaborations')
 def fetch_influencer_collaborations(influencer_uid: str, page: int = 1, limit: int = 100) -> Dict:
     """
     Fetch collaborations (campaigns) for an influencer from Hyptrb API
@@ -254,10 +278,10 @@ def fetch_influencer_collaborations(influencer_uid: str, page: int = 1, limit: i
     try:
         url = f"{HYPTRB_BASE_URL}internal-endpoints/get/clients/collaborations/{quote(influencer_uid)}"
         params = {'page': page, 'limit': limit}
-        response = requests.get(url, params=params, timeout=10, headers=_auth_headers())
+        response = client.get('influencer_collaborations', url, params=params, headers=_auth_headers())
         
         if response.status_code == 404:
-            return {'current_clients': [], 'past_clients': []}
+            return NotFound({'current_clients': [], 'past_clients': []})
         
         if response.status_code != 200:
             raise HyptrbAPIError(f"Failed to fetch influencer collaborations: {response.status_code}")
@@ -266,6 +290,7 @@ def fetch_influencer_collaborations(influencer_uid: str, page: int = 1, limit: i
     except requests.exceptions.RequestException as e:
         raise HyptrbAPIError(f"Network error fetching influencer collaborations: {str(e)}")
 
+@cached('influencer_jobs')
 def fetch_influencer_jobs(influencer_uid: str, page: int = 1) -> Dict:
     """
     Fetch jobs/campaigns for an influencer from Hyptrb API
@@ -288,16 +313,16 @@ def fetch_influencer_jobs(influencer_uid: str, page: int = 1) -> Dict:
     try:
         url = f"{HYPTRB_BASE_URL}internal-endpoints/get/influencer/jobs/{quote(influencer_uid)}"
         params = {'page': page}
-        response = requests.get(url, params=params, timeout=10, headers=_auth_headers())
+        response = client.get('influencer_jobs', url, params=params, headers=_auth_headers())
         
         if response.status_code == 404:
-            return {
+            return NotFound({
                 'influencer_uid': influencer_uid,
                 'totalJobs': 0,
                 'totalPages': 0,
                 'currentPage': page,
                 'jobs': []
-            }
+            })
         
         if response.status_code != 200:
             raise HyptrbAPIError(f"Failed to fetch influencer jobs: {response.status_code}")
@@ -305,3 +330,51 @@ def fetch_influencer_jobs(influencer_uid: str, page: int = 1) -> Dict:
         return response.json()
     except requests.exceptions.RequestException as e:
         raise HyptrbAPIError(f"Network error fetching influencer jobs: {str(e)}")
+
+def fetch_all_influencer_jobs(influencer_uid: str, page_timeout: float = HYPTRB_PAGE_TIMEOUT) -> list:
+    """
+    Fetch the jobs on every page for an influencer
+    
+    Page 1 is fetched first to learn the page count; the remaining pages are
+    fetched concurrently on a bounded worker pool (HYPTRB_PAGE_WORKERS).
+    
+    Args:
+        influencer_uid: Influencer's unique identifier
+        page_timeout: Seconds to wait for the remaining pages
+        
+    Returns:
+        List of job objects from all pages, in page order
+        
+    Raises:
+        HyptrbAPIError: If the first page cannot be fetched
+        HyptrbPartialResult: If some later pages failed or timed out (`result` has the jobs that arrived)
+    """
+    first_page = fetch_influencer_jobs(influencer_uid, page=1)
+    total_pages = first_page.get('totalPages', 1) or 1
+    jobs_by_page = {1: first_page.get('jobs', [])}
+    
+    # Copy the context so a cache bypass (forced refresh) applies to the page workers too
+    futures = {
+        _page_executor.submit(contextvars.copy_context().run, fetch_influencer_jobs, influencer_uid, page): page
+        for page in range(2, total_pages + 1)
+    }
+    done, not_done = wait(futures, timeout=page_timeout)
+    
+    failed_pages = []
+    for future in not_done:
+        future.cancel()
+        failed_pages.append(futures[future])
+    for future in done:
+        try:
+            jobs_by_page[futures[future]] = future.result().get('jobs', [])
+        except Exception:
+            failed_pages.append(futures[future])
+    
+    all_jobs = [job for page in sorted(jobs_by_page) for job in jobs_by_page[page]]
+    if failed_pages:
+        raise HyptrbPartialResult(
+            f"Fetched {len(jobs_by_page)} of {total_pages} job pages; "
+            f"missing pages {sorted(failed_pages)}",
+            all_jobs
+        )
+    return all_jobs
@@ -0,0 +1,343 @@
+"""
+Hyptrb API Cache Module
+TTL + LRU cache for hyptrb_api lookups, with negative caching and stale-while-revalidate
+"""
+import contextvars
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+from logger_config import logger
+
+# memory (default), sqlite (survives restarts) or none
+HYPTRB_CACHE_BACKEND = os.getenv('HYPTRB_CACHE_BACKEND', 'memory').lower()
+HYPTRB_CACHE_PATH = os.getenv('HYPTRB_CACHE_PATH', 'hyptrb_cache.db')
+HYPTRB_CACHE_MAX_ENTRIES = int(os.getenv('HYPTRB_CACHE_MAX_ENTRIES', 5000))
+# How long a "not found" (404) answer is cached
+HYPTRB_CACHE_NEGATIVE_TTL = int(os.getenv('HYPTRB_CACHE_NEGATIVE_TTL', 60))
+# How long an expired entry may still be served while it is refreshed in the background
+HYPTRB_CACHE_STALE_TTL = int(os.getenv('HYPTRB_CACHE_STALE_TTL', 300))
+# How long past that an entry is still served if Hyptrb is failing (errors, open circuit)
+HYPTRB_CACHE_STALE_IF_ERROR_TTL = int(os.getenv('HYPTRB_CACHE_STALE_IF_ERROR_TTL', 86400))
+
+# Fresh TTL per endpoint in seconds, overridable with HYPTRB_CACHE_TTL_<ENDPOINT>
+DEFAULT_ENDPOINT_TTLS = {
+    'user_role': 600,
+    'client_profile': 600,
+    'admin_profile': 600,
+    'influencer_profile': 600,
+    'client_campaigns': 120,
+    'influencer_collaborations': 120,
+    'influencer_jobs': 120
+}
+
+
+def _endpoint_ttl(endpoint: str) -> int:
+    return int(os.getenv(f'HYPTRB_CACHE_TTL_{endpoint.upper()}', DEFAULT_ENDPOINT_TTLS.get(endpoint, 60)))
+
+
+class NotFound:
+    """
+    Marker returned by a cached fetch function for a 404 answer.
+
+    The cache stores it with the (shorter) negative TTL and hands `value`
+    (None, [] ...) back to the caller.
+    """
+
+    def __init__(self, value: Any = None):
+        self.value = value
+
+
+class MemoryCacheBackend:
+    """In-process LRU store (lost on restart)"""
+
+    def __init__(self, max_entries: int = HYPTRB_CACHE_MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return dict(entry) if entry else None
+
+    def set(self, key: str, entry: Dict):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """LRU store in a local SQLite file, so warm entries survive restarts"""
+
+    def __init__(self, path: str = HYPTRB_CACHE_PATH, max_entries: int = HYPTRB_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS hyptrb_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                negative INTEGER NOT NULL DEFAULT 0,
+                stored_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                stale_until REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_hyptrb_cache_last_access ON hyptrb_cache(last_access)')
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute('''
+                SELECT value, negative, stored_at, expires_at, stale_until
+                FROM hyptrb_cache WHERE key = ?
+            ''', (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE hyptrb_cache SET last_access = ? WHERE key = ?', (time.time(), key))
+        return {
+            'value': row[0],
+            'negative': bool(row[1]),
+            'stored_at': row[2],
+            'expires_at': row[3],
+            'stale_until': row[4]
+        }
+
+    def set(self, key: str, entry: Dict):
+        with self._lock:
+            self._conn.execute('''
+                INSERT OR REPLACE INTO hyptrb_cache
+                (key, value, negative, stored_at, expires_at, stale_until, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (key, entry['value'], int(entry['negative']), entry['stored_at'],
+                  entry['expires_at'], entry['stale_until'], time.time()))
+            overflow = self._conn.execute('SELECT COUNT(*) FROM hyptrb_cache').fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute('''
+                    DELETE FROM hyptrb_cache WHERE key IN (
+                        SELECT key FROM hyptrb_cache ORDER BY last_access ASC LIMIT ?
+                    )
+                ''', (overflow,))
+                self.evictions += overflow
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM hyptrb_cache WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM hyptrb_cache')
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM hyptrb_cache').fetchone()[0]
+
+
+class HyptrbCache:
+    """
+    Read-through cache in front of the hyptrb_api fetch functions.
+
+    Entries are fresh for the endpoint TTL (HYPTRB_CACHE_NEGATIVE_TTL for 404s).
+    After that they may still be served for HYPTRB_CACHE_STALE_TTL seconds
+    while a single background refresh per key fetches the new value. When a
+    fetch fails (Hyptrb down, circuit breaker open), an entry up to
+    HYPTRB_CACHE_STALE_IF_ERROR_TTL seconds older than that is served instead.
+    """
+
+    def __init__(self, backend=None, negative_ttl: int = HYPTRB_CACHE_NEGATIVE_TTL,
+                 stale_ttl: int = HYPTRB_CACHE_STALE_TTL,
+                 stale_if_error_ttl: int = HYPTRB_CACHE_STALE_IF_ERROR_TTL):
+        self.backend = backend
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.stale_if_error_ttl = stale_if_error_ttl
+        self._lock = threading.Lock()
+        # A ContextVar (not thread-local) so worker threads started with
+        # contextvars.copy_context() inherit the bypass
+        self._bypass = contextvars.ContextVar('hyptrb_cache_bypass', default=False)
+        self._revalidating = set()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='hyptrb-cache')
+        self._counters = {}
+
+    @contextmanager
+    def bypass(self):
+        """Skip cached values (but store fresh ones) for fetches in this block, e.g. forced refreshes"""
+        token = self._bypass.set(True)
+        try:
+            yield
+        finally:
+            self._bypass.reset(token)
+
+    def _count(self, endpoint: str, counter: str):
+        with self._lock:
+            counters = self._counters.setdefault(endpoint, {
+                'hits': 0, 'stale_hits': 0, 'negative_hits': 0, 'misses': 0,
+                'stale_if_error': 0, 'revalidations': 0, 'revalidation_errors': 0
+            })
+            counters[counter] += 1
+
+    def get_or_fetch(self, endpoint: str, key: str, fetch: Callable[[], Any]) -> Any:
+        """Return the cached value for key, fetching (and storing) it if needed"""
+        if self.backend is None:
+            return self._unwrap(fetch())
+
+        bypass = self._bypass.get()
+        entry = self.backend.get(key)
+        now = time.time()
+
+        if entry is not None and not bypass:
+            if now < entry['expires_at']:
+                self._count(endpoint, 'negative_hits' if entry['negative'] else 'hits')
+                return json.loads(entry['value'])
+            if now < entry['stale_until']:
+                self._count(endpoint, 'stale_hits')
+                self._revalidate(endpoint, key, fetch)
+                return json.loads(entry['value'])
+
+        self._count(endpoint, 'misses')
+        try:
+            result = fetch()
+        except Exception as e:
+            if entry is None or now >= entry['stale_until'] + self.stale_if_error_ttl:
+                raise
+            self._count(endpoint, 'stale_if_error')
+            logger.warning(f"Hyptrb {endpoint} unavailable ({e}); serving cached response "
+                           f"from {int(now - entry['stored_at'])}s ago")
+            return json.loads(entry['value'])
+        return self._store(endpoint, key, result)
+
+    def _store(self, endpoint: str, key: str, result: Any) -> Any:
+        negative = isinstance(result, NotFound)
+        value = self._unwrap(result)
+        ttl = self.negative_ttl if negative else _endpoint_ttl(endpoint)
+        now = time.time()
+        try:
+            self.backend.set(key, {
+                'value': json.dumps(value),
+                'negative': negative,
+                'stored_at': now,
+                'expires_at': now + ttl,
+                'stale_until': now + ttl + self.stale_ttl
+            })
+        except (TypeError, ValueError, sqlite3.Error) as e:
+            logger.warning(f"Could not cache Hyptrb {endpoint} response: {e}")
+        return value
+
+    def _revalidate(self, endpoint: str, key: str, fetch: Callable[[], Any]):
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def run():
+            try:
+                self._store(endpoint, key, fetch())
+                self._count(endpoint, 'revalidations')
+            except Exception as e:
+                # Keep serving the stale entry; the next request past stale_until refetches
+                self._count(endpoint, 'revalidation_errors')
+                logger.warning(f"Background refresh of Hyptrb {endpoint} failed: {e}")
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        self._executor.submit(run)
+
+    @staticmethod
+    def _unwrap(result: Any) -> Any:
+        return result.value if isinstance(result, NotFound) else result
+
+    def invalidate(self, key: str):
+        if self.backend is not None:
+            self.backend.delete(key)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self) -> Dict:
+        """Cache metrics snapshot"""
+        if self.backend is None:
+            return {'backend': 'none'}
+        with self._lock:
+            endpoints = {name: dict(counters) for name, counters in self._counters.items()}
+        for counters in endpoints.values():
+            lookups = counters['hits'] + counters['stale_hits'] + counters['negative_hits'] + counters['misses']
+            counters['hit_rate'] = round((lookups - counters['misses']) / lookups, 4) if lookups else 0.0
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': self.backend.size(),
+            'max_entries': self.backend.max_entries,
+            'evictions': self.backend.evictions,
+            'endpoints': endpoints
+        }
+
+
+def _create_backend(name: str):
+    if name == 'none':
+        return None
+    if name == 'sqlite':
+        try:
+            return SQLiteCacheBackend()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not open Hyptrb cache at {HYPTRB_CACHE_PATH} ({e}); using memory cache")
+    elif name != 'memory':
+        logger.warning(f"Unknown HYPTRB_CACHE_BACKEND '{name}', using memory cache")
+    return MemoryCacheBackend()
+
+
+# Global cache instance
+cache = HyptrbCache(_create_backend(HYPTRB_CACHE_BACKEND))
+
+
+def cached(endpoint: str):
+    """
+    Decorator caching a hyptrb_api fetch function under `endpoint`
+
+    The cache key is the endpoint plus the bound call arguments (defaults
+    applied), so fetch_influencer_jobs(uid) and fetch_influencer_jobs(uid, page=1)
+    share an entry. Return NotFound(default) from the function for 404s.
+    """
+    def decorator(f):
+        signature = inspect.signature(f)
+
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = f"{endpoint}:{json.dumps(list(bound.arguments.values()), default=str)}"
+            return cache.get_or_fetch(endpoint, key, lambda: f(*args, **kwargs))
+
+        decorated_function.uncached = f
+        return decorated_function
+    return decorator
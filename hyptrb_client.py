@@ -0,0 +1,252 @@
+"""
+Hyptrb HTTP Client Module
+Shared keep-alive session for hyptrb_api with per-endpoint timeouts, jittered
+retries, a circuit breaker and per-endpoint latency/error metrics
+"""
+import os
+import random
+import threading
+import time
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logger_config import logger
+
+HYPTRB_POOL_SIZE = int(os.getenv('HYPTRB_POOL_SIZE', 20))
+# Default (connect, read) timeout in seconds
+HYPTRB_CONNECT_TIMEOUT = float(os.getenv('HYPTRB_CONNECT_TIMEOUT', 3.05))
+HYPTRB_READ_TIMEOUT = float(os.getenv('HYPTRB_READ_TIMEOUT', 5))
+# Extra attempts after the first one for timeouts, connection errors and 429/502/503/504
+HYPTRB_RETRIES = int(os.getenv('HYPTRB_RETRIES', 2))
+HYPTRB_RETRY_BACKOFF = float(os.getenv('HYPTRB_RETRY_BACKOFF', 0.2))
+HYPTRB_RETRY_BACKOFF_MAX = float(os.getenv('HYPTRB_RETRY_BACKOFF_MAX', 2))
+# Consecutive failed requests that open the circuit, and how long it stays open
+HYPTRB_BREAKER_FAILURES = int(os.getenv('HYPTRB_BREAKER_FAILURES', 5))
+HYPTRB_BREAKER_RESET_TIMEOUT = float(os.getenv('HYPTRB_BREAKER_RESET_TIMEOUT', 30))
+
+# Read timeouts per endpoint (seconds), overridable with HYPTRB_TIMEOUT_<ENDPOINT>.
+# Lookups are small; campaign and job listings can be slow on the Hyptrb side.
+DEFAULT_READ_TIMEOUTS = {
+    'user_role': 5,
+    'client_profile': 5,
+    'admin_profile': 5,
+    'influencer_profile': 5,
+    'client_campaigns': 10,
+    'influencer_collaborations': 10,
+    'influencer_jobs': 10
+}
+
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without calling Hyptrb while the circuit breaker is open"""
+    pass
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed -> open after `failure_threshold` failed requests in a row; open
+    requests fail immediately for `reset_timeout` seconds; then one probe
+    request is let through (half-open) and its outcome closes or re-opens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = HYPTRB_BREAKER_FAILURES,
+                 reset_timeout: float = HYPTRB_BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Hyptrb circuit breaker closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.times_opened += 1
+                    logger.warning(f"Hyptrb circuit breaker opened after {self._failures} failures; "
+                                   f"failing fast for {self.reset_timeout}s")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected
+            }
+
+
+class EndpointMetrics:
+    """Latency histogram and error counts for one endpoint"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = {}
+        self.retries = 0
+        self.rejected = 0  # not sent because the circuit was open
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.latency_total_ms = 0.0
+
+    def observe(self, latency_ms: float, error: str = None):
+        self.requests += 1
+        self.latency_total_ms += latency_ms
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                self.latency_buckets[i] += 1
+                break
+        else:
+            self.latency_buckets[-1] += 1
+        if error:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def to_dict(self) -> Dict:
+        failed = sum(self.errors.values())
+        labels = [f"le_{bound}ms" for bound in LATENCY_BUCKETS_MS] + ['inf']
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'rejected': self.rejected,
+            'errors': dict(self.errors),
+            'error_rate': round(failed / self.requests, 4) if self.requests else 0.0,
+            'latency_avg_ms': round(self.latency_total_ms / self.requests, 3) if self.requests else 0.0,
+            'latency_histogram': dict(zip(labels, self.latency_buckets))
+        }
+
+
+class HyptrbClient:
+    """requests.Session wrapper used by every hyptrb_api call"""
+
+    def __init__(self, pool_size: int = HYPTRB_POOL_SIZE, retries: int = HYPTRB_RETRIES,
+                 breaker: CircuitBreaker = None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.retries = max(0, retries)
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    @staticmethod
+    def timeout_for(endpoint: str) -> Tuple[float, float]:
+        read_timeout = os.getenv(f'HYPTRB_TIMEOUT_{endpoint.upper()}',
+                                 DEFAULT_READ_TIMEOUTS.get(endpoint, HYPTRB_READ_TIMEOUT))
+        return (HYPTRB_CONNECT_TIMEOUT, float(read_timeout))
+
+    def get(self, endpoint: str, url: str, **kwargs) -> requests.Response:
+        """
+        GET with retries and circuit breaking
+
+        Args:
+            endpoint: Endpoint name for timeouts and metrics (e.g. 'user_role')
+            url: Full URL
+            **kwargs: Passed to requests (params, headers)
+
+        Returns:
+            The final response (any status code; callers interpret 404 etc.)
+
+        Raises:
+            CircuitOpenError: If the breaker is open (no request is made)
+            requests.exceptions.RequestException: If every attempt failed
+        """
+        if not self.breaker.allow_request():
+            with self._lock:
+                self._metrics.setdefault(endpoint, EndpointMetrics()).rejected += 1
+            raise CircuitOpenError(f"Hyptrb circuit open; {endpoint} request not sent")
+
+        kwargs.setdefault('timeout', self.timeout_for(endpoint))
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                response = self.session.get(url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                error = 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'connection'
+                self._observe(endpoint, (time.monotonic() - started) * 1000, error)
+                if attempt < self.retries:
+                    attempt = self._backoff(endpoint, attempt)
+                    continue
+                self.breaker.record_failure()
+                raise
+
+            retryable = response.status_code in RETRY_STATUS_CODES
+            error = f"http_{response.status_code}" if response.status_code >= 500 or retryable else None
+            self._observe(endpoint, (time.monotonic() - started) * 1000, error)
+            if retryable and attempt < self.retries:
+                response.close()
+                attempt = self._backoff(endpoint, attempt, response.headers.get('Retry-After'))
+                continue
+
+            if error:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return response
+
+    def _backoff(self, endpoint: str, attempt: int, retry_after: str = None) -> int:
+        # Full jitter: spreads retries from concurrent workers instead of synchronising them
+        delay = random.uniform(0, min(HYPTRB_RETRY_BACKOFF_MAX, HYPTRB_RETRY_BACKOFF * (2 ** attempt)))
+        if retry_after and retry_after.isdigit():
+            delay = min(float(retry_after), HYPTRB_RETRY_BACKOFF_MAX)
+        with self._lock:
+            self._metrics.setdefault(endpoint, EndpointMetrics()).retries += 1
+        time.sleep(delay)
+        return attempt + 1
+
+    def _observe(self, endpoint: str, latency_ms: float, error: str = None):
+        with self._lock:
+            self._metrics.setdefault(endpoint, EndpointMetrics()).observe(latency_ms, error)
+
+    def stats(self) -> Dict:
+        """Per-endpoint latency/error metrics and breaker state"""
+        with self._lock:
+            endpoints = {name: metrics.to_dict() for name, metrics in self._metrics.items()}
+        return {
+            'circuit_breaker': self.breaker.stats(),
+            'endpoints': endpoints
+        }
+
+
+# Global client instance
+client = HyptrbClient()
@@ -1,5 +1,6 @@
 import os
 import logging
+import multiprocessing
 from logging.handlers import RotatingFileHandler
 
 def setup_logger(name='chat_api'):
@@ -14,10 +15,14 @@ def setup_logger(name='chat_api'):
 
     # Prevent adding handlers multiple times
     if not logger.handlers:
-        # Create rotating file handler (10MB per file, keep 5 backups)
-        file_handler = RotatingFileHandler(LOG_FILE, maxBytes=10*1024*1024, backupCount=5)
-        file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(file_formatter)
+        # Worker processes (media_pipeline) log to the console only: two processes
+        # rotating the same file would lose or clobber log lines
+        if multiprocessing.current_process().name == 'MainProcess':
+            # Create rotating file handler (10MB per file, keep 5 backups)
+            file_handler = RotatingFileHandler(LOG_FILE, maxBytes=10*1024*1024, backupCount=5)
+            file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            file_handler.setFormatter(file_formatter)
+            logger.addHandler(file_handler)
 
         # Create console handler
         console_handler = logging.StreamHandler()
@@ -25,7 +30,6 @@ def setup_logger(name='chat_api'):
         console_handler.setFormatter(console_formatter)
 
         # Add handlers to logger
-        logger.addHandler(file_handler)
         logger.addHandler(console_handler)
 
     return logger
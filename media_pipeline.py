@@ -0,0 +1,351 @@
+"""
+Media Pipeline Module
+Extracts image/video metadata (dimensions, duration, codec) from uploaded blobs
+and renders their thumbnails in a bounded process pool, after the upload request
+has returned
+"""
+import atexit
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional
+
+from blob_store import blob_store
+from db import get_db
+from logger_config import logger
+from thumbnails import variant_cache
+
+# Worker processes probing media files
+MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', 2))
+# Jobs handed to the pool at once (the rest wait in the media_jobs table)
+MEDIA_MAX_IN_FLIGHT = int(os.getenv('MEDIA_MAX_IN_FLIGHT', MEDIA_WORKERS * 2))
+# A failing job is retried until it has been attempted this many times
+MEDIA_MAX_ATTEMPTS = int(os.getenv('MEDIA_MAX_ATTEMPTS', 3))
+# The queue is also checked this often without a wakeup (seconds)
+MEDIA_POLL_INTERVAL = float(os.getenv('MEDIA_POLL_INTERVAL', 5))
+# A job still running this long after it was claimed is presumed abandoned and re-queued (seconds)
+MEDIA_JOB_TIMEOUT = float(os.getenv('MEDIA_JOB_TIMEOUT', 600))
+
+# Attachment types that are probed
+MEDIA_TYPES = ('image', 'video')
+
+# Recent timings kept per stage for metrics
+TIMING_WINDOW = 500
+STAGES = ('queue_ms', 'start_ms', 'probe_ms', 'render_ms', 'patch_ms', 'total_ms')
+
+
+def needs_processing(file_type: str, metadata: Dict) -> bool:
+    """Whether an attachment of this type with this blob metadata should be (re)processed"""
+    return file_type in MEDIA_TYPES and 'thumbnails' not in metadata
+
+
+def probe_media(sha256: str, file_type: str, submitted_at: float) -> Dict:
+    """
+    Extract metadata from a media blob and render its thumbnails (runs in a worker process)
+
+    Returns:
+        {'metadata': {...}, 'start_ms': ..., 'probe_ms': ..., 'render_ms': ...};
+        metadata is empty when the library for the type (Pillow / OpenCV) is not
+        installed
+    """
+    started = time.time()
+    path = blob_store.path(sha256)
+    metadata = {}
+    if file_type == 'image':
+        try:
+            from PIL import Image
+        except ImportError:
+            Image = None
+        if Image:
+            with Image.open(path) as img:
+                metadata['dimensions'] = {'width': img.width, 'height': img.height}
+    elif file_type == 'video':
+        try:
+            import cv2
+        except ImportError:
+            cv2 = None
+        if cv2:
+            video = cv2.VideoCapture(path)
+            try:
+                if not video.isOpened():
+                    raise ValueError('unreadable video')
+                metadata['dimensions'] = {
+                    'width': int(video.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                    'height': int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                }
+                fps = video.get(cv2.CAP_PROP_FPS)
+                frames = video.get(cv2.CAP_PROP_FRAME_COUNT)
+                if fps > 0 and frames > 0:
+                    metadata['duration'] = round(frames / fps, 3)
+                fourcc = int(video.get(cv2.CAP_PROP_FOURCC))
+                codec = ''.join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)).strip('\x00 ')
+                if codec:
+                    metadata['codec'] = codec
+            finally:
+                video.release()
+    probed = time.time()
+    metadata.update(variant_cache.generate(sha256, file_type))
+    return {
+        'metadata': metadata,
+        'start_ms': (started - submitted_at) * 1000,
+        'probe_ms': (probed - started) * 1000,
+        'render_ms': (time.time() - probed) * 1000
+    }
+
+
+@contextmanager
+def _worker_main():
+    """
+    Present this module as __main__ while worker processes are spawned.
+
+    A spawned process re-runs the parent's __main__ (app.py under `python
+    app.py`) as __mp_main__ before it can unpickle a job, which would repeat
+    the app's migrations, Firebase setup and Flask app in every worker. With
+    this module as __main__ a worker only imports the media code it runs.
+    """
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = sys.modules[__name__]
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+
+class MediaPipeline:
+    """
+    Durable job queue (media_jobs table) drained into a process pool.
+
+    Uploads only store the bytes and queue a job per media attachment. A
+    dispatcher thread claims queued jobs, at most max_in_flight at a time, and
+    runs probe_media (metadata, then thumbnails via thumbnails.variant_cache) in
+    one of `workers` processes, so slow decoders never hold a request worker and
+    CPU-heavy probing never holds the GIL. When a probe
+    finishes, the metadata is stored on the blob (a later duplicate upload gets
+    it immediately), merged into the message's attachment, and on_processed is
+    called with the updated message. Failed jobs are retried up to
+    max_attempts. Claims are leases: the dispatcher of every process re-queues
+    jobs that have been running for longer than job_timeout, so work left
+    running by a crashed or restarted process is picked up again without a
+    manual start() (under gunicorn the dispatcher starts on the first submit).
+    """
+
+    def __init__(self, db=None, on_processed: Optional[Callable[[Dict], None]] = None,
+                 workers: int = MEDIA_WORKERS, max_in_flight: int = MEDIA_MAX_IN_FLIGHT,
+                 max_attempts: int = MEDIA_MAX_ATTEMPTS, poll_interval: float = MEDIA_POLL_INTERVAL,
+                 job_timeout: float = MEDIA_JOB_TIMEOUT):
+        self._db = db
+        self.on_processed = on_processed
+        self.workers = max(1, workers)
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_attempts = max(1, max_attempts)
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+
+        self._executor = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._in_flight = 0
+        self._last_requeue = 0.0
+
+        # Metrics
+        self._completed = 0
+        self._failed = 0
+        self._retried = 0
+        self._requeued = 0
+        self._timings = {stage: deque(maxlen=TIMING_WINDOW) for stage in STAGES}
+
+    @property
+    def db(self):
+        return self._db or get_db()
+
+    def submit(self, sha256: str, file_type: str, message_id: str = None) -> int:
+        """Queue a blob for processing (and the message to patch); returns the job ID"""
+        job_id = self.db.enqueue_media_job(sha256, file_type, message_id)
+        self._ensure_started()
+        self._wakeup.set()
+        return job_id
+
+    def start(self):
+        """Start dispatching without waiting for a submit (picks up jobs queued before a restart)"""
+        self._ensure_started()
+        self._wakeup.set()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='media-dispatch', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: never fork a process that is running server threads
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._requeue_abandoned()
+                self._dispatch()
+            except Exception as e:
+                logger.error(f"Media job dispatch failed: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _requeue_abandoned(self):
+        now = time.time()
+        if now - self._last_requeue < self.poll_interval:
+            return
+        self._last_requeue = now
+        requeued = self.db.requeue_running_media_jobs(now - self.job_timeout)
+        if requeued:
+            logger.info(f"Re-queued {requeued} media jobs running for more than {self.job_timeout}s")
+            with self._lock:
+                self._requeued += requeued
+
+    def _dispatch(self):
+        with self._lock:
+            free = self.max_in_flight - self._in_flight
+        if free <= 0:
+            return
+        for job in self.db.claim_media_jobs(free):
+            with self._lock:
+                self._in_flight += 1
+            claimed_at = time.time()
+            blob = self.db.get_blob(job['sha256'])
+            if blob and not needs_processing(job['file_type'], blob['metadata']):
+                # Already processed (duplicate upload or forward): only the patch is left
+                self._complete(job, claimed_at, {'metadata': blob['metadata'], 'start_ms': 0,
+                                                 'probe_ms': 0, 'render_ms': 0})
+                continue
+            try:
+                # Workers are started on demand by submit()
+                with _worker_main():
+                    future = self._get_executor().submit(probe_media, job['sha256'], job['file_type'], claimed_at)
+            except Exception as e:
+                self._fail(job, claimed_at, e)
+                continue
+            future.add_done_callback(lambda f, job=job, claimed_at=claimed_at: self._on_done(job, claimed_at, f))
+
+    def _on_done(self, job: Dict, claimed_at: float, future):
+        error = future.exception()
+        if error is None:
+            self._complete(job, claimed_at, future.result())
+        else:
+            if isinstance(error, BrokenProcessPool):
+                with self._lock:
+                    self._executor = None
+            self._fail(job, claimed_at, error)
+
+    def _complete(self, job: Dict, claimed_at: float, result: Dict):
+        try:
+            patch_started = time.time()
+            metadata = result['metadata']
+            if metadata:
+                self.db.update_blob_metadata(job['sha256'], metadata)
+            self._patch_message(job, metadata, 'done')
+            finished = time.time()
+            timings = {
+                'queue_ms': (claimed_at - job['enqueued_at']) * 1000,
+                'start_ms': result['start_ms'],
+                'probe_ms': result['probe_ms'],
+                'render_ms': result['render_ms'],
+                'patch_ms': (finished - patch_started) * 1000,
+                'total_ms': (finished - job['enqueued_at']) * 1000
+            }
+            timings = {stage: round(value, 3) for stage, value in timings.items()}
+            self.db.finish_media_job(job['id'], 'done', timings=timings)
+            with self._lock:
+                self._completed += 1
+                for stage, value in timings.items():
+                    self._timings[stage].append(value)
+        except Exception as e:
+            logger.error(f"Failed to apply media job {job['id']}: {e}")
+            self.db.finish_media_job(job['id'], 'failed', error=str(e))
+        finally:
+            self._release()
+
+    def _fail(self, job: Dict, claimed_at: float, error: Exception):
+        try:
+            if job['attempts'] < self.max_attempts:
+                logger.warning(f"Media job {job['id']} failed (attempt {job['attempts']}), retrying: {error}")
+                self.db.finish_media_job(job['id'], 'queued', error=str(error))
+                with self._lock:
+                    self._retried += 1
+            else:
+                logger.error(f"Media job {job['id']} for blob {job['sha256']} failed: {error}")
+                self.db.finish_media_job(job['id'], 'failed', error=str(error))
+                self._patch_message(job, {}, 'failed')
+                with self._lock:
+                    self._failed += 1
+        except Exception as e:
+            logger.error(f"Failed to record media job {job['id']} failure: {e}")
+        finally:
+            self._release()
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._wakeup.set()
+
+    def _patch_message(self, job: Dict, metadata: Dict, processing: str):
+        if not job['message_id']:
+            return
+        message = self.db.update_message_attachments(job['message_id'], job['sha256'], metadata, processing)
+        if message and self.on_processed:
+            try:
+                self.on_processed(message)
+            except Exception as e:
+                logger.error(f"Media processed callback failed for message {job['message_id']}: {e}")
+
+    def stop(self):
+        """Stop dispatching; jobs still running are re-queued once their claim times out"""
+        self._stop.set()
+        self._wakeup.set()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict:
+        """Pipeline metrics snapshot: queue state and per-stage timings (ms)"""
+        with self._lock:
+            timings = {}
+            for stage, values in self._timings.items():
+                ordered = sorted(values)
+                timings[stage] = {
+                    'count': len(ordered),
+                    'mean': round(sum(ordered) / len(ordered), 3) if ordered else 0.0,
+                    'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else 0.0,
+                    'max': ordered[-1] if ordered else 0.0
+                }
+            stats = {
+                'workers': self.workers,
+                'max_in_flight': self.max_in_flight,
+                'in_flight': self._in_flight,
+                'completed': self._completed,
+                'failed': self._failed,
+                'retried': self._retried,
+                'requeued': self._requeued,
+                'timings_ms': timings
+            }
+        stats['jobs'] = self.db.get_media_job_counts()
+        return stats
+
+
+# Global media pipeline (app.py sets on_processed)
+media_pipeline = MediaPipeline()
@@ -0,0 +1,170 @@
+"""
+Presence Module
+Write-behind buffer for users' last seen timestamps, and in-memory "who is online"
+"""
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import realtime
+from db import get_db
+from logger_config import logger
+
+# How often buffered last_seen timestamps are written to the database (seconds)
+PRESENCE_FLUSH_INTERVAL = float(os.getenv('PRESENCE_FLUSH_INTERVAL', 10))
+# A user counts as online if they made a request within this window (seconds)
+# or have an open real-time connection
+PRESENCE_ONLINE_WINDOW = int(os.getenv('PRESENCE_ONLINE_WINDOW', 300))
+
+
+class PresenceBuffer:
+    """
+    Latest activity per user, kept in memory and written behind.
+
+    touch() only updates a dict; a background thread writes every user that
+    was touched since the last flush in one batched transaction every
+    flush_interval seconds, and once more at interpreter exit. last_seen in
+    the database therefore lags by up to flush_interval; a crash loses at most
+    that much presence data (no messages or profile data are buffered).
+    """
+
+    def __init__(self, db=None, flush_interval: float = PRESENCE_FLUSH_INTERVAL,
+                 online_window: int = PRESENCE_ONLINE_WINDOW):
+        self._db = db
+        self.flush_interval = flush_interval
+        self.online_window = online_window
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}       # firebase_uid -> last_seen ISO timestamp not yet written
+        self._last_active = {}   # firebase_uid -> (epoch seconds, ISO timestamp)
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Metrics
+        self._touches = 0
+        self._flushes = 0
+        self._rows_flushed = 0
+        self._flush_errors = 0
+        self._last_flush_ms = 0.0
+
+    @property
+    def db(self):
+        return self._db or get_db()
+
+    def touch(self, firebase_uid: str) -> str:
+        """
+        Record activity for a user (no database write)
+
+        Returns:
+            The recorded last_seen timestamp
+        """
+        now = time.time()
+        last_seen = datetime.fromtimestamp(now).isoformat() + 'Z'
+        with self._lock:
+            self._pending[firebase_uid] = last_seen
+            self._last_active[firebase_uid] = (now, last_seen)
+            self._touches += 1
+        self._ensure_started()
+        return last_seen
+
+    def last_seen(self, firebase_uid: str) -> Optional[str]:
+        """Latest activity seen by this process, or None"""
+        with self._lock:
+            entry = self._last_active.get(firebase_uid)
+        return entry[1] if entry else None
+
+    def online_users(self, user_ids: Iterable[str] = None) -> List[Dict]:
+        """
+        Users active within the online window or connected over SSE/WebSocket
+
+        Args:
+            user_ids: Only report these users (default: everyone online)
+
+        Returns:
+            List of {'user_id', 'last_seen', 'connected'} dicts, most recent first
+        """
+        cutoff = time.time() - self.online_window
+        connected = set(realtime.hub.connected_users())
+        with self._lock:
+            candidates = set(user_ids) if user_ids is not None else set(self._last_active) | connected
+            activity = [(uid,) + self._last_active.get(uid, (0, None)) for uid in candidates]
+        online = [(active_at, uid, last_seen) for uid, active_at, last_seen in activity
+                  if uid in connected or active_at >= cutoff]
+        online.sort(reverse=True)
+        return [{'user_id': uid, 'last_seen': last_seen, 'connected': uid in connected}
+                for _, uid, last_seen in online]
+
+    def flush(self) -> int:
+        """Write all pending timestamps in one transaction; returns rows updated"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            started = time.monotonic()
+            try:
+                updated = self.db.update_users_last_seen(list(pending.items()))
+            except Exception as e:
+                logger.error(f"Failed to flush last_seen for {len(pending)} users: {e}")
+                with self._lock:
+                    # Put them back unless the user was touched again meanwhile
+                    for uid, last_seen in pending.items():
+                        self._pending.setdefault(uid, last_seen)
+                    self._flush_errors += 1
+                return 0
+
+            with self._lock:
+                self._flushes += 1
+                self._rows_flushed += updated
+                self._last_flush_ms = (time.monotonic() - started) * 1000
+                self._prune()
+            return updated
+
+    def _prune(self):
+        # Forget users inactive for longer than the window (caller holds _lock)
+        cutoff = time.time() - self.online_window
+        for uid in [uid for uid, (active_at, _) in self._last_active.items()
+                    if active_at < cutoff and uid not in self._pending]:
+            del self._last_active[uid]
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='presence-flush', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self):
+        """Stop the flush thread and write what is still pending"""
+        self._stop.set()
+        self.flush()
+
+    def stats(self) -> Dict:
+        """Buffer metrics snapshot"""
+        with self._lock:
+            return {
+                'flush_interval_seconds': self.flush_interval,
+                'online_window_seconds': self.online_window,
+                'tracked_users': len(self._last_active),
+                'pending_writes': len(self._pending),
+                'touches': self._touches,
+                'flushes': self._flushes,
+                'rows_flushed': self._rows_flushed,
+                'flush_errors': self._flush_errors,
+                'last_flush_ms': round(self._last_flush_ms, 3)
+            }
+
+
+# Global presence buffer
+presence = PresenceBuffer()
@@ -0,0 +1,168 @@
+"""
+Real-time Event Hub Module
+In-process pub/sub that fans conversation events out to connected clients (SSE, WebSocket)
+"""
+import os
+import queue
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from logger_config import logger
+
+REALTIME_QUEUE_SIZE = int(os.getenv('REALTIME_QUEUE_SIZE', 100))
+REALTIME_HEARTBEAT_INTERVAL = float(os.getenv('REALTIME_HEARTBEAT_INTERVAL', 15))
+
+# Event types
+MESSAGE_CREATED = 'message.created'
+MESSAGE_DELETED = 'message.deleted'
+MESSAGE_PROCESSED = 'message.processed'
+CONVERSATION_READ = 'conversation.read'
+TYPING = 'typing'
+SUBSCRIPTION_EVICTED = 'subscription.evicted'
+
+
+class Subscription:
+    """
+    One connected client of a user.
+
+    Events are buffered in a bounded queue. If the client falls so far behind
+    that the queue fills up, the hub evicts the subscription: pending events
+    are dropped and a single SUBSCRIPTION_EVICTED event tells the client to
+    reconnect and catch up through /messages/sync.
+    """
+
+    def __init__(self, hub, user_id: str, max_queue: int = REALTIME_QUEUE_SIZE):
+        self.hub = hub
+        self.user_id = user_id
+        self.created_at = datetime.now().isoformat() + 'Z'
+        self.evicted = False
+        self.closed = False
+        self._queue = queue.Queue(maxsize=max_queue)
+
+    def deliver(self, event: Dict) -> bool:
+        """Queue an event for this client; returns False if the client is too slow"""
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+    def evict(self, event: Dict):
+        """Drop pending events and leave only the eviction notice"""
+        self.evicted = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._queue.put_nowait(event)
+
+    def get(self, timeout: float = None) -> Optional[Dict]:
+        """Next event, or None if nothing arrived within timeout"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class EventHub:
+    """Fan-out of events to every subscription of the recipient users"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}  # user_id -> set of Subscription
+
+        # Metrics
+        self._published = 0
+        self._delivered = 0
+        self._evictions = 0
+
+    def subscribe(self, user_id: str, subscription: Subscription = None) -> Subscription:
+        """Register a new subscription (a default queue-backed one unless given)"""
+        subscription = subscription or Subscription(self, user_id)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.closed = True
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, event_type: str, data: Dict, user_ids: Iterable[str]) -> int:
+        """
+        Publish an event to every subscription of the given users
+
+        Returns:
+            Number of subscriptions the event was delivered to
+        """
+        event = {
+            'type': event_type,
+            'data': data,
+            'published_at': datetime.now().isoformat() + 'Z'
+        }
+
+        with self._lock:
+            self._published += 1
+            targets = [sub for user_id in set(filter(None, user_ids))
+                       for sub in self._subscriptions.get(user_id, ())]
+
+        delivered = 0
+        for subscription in targets:
+            if subscription.deliver(event):
+                delivered += 1
+            else:
+                self._evict(subscription)
+
+        with self._lock:
+            self._delivered += delivered
+        return delivered
+
+    def _evict(self, subscription: Subscription):
+        logger.warning(f"Evicting slow real-time subscriber for user {subscription.user_id} "
+                       f"({subscription.pending()} events pending)")
+        self.unsubscribe(subscription)
+        subscription.evict({
+            'type': SUBSCRIPTION_EVICTED,
+            'data': {'reason': 'slow_consumer'},
+            'published_at': datetime.now().isoformat() + 'Z'
+        })
+        with self._lock:
+            self._evictions += 1
+
+    def connected_users(self) -> List[str]:
+        with self._lock:
+            return list(self._subscriptions)
+
+    def stats(self) -> Dict:
+        """Hub metrics snapshot"""
+        with self._lock:
+            subscriptions = [sub for subs in self._subscriptions.values() for sub in subs]
+            return {
+                'connected_users': len(self._subscriptions),
+                'subscriptions': len(subscriptions),
+                'queued_events': sum(sub.pending() for sub in subscriptions),
+                'published': self._published,
+                'delivered': self._delivered,
+                'evictions': self._evictions
+            }
+
+
+def conversation_participants(conversation: Dict) -> List[str]:
+    """User IDs that receive events for a conversation"""
+    return [uid for uid in (conversation.get('participant1_id'), conversation.get('participant2_id')) if uid]
+
+
+# Global hub instance
+hub = EventHub()
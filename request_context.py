@@ -0,0 +1,90 @@
+"""
+Request Context Module
+Request-scoped identity map: each user, thread and conversation is read from
+the database at most once per request
+"""
+from typing import Dict, Optional
+
+from flask import g, has_app_context
+
+from db import get_db
+
+# Sentinel for "looked up, not found" so misses are memoised too
+_MISSING = object()
+
+
+class IdentityMap:
+    """
+    Memo of database rows read during one request.
+
+    Lookups go to the database the first time and are answered from memory
+    afterwards. Code that writes a row must call the matching forget_* (or
+    remember_user) so later reads in the same request see the new values.
+    """
+
+    def __init__(self, db=None):
+        self.db = db or get_db()
+        self._users = {}
+        self._threads = {}
+        self._conversations = {}
+        self._resolved = {}  # firebase_uid -> user row returned by ensure_user_exists
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, store: Dict, key: str, load) -> Optional[Dict]:
+        value = store.get(key, _MISSING) if key is not None else None
+        if value is _MISSING:
+            self.misses += 1
+            value = load(key)
+            store[key] = value
+        else:
+            self.hits += 1
+        return value
+
+    def user(self, firebase_uid: str) -> Optional[Dict]:
+        """User row by Firebase UID (db.get_user_by_firebase_uid)"""
+        return self._lookup(self._users, firebase_uid, self.db.get_user_by_firebase_uid)
+
+    def thread(self, thread_id: str) -> Optional[Dict]:
+        """Thread row by ID (db.get_thread_by_id)"""
+        return self._lookup(self._threads, thread_id, self.db.get_thread_by_id)
+
+    def conversation(self, conversation_id: str) -> Optional[Dict]:
+        """Conversation with participant details by ID (db.get_conversation_by_id)"""
+        return self._lookup(self._conversations, conversation_id, self.db.get_conversation_by_id)
+
+    def remember_user(self, user: Dict):
+        """Store a user row that was just written"""
+        self._users[user['firebase_uid']] = user
+
+    def forget_user(self, firebase_uid: str):
+        self._users.pop(firebase_uid, None)
+        self._resolved.pop(firebase_uid, None)
+
+    def forget_thread(self, thread_id: str):
+        self._threads.pop(thread_id, None)
+
+    def forget_conversation(self, conversation_id: str):
+        self._conversations.pop(conversation_id, None)
+
+    def resolved_user(self, firebase_uid: str) -> Optional[Dict]:
+        """The authenticated user's row if ensure_user_exists already ran in this request"""
+        return self._resolved.get(firebase_uid)
+
+    def set_resolved_user(self, user: Dict):
+        self._resolved[user['firebase_uid']] = user
+        self._users[user['firebase_uid']] = user
+
+
+def identity_map() -> IdentityMap:
+    """
+    The identity map of the current request.
+
+    Outside an application context (background workers, scripts) a fresh,
+    throw-away map is returned, so callers never share rows across requests.
+    """
+    if not has_app_context():
+        return IdentityMap()
+    if 'identity_map' not in g:
+        g.identity_map = IdentityMap()
+    return g.identity_map
@@ -0,0 +1,66 @@
+"""
+Shared fixtures: the Flask app running in a scratch directory (database, blob
+store and logs), with Firebase token checks and the Hyptrb API stubbed out
+"""
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# Bearer token -> decoded Firebase token
+USERS = {
+    'tok-client': {'uid': 'client1', 'email': 'client@example.com', 'name': 'Client'},
+    'tok-influencer': {'uid': 'influencer1', 'email': 'influencer@example.com', 'name': 'Influencer'},
+}
+ROLES = {'client@example.com': 'client', 'influencer@example.com': 'influencer'}
+CAMPAIGN = {'_id': 'camp1', 'campaignName': 'Campaign One'}
+
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """app.py imported inside a scratch directory (its paths are relative to the working directory)"""
+    workdir = tmp_path_factory.mktemp('chat_api')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    # Absolute: send_file resolves relative paths against the app's root, not the working directory
+    os.environ['UPLOAD_FOLDER'] = str(workdir / 'uploads')
+    try:
+        import firebase_auth
+        firebase_auth.verify_firebase_token = lambda token: dict(USERS[token])
+
+        import app as app_module
+        import hyptrb_api
+        app_module.fetch_user_role = lambda email: {'role': ROLES.get(email)}
+        app_module.fetch_user_profile_by_role = lambda email, role, uid=None: None
+        app_module.fetch_client_campaigns = lambda email: [CAMPAIGN]
+        # Also used by hyptrb_api's own paging helpers
+        hyptrb_api.fetch_influencer_jobs = app_module.fetch_influencer_jobs = lambda uid, page=1: {
+            'totalJobs': 1,
+            'totalPages': 1,
+            'jobs': [{'campaignDetails': [{'campaignId': CAMPAIGN['_id'], 'campaignName': CAMPAIGN['campaignName'],
+                                           'clientEmail': 'client@example.com'}]}]
+        }
+        yield app_module
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope='session')
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture(scope='session')
+def conversation_url(client):
+    """Messages URL of the client/influencer conversation of the stubbed campaign"""
+    client.get('/messages/threads', headers=auth('tok-client'))
+    threads = client.get('/messages/threads', headers=auth('tok-influencer')).get_json()['threads']
+    thread = threads[0]
+    return f"/messages/threads/{thread['id']}/conversations/{thread['conversations'][0]['id']}"
@@ -0,0 +1,59 @@
+"""Blob garbage collection: pinned standalone uploads and re-uploads racing a GC pass"""
+import io
+
+import pytest
+
+from conftest import auth
+
+
+def test_standalone_upload_is_pinned_against_gc(app_module, client):
+    response = client.post('/uploads', headers=auth('tok-client'), data={
+        'file': (io.BytesIO(b'brand guidelines'), 'guidelines.pdf')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 201
+    attachment = response.get_json()
+
+    store = app_module.blob_store
+    grace = store.gc_grace
+    store.gc_grace = -1
+    try:
+        store.collect_garbage()
+    finally:
+        store.gc_grace = grace
+
+    blob = store.get(attachment['sha256'])
+    assert blob is not None and blob['pinned'] and blob['ref_count'] == 1
+    assert client.get(attachment['file_path'], headers=auth('tok-client')).status_code == 200
+
+    # Claiming the same content again does not add a second pin
+    response = client.post('/uploads', headers=auth('tok-client'),
+                           json={'sha256': attachment['sha256'], 'filename': 'guidelines-v2.pdf'})
+    assert response.status_code == 200
+    assert store.get(attachment['sha256'])['ref_count'] == 1
+
+
+@pytest.mark.parametrize('race_point', ['delete_unreferenced_blobs', 'get_blob'])
+def test_reupload_during_gc_keeps_the_file(app_module, monkeypatch, race_point):
+    store = app_module.blob_store
+    content = f'shot list ({race_point})'.encode()
+    sha256 = store.put(io.BytesIO(content))['sha256']
+
+    # The same content arrives again right after GC deleted the row (before the
+    # file is removed) or right after the file was moved aside
+    original = getattr(store.db, race_point)
+    reuploads = []
+
+    def racing(*args, **kwargs):
+        result = original(*args, **kwargs)
+        if not reuploads:
+            reuploads.append(store.put(io.BytesIO(content)))
+        return result
+
+    monkeypatch.setattr(store.db, race_point, racing)
+    monkeypatch.setattr(store, 'gc_grace', -1)
+    store.collect_garbage()
+
+    assert reuploads and not reuploads[0]['duplicate']
+    assert store.get(sha256) is not None
+    with open(store.path(sha256), 'rb') as f:
+        assert f.read() == content
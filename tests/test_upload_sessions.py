@@ -0,0 +1,93 @@
+"""Resumable uploads end to end: session -> chunks -> finalize -> message -> blob GC"""
+import hashlib
+import io
+
+from conftest import auth
+
+CONTENT = b'quarterly report\n' * 4096
+
+
+def upload_in_chunks(client, filename, content, chunk_size):
+    """Upload content through an upload session and return the finalized attachment"""
+    response = client.post('/uploads/sessions', headers=auth('tok-influencer'), json={
+        'filename': filename,
+        'size': len(content),
+        'sha256': hashlib.sha256(content).hexdigest()
+    })
+    assert response.status_code == 201
+    upload_id = response.get_json()['upload_id']
+
+    for offset in range(0, len(content), chunk_size):
+        chunk = content[offset:offset + chunk_size]
+        response = client.patch(f'/uploads/sessions/{upload_id}', data=chunk, headers={
+            **auth('tok-influencer'),
+            'Upload-Offset': str(offset),
+            'Content-Type': 'application/offset+octet-stream'
+        })
+        assert response.status_code == 200
+        assert response.headers['Upload-Offset'] == str(offset + len(chunk))
+
+    response = client.post(f'/uploads/sessions/{upload_id}/complete', headers=auth('tok-influencer'))
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def test_finalized_upload_sent_in_a_message_survives_gc(app_module, client, conversation_url):
+    attachment = upload_in_chunks(client, 'report.txt', CONTENT, chunk_size=16 * 1024)
+    assert attachment['sha256'] == hashlib.sha256(CONTENT).hexdigest()
+    assert attachment['file_size'] == len(CONTENT)
+
+    response = client.post(conversation_url, headers=auth('tok-influencer'), json={
+        'content': 'Report attached',
+        'attachments': [{'sha256': attachment['sha256'], 'filename': 'report.txt'}]
+    })
+    assert response.status_code == 201
+    message = response.get_json()['data']
+    assert message['has_attachment'] is True
+    assert message['attachments'][0]['sha256'] == attachment['sha256']
+    assert message['attachments'][0]['file_path'] == f"/files/{attachment['sha256']}/report.txt"
+
+    # An upload nothing references, to show the collection actually runs
+    orphan = upload_in_chunks(client, 'draft.txt', b'unsent draft', chunk_size=1024)
+
+    store = app_module.blob_store
+    grace = store.gc_grace
+    store.gc_grace = -1
+    try:
+        store.collect_garbage()
+    finally:
+        store.gc_grace = grace
+
+    blob = store.get(attachment['sha256'])
+    assert blob is not None and blob['ref_count'] == 1
+    assert store.get(orphan['sha256']) is None
+
+    response = client.get(message['attachments'][0]['file_path'], headers=auth('tok-influencer'))
+    assert response.status_code == 200
+    assert response.data == CONTENT
+
+
+def test_message_with_unknown_attachment_is_rejected(client, conversation_url):
+    response = client.post(conversation_url, headers=auth('tok-influencer'), json={
+        'content': 'Missing file',
+        'attachments': [{'sha256': hashlib.sha256(b'never uploaded').hexdigest(), 'filename': 'missing.txt'}]
+    })
+    assert response.status_code == 400
+
+    response = client.post(conversation_url, headers=auth('tok-influencer'), json={
+        'content': 'Bad reference',
+        'attachments': [{'sha256': 'not-a-hash', 'filename': 'report.txt'}]
+    })
+    assert response.status_code == 400
+
+
+def test_multipart_message_can_reference_stored_content(client, conversation_url):
+    attachment = upload_in_chunks(client, 'notes.txt', b'meeting notes', chunk_size=1024)
+    response = client.post(conversation_url, headers=auth('tok-influencer'), data={
+        'text': 'Notes and a photo list',
+        'attachments': f'[{{"sha256": "{attachment["sha256"]}", "filename": "notes.txt"}}]',
+        'files': [(io.BytesIO(b'a,b\n1,2\n'), 'list.csv')]
+    }, content_type='multipart/form-data')
+    assert response.status_code == 201
+    names = [a['filename'] for a in response.get_json()['data']['attachments']]
+    assert names == ['notes.txt', 'list.csv']
@@ -0,0 +1,201 @@
+"""
+Thread Sync Scheduler Module
+Decides when a user's campaign threads are re-synced from the Hyptrb API
+"""
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from db import get_db
+from hyptrb_api import HyptrbAPIError, HyptrbPartialResult
+from hyptrb_cache import cache as hyptrb_cache
+from logger_config import logger
+
+# Re-sync a user's campaigns at most once per TTL (seconds)
+THREAD_SYNC_TTL = int(os.getenv('THREAD_SYNC_TTL', 300))
+# background: return cached threads and refresh stale ones after the response
+# inline: refresh stale threads before responding (previous behaviour, once per TTL)
+THREAD_SYNC_MODE = os.getenv('THREAD_SYNC_MODE', 'background').lower()
+# After a failed sync, wait this long before trying again (seconds)
+THREAD_SYNC_RETRY_INTERVAL = int(os.getenv('THREAD_SYNC_RETRY_INTERVAL', 60))
+THREAD_SYNC_WORKERS = int(os.getenv('THREAD_SYNC_WORKERS', 2))
+
+# Sync outcomes
+SYNC_FRESH = 'fresh'            # synced within the TTL, nothing done
+SYNC_SCHEDULED = 'scheduled'    # stale, refresh queued in the background
+SYNC_UNCHANGED = 'unchanged'    # fetched, campaigns identical to last sync; no writes
+SYNC_APPLIED = 'synced'         # fetched and written to the database
+SYNC_PARTIAL = 'partial'        # some pages missing; what arrived was applied, retried soon
+SYNC_FAILED = 'failed'          # Hyptrb API error; cached threads served
+SYNC_BACKOFF = 'backoff'        # last attempt failed recently; not retried yet
+SYNC_SKIPPED = 'skipped'        # role without campaign threads
+
+
+def campaigns_hash(campaigns: Dict) -> str:
+    """Stable content hash of a {campaign_id: {...}} mapping"""
+    return hashlib.sha256(json.dumps(campaigns, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _age_seconds(timestamp: str) -> float:
+    if not timestamp:
+        return float('inf')
+    return (datetime.now() - datetime.fromisoformat(timestamp.rstrip('Z'))).total_seconds()
+
+
+class ThreadSyncScheduler:
+    """
+    Per-user sync scheduler for campaign threads.
+
+    Sync is split into a fetch step (Hyptrb HTTP calls, returns the campaign
+    mapping) and an apply step (database writes). The last sync time and a
+    hash of the fetched campaigns are stored per user in `user_sync_state`:
+    - within the TTL nothing is fetched,
+    - if the fetched campaigns hash to the stored value nothing is written,
+    - in background mode a stale user gets cached threads immediately and the
+      refresh runs on a worker thread (at most one in flight per user).
+    """
+
+    def __init__(self, db=None, fetch: Optional[Callable[[str, str, str], Dict]] = None,
+                 apply: Optional[Callable[[str, str, str, Dict], int]] = None,
+                 ttl: int = THREAD_SYNC_TTL, mode: str = THREAD_SYNC_MODE,
+                 retry_interval: int = THREAD_SYNC_RETRY_INTERVAL,
+                 workers: int = THREAD_SYNC_WORKERS):
+        self._db = db
+        self.fetch = fetch
+        self.apply = apply
+        self.ttl = ttl
+        self.mode = mode if mode in ('background', 'inline') else 'background'
+        self.retry_interval = retry_interval
+
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='thread-sync')
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._outcomes = {}
+
+    @property
+    def db(self):
+        return self._db or get_db()
+
+    def sync(self, firebase_uid: str, email: str, role: str, force: bool = False) -> Dict:
+        """
+        Sync a user's campaign threads if due
+
+        Args:
+            firebase_uid: User's Firebase UID
+            email: User's email
+            role: User's role (only client and influencer have campaign threads)
+            force: Fetch and apply now regardless of TTL and content hash
+
+        Returns:
+            Dict with the outcome `status` and the user's sync state
+        """
+        if role not in ('client', 'influencer') or not email:
+            return self._result(SYNC_SKIPPED, None)
+
+        state = self.db.get_user_sync_state(firebase_uid)
+
+        if not force and state:
+            if _age_seconds(state.get('last_synced_at')) < self.ttl:
+                return self._result(SYNC_FRESH, state)
+            if state.get('last_error') and _age_seconds(state.get('last_attempt_at')) < self.retry_interval:
+                return self._result(SYNC_BACKOFF, state)
+
+            # A user that was synced before already has threads to show
+            if self.mode == 'background' and state.get('last_synced_at'):
+                self._schedule(firebase_uid, email, role)
+                return self._result(SYNC_SCHEDULED, state)
+
+        status = self._run(firebase_uid, email, role, force)
+        return self._result(status, self.db.get_user_sync_state(firebase_uid))
+
+    def _schedule(self, firebase_uid: str, email: str, role: str):
+        with self._lock:
+            if firebase_uid in self._in_flight:
+                return
+            self._in_flight.add(firebase_uid)
+
+        def run():
+            try:
+                self._run(firebase_uid, email, role, force=False)
+            finally:
+                with self._lock:
+                    self._in_flight.discard(firebase_uid)
+
+        self._executor.submit(run)
+
+    def _run(self, firebase_uid: str, email: str, role: str, force: bool) -> str:
+        """Fetch, compare and apply one user's campaigns"""
+        try:
+            if force:
+                # A forced refresh must reach Hyptrb, not the API response cache
+                with hyptrb_cache.bypass():
+                    campaigns = self.fetch(firebase_uid, email, role)
+            else:
+                campaigns = self.fetch(firebase_uid, email, role)
+        except HyptrbPartialResult as e:
+            # Create the threads we know about now; recording the error (not
+            # a content hash) makes the next request retry after the retry interval
+            logger.warning(f"Partial campaign sync for {email}: {e}")
+            try:
+                self.apply(firebase_uid, email, role, e.result)
+            except Exception as apply_error:
+                logger.error(f"Error applying partial thread sync for {email}: {apply_error}")
+            self.db.record_user_sync(firebase_uid, error=str(e))
+            return self._count(SYNC_PARTIAL)
+        except HyptrbAPIError as e:
+            logger.warning(f"Failed to fetch campaigns for {email}: {e}")
+            self.db.record_user_sync(firebase_uid, error=str(e))
+            return self._count(SYNC_FAILED)
+        except Exception as e:
+            logger.error(f"Error syncing threads for {email}: {e}")
+            self.db.record_user_sync(firebase_uid, error=str(e))
+            return self._count(SYNC_FAILED)
+
+        content_hash = campaigns_hash(campaigns)
+        state = self.db.get_user_sync_state(firebase_uid)
+        if not force and state and state.get('content_hash') == content_hash:
+            self.db.record_user_sync(firebase_uid, content_hash=content_hash, campaign_count=len(campaigns))
+            return self._count(SYNC_UNCHANGED)
+
+        try:
+            threads_synced = self.apply(firebase_uid, email, role, campaigns)
+        except Exception as e:
+            logger.error(f"Error applying thread sync for {email}: {e}")
+            self.db.record_user_sync(firebase_uid, error=str(e))
+            return self._count(SYNC_FAILED)
+
+        logger.debug(f"Synced {threads_synced} threads for {email}")
+        self.db.record_user_sync(firebase_uid, content_hash=content_hash, campaign_count=len(campaigns))
+        return self._count(SYNC_APPLIED)
+
+    def _count(self, status: str) -> str:
+        with self._lock:
+            self._outcomes[status] = self._outcomes.get(status, 0) + 1
+        return status
+
+    def _result(self, status: str, state: Dict) -> Dict:
+        if status in (SYNC_FRESH, SYNC_BACKOFF, SYNC_SCHEDULED, SYNC_SKIPPED):
+            self._count(status)
+        return {
+            'status': status,
+            'last_synced_at': state.get('last_synced_at') if state else None,
+            'campaign_count': state.get('campaign_count') if state else None
+        }
+
+    def stats(self) -> Dict:
+        """Scheduler metrics snapshot"""
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'ttl_seconds': self.ttl,
+                'in_flight': len(self._in_flight),
+                'outcomes': dict(self._outcomes)
+            }
+
+
+# Global thread sync scheduler (app.py sets fetch and apply)
+thread_sync_scheduler = ThreadSyncScheduler()
@@ -0,0 +1,257 @@
+"""
+Thumbnails Module
+Resized previews (WebP/JPEG) of image attachments and poster frames of video
+attachments, rendered once and cached next to the blob they were made from
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from blob_store import blob_store
+from logger_config import logger
+
+# Thumbnail sizes (longest edge in pixels); only these are rendered on request
+THUMBNAIL_SIZES = tuple(sorted({int(size) for size in os.getenv('THUMBNAIL_SIZES', '160,480,1080').split(',')
+                                if size.strip()}))
+# Format of the thumbnails referenced in attachment metadata (webp or jpg)
+THUMBNAIL_FORMAT = os.getenv('THUMBNAIL_FORMAT', 'webp').lower().replace('jpeg', 'jpg')
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', 80))
+# Poster frames are taken this far into a video (or from the first frame of shorter ones)
+POSTER_AT_SECONDS = float(os.getenv('POSTER_AT_SECONDS', 1))
+
+# Variant file extension -> (Pillow format, MIME type)
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpg': ('JPEG', 'image/jpeg')
+}
+POSTER = 'poster.jpg'
+
+
+def parse_variant(name: str) -> Optional[Tuple[Optional[int], str]]:
+    """
+    Validate a variant name
+
+    Returns:
+        (size, extension) for '<size>.<ext>', (None, 'jpg') for the poster, or None
+        if the name is not a configured variant
+    """
+    if name == POSTER:
+        return None, 'jpg'
+    size, _, ext = name.partition('.')
+    if ext not in FORMATS or not size.isdigit() or int(size) not in THUMBNAIL_SIZES:
+        return None
+    return int(size), ext
+
+
+def variant_url(sha256: str, name: str) -> str:
+    return f"/files/{sha256}/variants/{name}"
+
+
+def _write_atomic(dest: str, write):
+    # Readers only ever see a missing or a complete variant
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp_path = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, dest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def render_thumbnail(source: str, dest: str, size: int, ext: str):
+    """
+    Write a thumbnail of an image no larger than size x size (never upscaled)
+
+    Raises:
+        ImportError without Pillow, PIL.UnidentifiedImageError if source is not an image
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as img:
+        # JPEG sources are decoded at a reduced scale close to the target size
+        img.draft('RGB', (size, size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size), Image.LANCZOS)
+
+        pil_format = FORMATS[ext][0]
+        if img.mode in ('RGBA', 'LA', 'P') and pil_format == 'JPEG':
+            # No alpha in JPEG: flatten onto white
+            rgba = img.convert('RGBA')
+            img = Image.new('RGB', rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel('A'))
+        elif img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if img.mode in ('LA', 'P', 'PA') else 'RGB')
+
+        _write_atomic(dest, lambda path: img.save(path, pil_format, quality=THUMBNAIL_QUALITY))
+
+
+def _is_image(path: str) -> bool:
+    try:
+        from PIL import Image
+        with Image.open(path):
+            return True
+    except Exception:
+        return False
+
+
+def render_poster(source: str, dest: str):
+    """
+    Write a full-size JPEG frame from POSTER_AT_SECONDS into a video
+
+    Raises:
+        ImportError without OpenCV, ValueError if source is an image or no frame
+        can be decoded
+    """
+    import cv2
+
+    # OpenCV also opens still images as one-frame videos
+    if _is_image(source):
+        raise ValueError('not a video')
+
+    video = cv2.VideoCapture(source)
+    try:
+        if not video.isOpened():
+            raise ValueError('unreadable video')
+        video.set(cv2.CAP_PROP_POS_MSEC, POSTER_AT_SECONDS * 1000)
+        ok, frame = video.read()
+        if not ok:
+            video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = video.read()
+        if not ok:
+            raise ValueError('no decodable frame')
+    finally:
+        video.release()
+
+    ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+    if not ok:
+        raise ValueError('poster encoding failed')
+    _write_atomic(dest, lambda path: encoded.tofile(path))
+
+
+class VariantCache:
+    """
+    Thumbnails and poster frames stored beside their blob (<blob>.variants/<name>).
+
+    get() returns the cached file, or renders it on first request: a per-variant
+    lock makes concurrent requests for the same missing variant wait for one
+    render instead of each decoding the original. Thumbnails of videos are made
+    from the poster frame. Variants are derived from immutable content, so they
+    never need invalidating and are removed with their blob by blob_store GC.
+
+    The media pipeline calls generate() for new attachments, so the variants the
+    attachment metadata points at are usually rendered before anyone asks.
+    """
+
+    def __init__(self, store=blob_store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._render_locks = {}
+
+        # Metrics
+        self._hits = 0
+        self._renders = 0
+        self._render_errors = 0
+        self._render_ms = 0.0
+
+    def path(self, sha256: str, name: str) -> str:
+        return self.store.variant_path(sha256, name)
+
+    def get(self, sha256: str, name: str) -> Optional[str]:
+        """
+        Path of a variant of stored content, rendering it if needed
+
+        Returns:
+            The variant's path, or None if the name is not a configured variant,
+            the blob is unknown, or no preview can be made from it
+        """
+        variant = parse_variant(name)
+        if variant is None or not self.store.exists(sha256):
+            return None
+        dest = self.path(sha256, name)
+        if os.path.isfile(dest):
+            with self._lock:
+                self._hits += 1
+            return dest
+
+        key = (sha256, name)
+        with self._lock:
+            render_lock = self._render_locks.setdefault(key, threading.Lock())
+        try:
+            with render_lock:
+                if os.path.isfile(dest):
+                    with self._lock:
+                        self._hits += 1
+                    return dest
+                return self._render(sha256, variant, dest)
+        finally:
+            with self._lock:
+                if self._render_locks.get(key) is render_lock and not render_lock.locked():
+                    del self._render_locks[key]
+
+    def _render(self, sha256: str, variant: Tuple[Optional[int], str], dest: str) -> Optional[str]:
+        size, ext = variant
+        source = self.store.path(sha256)
+        started = time.monotonic()
+        try:
+            if size is None:
+                render_poster(source, dest)
+            else:
+                try:
+                    render_thumbnail(source, dest, size, ext)
+                except ImportError:
+                    raise
+                except Exception:
+                    # Not an image: thumbnail the video's poster frame instead
+                    poster = self.get(sha256, POSTER)
+                    if not poster:
+                        raise
+                    render_thumbnail(poster, dest, size, ext)
+        except Exception as e:
+            logger.debug(f"No {os.path.basename(dest)} preview for blob {sha256}: {e}")
+            with self._lock:
+                self._render_errors += 1
+            return None
+        with self._lock:
+            self._renders += 1
+            self._render_ms += (time.monotonic() - started) * 1000
+        return dest
+
+    def generate(self, sha256: str, file_type: str) -> Dict:
+        """
+        Render the variants attachments reference (the poster of a video and a
+        THUMBNAIL_FORMAT thumbnail per size)
+
+        Returns:
+            Attachment metadata for the variants that could be made:
+            {'thumbnails': {size: url}, 'poster': url}
+        """
+        metadata = {}
+        if file_type == 'video' and self.get(sha256, POSTER):
+            metadata['poster'] = variant_url(sha256, POSTER)
+        if file_type in ('image', 'video'):
+            thumbnails = {}
+            for size in THUMBNAIL_SIZES:
+                name = f"{size}.{THUMBNAIL_FORMAT}"
+                if self.get(sha256, name):
+                    thumbnails[str(size)] = variant_url(sha256, name)
+            if thumbnails:
+                metadata['thumbnails'] = thumbnails
+        return metadata
+
+    def stats(self) -> Dict:
+        """Cache metrics snapshot (this process only)"""
+        with self._lock:
+            return {
+                'sizes': list(THUMBNAIL_SIZES),
+                'format': THUMBNAIL_FORMAT,
+                'hits': self._hits,
+                'renders': self._renders,
+                'render_errors': self._render_errors,
+                'mean_render_ms': round(self._render_ms / self._renders, 3) if self._renders else 0.0
+            }
+
+
+# Global variant cache
+variant_cache = VariantCache()
@@ -0,0 +1,160 @@
+"""
+Firebase Token Cache Module
+Bounded cache of verified Firebase ID tokens so repeat requests skip signature verification
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict
+
+from logger_config import logger
+
+# Maximum number of verified tokens kept (0 disables the cache)
+FIREBASE_TOKEN_CACHE_SIZE = int(os.getenv('FIREBASE_TOKEN_CACHE_SIZE', 10000))
+# Upper bound on how long a verified token is trusted without re-verifying (seconds)
+FIREBASE_TOKEN_CACHE_MAX_TTL = int(os.getenv('FIREBASE_TOKEN_CACHE_MAX_TTL', 3600))
+# If > 0, a cached token is re-verified with a revocation check once per interval (seconds).
+# Each check is a call to the Firebase Auth backend.
+FIREBASE_TOKEN_REVOCATION_CHECK_INTERVAL = int(os.getenv('FIREBASE_TOKEN_REVOCATION_CHECK_INTERVAL', 0))
+
+
+def token_key(id_token: str) -> str:
+    """Cache key for a token (the raw token is never stored)"""
+    return hashlib.sha256(id_token.encode('utf-8')).hexdigest()
+
+
+class TokenCache:
+    """
+    LRU cache of decoded claims for tokens that passed verification.
+
+    An entry is trusted until the token's own `exp` claim (capped by max_ttl),
+    so a cached token is never accepted after Firebase would reject it as
+    expired. Only successful verifications are cached: a failure, including
+    one caused by a signing key that is not yet (or no longer) published
+    during key rotation, is verified again on the next request. Tokens signed
+    with a retired key stay valid until their `exp`, which Google keeps inside
+    the key's publication window, so caching until `exp` does not outlive it.
+    """
+
+    def __init__(self, max_entries: int = FIREBASE_TOKEN_CACHE_SIZE,
+                 max_ttl: int = FIREBASE_TOKEN_CACHE_MAX_TTL,
+                 revocation_check_interval: int = FIREBASE_TOKEN_REVOCATION_CHECK_INTERVAL):
+        self.max_entries = max(0, max_entries)
+        self.max_ttl = max_ttl
+        self.revocation_check_interval = revocation_check_interval
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (claims, expires_at, verified_at)
+
+        # Metrics
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._evictions = 0
+        self._revocation_checks = 0
+        self._verifications = 0
+        self._verify_total_ms = 0.0
+        self._verify_max_ms = 0.0
+
+    def get_or_verify(self, id_token: str, verify: Callable[[str, bool], Dict]) -> Dict:
+        """
+        Return the decoded claims for a token, verifying it only on a cache miss
+
+        Args:
+            id_token: Firebase ID token
+            verify: verify(id_token, check_revoked) -> decoded claims; raises if invalid
+
+        Returns:
+            Copy of the decoded token claims
+
+        Raises:
+            Whatever verify raises; the token is not cached in that case
+        """
+        if not self.max_entries:
+            return self._verify(id_token, verify, check_revoked=False)
+
+        key = token_key(id_token)
+        now = time.time()
+        check_revoked = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                claims, expires_at, verified_at = entry
+                if now >= expires_at:
+                    del self._entries[key]
+                    self._expired += 1
+                elif self.revocation_check_interval > 0 and now - verified_at >= self.revocation_check_interval:
+                    check_revoked = True
+                else:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return dict(claims)
+            self._misses += 1
+
+        try:
+            claims = self._verify(id_token, verify, check_revoked)
+        except Exception:
+            with self._lock:
+                self._entries.pop(key, None)
+            raise
+
+        expires_at = min(float(claims.get('exp') or 0), now + self.max_ttl)
+        if expires_at > now:
+            with self._lock:
+                self._entries[key] = (dict(claims), expires_at, now)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+        return dict(claims)
+
+    def _verify(self, id_token: str, verify: Callable[[str, bool], Dict], check_revoked: bool) -> Dict:
+        started = time.monotonic()
+        try:
+            return verify(id_token, check_revoked)
+        finally:
+            elapsed_ms = (time.monotonic() - started) * 1000
+            with self._lock:
+                self._verifications += 1
+                self._verify_total_ms += elapsed_ms
+                self._verify_max_ms = max(self._verify_max_ms, elapsed_ms)
+                if check_revoked:
+                    self._revocation_checks += 1
+
+    def invalidate_user(self, uid: str) -> int:
+        """Drop every cached token of a user (e.g. after revoking their sessions)"""
+        with self._lock:
+            keys = [key for key, (claims, _, _) in self._entries.items() if claims.get('uid') == uid]
+            for key in keys:
+                del self._entries[key]
+        if keys:
+            logger.info(f"Dropped {len(keys)} cached tokens for user {uid}")
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Cache metrics snapshot"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'enabled': bool(self.max_entries),
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'expired': self._expired,
+                'evictions': self._evictions,
+                'revocation_checks': self._revocation_checks,
+                'verifications': self._verifications,
+                'verify_avg_ms': round(self._verify_total_ms / self._verifications, 3) if self._verifications else 0.0,
+                'verify_max_ms': round(self._verify_max_ms, 3)
+            }
+
+
+# Global cache instance
+token_cache = TokenCache()
@@ -0,0 +1,164 @@
+"""
+Upload Ingest Module
+Single-pass multipart upload ingest: each file part is written straight into the
+blob store while its hash, size and content type are computed
+"""
+import hashlib
+import os
+import tempfile
+from typing import Callable, Optional
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from blob_store import blob_store, BLOB_CHUNK_SIZE
+
+# Bytes needed to recognise every signature in sniff_mime
+SNIFF_BYTES = 16
+
+
+def sniff_mime(head: bytes) -> Optional[str]:
+    """Content type from a file's leading bytes (magic numbers), or None if not recognised"""
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head.startswith(b'RIFF'):
+        return {b'WEBP': 'image/webp', b'AVI ': 'video/x-msvideo', b'WAVE': 'audio/wav'}.get(head[8:12])
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'image/tiff'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in (b'heic', b'heix', b'mif1', b'msf1'):
+            return 'image/heic'
+        if brand == b'M4A ':
+            return 'audio/mp4'
+        return 'video/quicktime' if brand == b'qt  ' else 'video/mp4'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video/webm'
+    if head.startswith(b'%PDF-'):
+        return 'application/pdf'
+    if head.startswith(b'PK\x03\x04'):
+        return 'application/zip'
+    if head.startswith(b'Rar!\x1a\x07'):
+        return 'application/vnd.rar'
+    if head.startswith(b"7z\xbc\xaf'\x1c"):
+        return 'application/x-7z-compressed'
+    if head.startswith(b'\x1f\x8b'):
+        return 'application/gzip'
+    if head.startswith(b'OggS'):
+        return 'audio/ogg'
+    if head.startswith(b'ID3') or head[:2] in (b'\xff\xfb', b'\xff\xf3', b'\xff\xf2'):
+        return 'audio/mpeg'
+    return None
+
+
+class IngestStream:
+    """
+    Writable container werkzeug's form parser streams one file part into.
+
+    Bytes go to a temporary file in the blob store (buffered into
+    BLOB_CHUNK_SIZE writes) and are hashed, counted and sniffed as they pass,
+    so once the part is parsed nothing has to read the file again:
+    BlobStore.adopt() renames it into place. A part larger than max_size is
+    aborted with 413 as soon as the limit is crossed, and a discarded part
+    (e.g. a disallowed file type) is counted but never written.
+
+    The temporary file is removed on close() (werkzeug closes uploaded files
+    when the request ends) unless detach() handed it over.
+    """
+
+    def __init__(self, store=blob_store, max_size: int = None, discard: bool = False):
+        self.max_size = max_size
+        self.size = 0
+        self.mime_type = None
+        self._digest = hashlib.sha256()
+        self._head = b''
+        self._done = False
+        self.path = None
+        self._file = None
+        if not discard:
+            fd, self.path = tempfile.mkstemp(dir=store._tmp_dir)
+            self._file = os.fdopen(fd, 'w+b', buffering=BLOB_CHUNK_SIZE)
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.close()
+            raise RequestEntityTooLarge(f"File exceeds the maximum size of {self.max_size} bytes")
+        if len(self._head) < SNIFF_BYTES:
+            self._head += data[:SNIFF_BYTES - len(self._head)]
+        self._digest.update(data)
+        if self._file:
+            self._file.write(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        # Called by the parser once the part is complete: make it durable
+        if not self._done:
+            self._done = True
+            self.mime_type = sniff_mime(self._head)
+            if self._file:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+        return self._file.seek(offset, whence) if self._file else 0
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size) if self._file else b''
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._file.readline(size) if self._file else b''
+
+    def tell(self) -> int:
+        return self._file.tell() if self._file else 0
+
+    def detach(self) -> str:
+        """Close the stream and give up ownership of the file (for BlobStore.adopt); returns its path"""
+        path, self.path = self.path, None
+        if self._file:
+            self._file.close()
+            self._file = None
+        return path
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    @property
+    def complete(self) -> bool:
+        """Whether the part was fully received and the file is still owned by this stream"""
+        return self._done and self.path is not None
+
+    def __del__(self):
+        # Parsing aborted (client disconnect, limits): nothing else will clean up
+        self.close()
+
+
+def ingest_request_class(accept_filename: Callable[[str], bool] = None, max_file_size: int = None,
+                         store=blob_store):
+    """
+    Flask request class whose multipart file parts are ingested with IngestStream
+
+    Args:
+        accept_filename: Parts whose file name it rejects are discarded unread
+        max_file_size: Per-file size limit (413 once exceeded)
+    """
+    class IngestRequest(Request):
+        def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+            discard = accept_filename is not None and not accept_filename(filename or '')
+            return IngestStream(store, max_file_size, discard)
+
+    return IngestRequest
@@ -0,0 +1,310 @@
+"""
+Upload Sessions Module
+Resumable chunked uploads: a large file is sent as a series of chunks at known
+offsets, so a dropped connection only costs the chunk in flight
+"""
+import hashlib
+import os
+import secrets
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from blob_store import blob_store, BLOB_CHUNK_SIZE
+from db import get_db
+from logger_config import logger
+
+# Largest chunk accepted per request (bytes)
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+# Sessions expire this long after their last chunk (seconds); staged bytes are then removed
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 86400))
+# Expired sessions are swept at most this often, when a session is created (seconds)
+UPLOAD_SWEEP_INTERVAL = 300
+
+
+class UploadSessionError(Exception):
+    """A request an upload session cannot accept; status is the HTTP status to answer with"""
+
+    def __init__(self, message: str, status: int = 400, session: Dict = None):
+        super().__init__(message)
+        self.status = status
+        self.session = session
+
+
+class UploadSessions:
+    """
+    Resumable uploads staged on disk next to the blob store.
+
+    create() reserves a session and an empty staging file. append() writes one
+    chunk at the offset the client claims, which must equal the bytes received
+    so far: a retried chunk after a lost response gets a 409 with the current
+    offset, and the client continues from there. Each chunk is streamed from the
+    request body straight into the staging file (no multipart parsing or
+    spooling), checked against its optional SHA-256, fsynced, and only then
+    counted; a short or corrupt chunk is truncated away. finalize() hashes the
+    whole file (usually from the running hash kept while chunks arrived, so the
+    file is not read again) and hands it to blob_store.adopt(), which renames it
+    into place: no second copy is written.
+
+    Session state lives in the upload_sessions table, so a session survives a
+    restart (its running hash does not; finalize then re-reads the staged file).
+    Sessions idle for longer than ttl are swept with their staged bytes.
+    """
+
+    def __init__(self, db=None, store=blob_store, ttl: int = UPLOAD_SESSION_TTL,
+                 max_chunk_size: int = UPLOAD_CHUNK_SIZE):
+        self._db = db
+        self.store = store
+        self.ttl = ttl
+        self.max_chunk_size = max_chunk_size
+        self._lock = threading.Lock()
+        self._session_locks = {}
+        self._hashers = {}      # session id -> (bytes hashed, running sha256 of the staged file)
+        self._last_sweep = 0.0
+
+        # Metrics
+        self._chunks = 0
+        self._chunk_bytes = 0
+        self._rejected_chunks = 0
+        self._finalized = 0
+        self._rehashed = 0
+        self._expired = 0
+
+    @property
+    def db(self):
+        return self._db or get_db()
+
+    def staging_path(self, session_id: str) -> str:
+        return os.path.join(self.store.staging_dir, session_id)
+
+    def create(self, user_id: str, filename: str, size: int, expected_sha256: str = None) -> Dict:
+        """
+        Start a resumable upload
+
+        Args:
+            user_id: Uploader; only they can append to or finalize the session
+            filename: Name the upload will be attached under
+            size: Total size in bytes
+            expected_sha256: Optional hash of the whole file, checked on finalize
+
+        Returns:
+            Session row
+        """
+        self._maybe_sweep()
+        session_id = secrets.token_hex(16)
+        open(self.staging_path(session_id), 'wb').close()
+        return self.db.create_upload_session(session_id, user_id, filename, size, expected_sha256,
+                                             time.time() + self.ttl)
+
+    def get(self, session_id: str, user_id: str) -> Dict:
+        """Session row of one of the user's live sessions (UploadSessionError 404 otherwise)"""
+        session = self.db.get_upload_session(session_id)
+        if not session or session['user_id'] != user_id or session['expires_at'] < time.time():
+            raise UploadSessionError('Upload session not found', 404)
+        return session
+
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        with self._lock:
+            return self._session_locks.setdefault(session_id, threading.Lock())
+
+    def append(self, session_id: str, user_id: str, offset: int, stream, length: int,
+               checksum: Optional[str] = None) -> Dict:
+        """
+        Write one chunk at offset
+
+        Args:
+            stream: Readable binary stream of exactly length bytes (the request body)
+            checksum: Optional hex SHA-256 of the chunk
+
+        Returns:
+            The updated session row
+
+        Raises:
+            UploadSessionError: 409 if offset is not the current offset (the error
+                carries the session so the client can resume), 413 for an oversized
+                chunk, 400 for a short or corrupt chunk (nothing is kept)
+        """
+        with self._session_lock(session_id):
+            session = self.get(session_id, user_id)
+            if session['status'] != 'active':
+                raise UploadSessionError('Upload already finalized', 409, session)
+            if offset != session['received']:
+                raise UploadSessionError(f"Expected offset {session['received']}", 409, session)
+            if length > self.max_chunk_size:
+                raise UploadSessionError(f"Chunks are limited to {self.max_chunk_size} bytes", 413, session)
+            if offset + length > session['size']:
+                raise UploadSessionError('Chunk extends past the declared upload size', 413, session)
+
+            with self._lock:
+                hashed, running = self._hashers.get(session_id, (0, None))
+            if running is None and offset == 0:
+                running = hashlib.sha256()
+            # Only extend the running hash if it covers everything before this chunk
+            running = running.copy() if running is not None and hashed == offset else None
+
+            chunk_digest = hashlib.sha256()
+            written = 0
+            with open(self.staging_path(session_id), 'r+b') as staged:
+                # Anything past offset is left over from an interrupted chunk
+                staged.truncate(offset)
+                staged.seek(offset)
+                while written < length:
+                    data = stream.read(min(BLOB_CHUNK_SIZE, length - written))
+                    if not data:
+                        break
+                    chunk_digest.update(data)
+                    if running is not None:
+                        running.update(data)
+                    staged.write(data)
+                    written += len(data)
+
+                error = None
+                if written < length:
+                    error = f"Incomplete chunk: received {written} of {length} bytes"
+                elif checksum and chunk_digest.hexdigest() != checksum.lower():
+                    error = 'Chunk checksum mismatch'
+                if error:
+                    staged.truncate(offset)
+                    with self._lock:
+                        self._rejected_chunks += 1
+                    raise UploadSessionError(error, 400, session)
+                staged.flush()
+                os.fsync(staged.fileno())
+
+            if not self.db.advance_upload_session(session_id, offset, offset + length, time.time() + self.ttl):
+                raise UploadSessionError('Upload session changed concurrently', 409, self.db.get_upload_session(session_id))
+            with self._lock:
+                if running is not None:
+                    self._hashers[session_id] = (offset + length, running)
+                else:
+                    self._hashers.pop(session_id, None)
+                self._chunks += 1
+                self._chunk_bytes += length
+            return self.db.get_upload_session(session_id)
+
+    def finalize(self, session_id: str, user_id: str) -> Dict:
+        """
+        Move a fully received upload into the blob store
+
+        Idempotent: finalizing a finalized session returns the same blob.
+
+        Returns:
+            Blob row plus `duplicate` (see BlobStore.adopt)
+
+        Raises:
+            UploadSessionError: 409 if bytes are missing, 400 if the content does not
+                match expected_sha256 (the session is discarded)
+        """
+        with self._session_lock(session_id):
+            session = self.get(session_id, user_id)
+            if session['status'] == 'completed':
+                blob = self.store.get(session['sha256'])
+                if not blob:
+                    raise UploadSessionError('Uploaded content is no longer stored', 410, session)
+                blob['duplicate'] = True
+                return blob
+            if session['received'] != session['size']:
+                raise UploadSessionError(f"Upload incomplete: {session['received']} of {session['size']} bytes",
+                                         409, session)
+
+            path = self.staging_path(session_id)
+            with self._lock:
+                hashed, running = self._hashers.pop(session_id, (0, None))
+            if running is not None and hashed == session['size']:
+                sha256 = running.hexdigest()
+            else:
+                # Chunks arrived before a restart (or in another process): read it once
+                digest = hashlib.sha256()
+                with open(path, 'rb') as staged:
+                    for data in iter(lambda: staged.read(BLOB_CHUNK_SIZE), b''):
+                        digest.update(data)
+                sha256 = digest.hexdigest()
+                with self._lock:
+                    self._rehashed += 1
+
+            if session['expected_sha256'] and sha256 != session['expected_sha256'].lower():
+                self._discard(session_id)
+                raise UploadSessionError('Upload does not match the declared sha256', 400)
+
+            blob = self.store.adopt(path, sha256, session['size'])
+            self.db.complete_upload_session(session_id, sha256, time.time() + self.ttl)
+            with self._lock:
+                self._finalized += 1
+            return blob
+
+    def cancel(self, session_id: str, user_id: str):
+        """Abandon an upload and remove its staged bytes"""
+        with self._session_lock(session_id):
+            self.get(session_id, user_id)
+            self._discard(session_id)
+
+    def _discard(self, session_id: str):
+        self.db.delete_upload_session(session_id)
+        self._remove_staged(session_id)
+
+    def _remove_staged(self, session_id: str):
+        try:
+            os.unlink(self.staging_path(session_id))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._hashers.pop(session_id, None)
+            self._session_locks.pop(session_id, None)
+
+    def _maybe_sweep(self):
+        with self._lock:
+            if time.time() - self._last_sweep < UPLOAD_SWEEP_INTERVAL:
+                return
+            self._last_sweep = time.time()
+        try:
+            self.collect_expired()
+        except Exception as e:
+            logger.error(f"Failed to sweep expired upload sessions: {e}")
+
+    def collect_expired(self) -> int:
+        """Delete expired sessions and their staged files; returns the number removed"""
+        removed = 0
+        while True:
+            deleted = self.db.delete_expired_upload_sessions(time.time())
+            for session in deleted:
+                self._remove_staged(session['id'])
+            removed += len(deleted)
+            if len(deleted) < 1000:
+                break
+        if removed:
+            logger.info(f"Removed {removed} expired upload sessions")
+            with self._lock:
+                self._expired += removed
+        return removed
+
+    def stats(self) -> Dict:
+        """Upload session metrics snapshot"""
+        with self._lock:
+            stats = {
+                'max_chunk_size': self.max_chunk_size,
+                'ttl_seconds': self.ttl,
+                'chunks': self._chunks,
+                'chunk_bytes': self._chunk_bytes,
+                'rejected_chunks': self._rejected_chunks,
+                'finalized': self._finalized,
+                'rehashed_on_finalize': self._rehashed,
+                'expired': self._expired
+            }
+        stats['sessions'] = self.db.get_upload_session_counts()
+        return stats
+
+
+# Global upload sessions
+upload_sessions = UploadSessions()
+
+
+if __name__ == '__main__':
+    # python3 upload_sessions.py expire   - remove expired sessions and their staged bytes
+    # python3 upload_sessions.py stats
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    if command == 'expire':
+        print(f"Removed {upload_sessions.collect_expired()} sessions")
+    else:
+        for key, value in upload_sessions.stats().items():
+            print(f"{key}: {value}")
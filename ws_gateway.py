@@ -0,0 +1,445 @@
+"""
+WebSocket Gateway Module
+Bidirectional real-time channel: one socket per client, many conversations per socket.
+
+Runs an asyncio WebSocket server in a background thread of the API process so it
+shares the event hub (realtime.py) and the database layer with the REST endpoints.
+
+Protocol (JSON text frames):
+    Client -> server: {"op": "<op>", "ref": <optional, echoed in the reply>, ...}
+        auth         {"token": "<Firebase ID token>"}  (must be the first frame)
+        subscribe    {"conversation_ids": [...]}
+        unsubscribe  {"conversation_ids": [...]}
+        send         {"conversation_id": "...", "content": "...", "type": "text"}
+        typing       {"conversation_id": "...", "is_typing": true}
+        mark_read    {"conversation_id": "..."}
+        ping         {}
+    Server -> client:
+        {"type": "ack", "op": "<op>", "ref": ..., "data": {...}}
+        {"type": "error", "op": "<op>", "ref": ..., "error": "..."}
+        Hub events for subscribed conversations:
+        {"type": "message.created" | "message.deleted" | "conversation.read" | "typing", "data": {...}}
+"""
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+import firebase_auth
+import realtime
+from db import get_db
+from presence import presence
+from logger_config import logger
+
+# websockets is optional; without it the gateway is simply not started
+try:
+    import websockets
+    from websockets.exceptions import ConnectionClosed
+    WEBSOCKETS_AVAILABLE = True
+except ImportError:
+    WEBSOCKETS_AVAILABLE = False
+
+WS_ENABLED = os.getenv('WS_ENABLED', 'false').lower() in ('true', '1', 'yes')
+WS_HOST = os.getenv('WS_HOST', '0.0.0.0')
+WS_PORT = int(os.getenv('WS_PORT', 5002))
+WS_AUTH_TIMEOUT = float(os.getenv('WS_AUTH_TIMEOUT', 10))
+WS_MAX_SUBSCRIPTIONS = int(os.getenv('WS_MAX_SUBSCRIPTIONS', 200))
+WS_MAX_FRAME_SIZE = int(os.getenv('WS_MAX_FRAME_SIZE', 65536))
+
+# Close codes (4000-4999 are reserved for applications)
+CLOSE_AUTH_FAILED = 4401
+CLOSE_UNKNOWN_USER = 4403
+CLOSE_SLOW_CONSUMER = 1013  # "try again later"
+
+
+class LatencyStats:
+    """Running count/avg/max of a latency in seconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            'max_ms': round(self.max * 1000, 3)
+        }
+
+
+class WebSocketSubscription(realtime.Subscription):
+    """
+    Hub subscription feeding one WebSocket connection.
+
+    The hub calls deliver() from whichever thread published the event; events
+    are only queued for conversations this connection subscribed to, and the
+    connection's asyncio sender task is woken with call_soon_threadsafe. The
+    queue stays bounded, so a socket that cannot keep up gets evicted by the hub
+    exactly like a slow SSE client.
+    """
+
+    def __init__(self, hub, user_id: str, loop: asyncio.AbstractEventLoop):
+        super().__init__(hub, user_id)
+        self.conversation_ids = frozenset()
+        self.high_water = 0
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+    def deliver(self, event: Dict) -> bool:
+        data = event.get('data') or {}
+        if data.get('conversation_id') not in self.conversation_ids:
+            return True
+        try:
+            # Queue entries carry the enqueue time for delivery latency metrics
+            self._queue.put_nowait((time.monotonic(), event))
+        except queue.Full:
+            return False
+        self.high_water = max(self.high_water, self._queue.qsize())
+        self._wake()
+        return True
+
+    def evict(self, event: Dict):
+        super().evict((time.monotonic(), event))
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # Event loop already closed (gateway shutting down)
+            pass
+
+    async def next_batch(self) -> list:
+        """Wait for events and return everything queued so far"""
+        await self._wakeup.wait()
+        self._wakeup.clear()
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+
+class GatewayConnection:
+    """One authenticated WebSocket client"""
+
+    def __init__(self, gateway, websocket):
+        self.gateway = gateway
+        self.websocket = websocket
+        self.db = gateway.db
+        self.connected_at = datetime.now().isoformat() + 'Z'
+        self.user_id = None
+        self.db_user = None
+        self.subscription = None
+        self.conversations = {}  # conversation_id -> conversation (access already checked)
+
+        # Metrics
+        self.frames_received = 0
+        self.events_sent = 0
+        self.delivery_latency = LatencyStats()  # hub enqueue -> written to socket
+        self.op_latency = LatencyStats()         # client frame received -> ack sent
+
+    async def run(self):
+        if not await self._authenticate():
+            return
+
+        loop = asyncio.get_running_loop()
+        self.subscription = realtime.hub.subscribe(
+            self.user_id, WebSocketSubscription(realtime.hub, self.user_id, loop)
+        )
+        sender = asyncio.create_task(self._send_events())
+        try:
+            await self._send({'type': 'ready', 'data': {'user_id': self.user_id}})
+            async for raw in self.websocket:
+                self.frames_received += 1
+                await self._handle_frame(raw)
+        finally:
+            sender.cancel()
+            self.subscription.close()
+
+    async def _authenticate(self) -> bool:
+        """Verify the Firebase token from the first frame (once per connection)"""
+        try:
+            frame = json.loads(await asyncio.wait_for(self.websocket.recv(), WS_AUTH_TIMEOUT))
+            if frame.get('op') != 'auth' or not frame.get('token'):
+                raise ValueError("first frame must be {\"op\": \"auth\", \"token\": ...}")
+            decoded_token = await asyncio.to_thread(firebase_auth.verify_firebase_token, frame['token'])
+        except asyncio.TimeoutError:
+            await self.websocket.close(CLOSE_AUTH_FAILED, 'Authentication timeout')
+            return False
+        except Exception as e:
+            logger.warning(f"WebSocket authentication failed: {str(e)}")
+            await self.websocket.close(CLOSE_AUTH_FAILED, 'Authentication failed')
+            return False
+
+        self.user_id = decoded_token['uid']
+        self.db_user = await asyncio.to_thread(self.db.get_user_by_firebase_uid, self.user_id)
+        if not self.db_user:
+            # Users are provisioned (role, profile, threads) by the REST API on first use
+            await self.websocket.close(CLOSE_UNKNOWN_USER, 'Unknown user; sign in through the API first')
+            return False
+        presence.touch(self.user_id)
+        return True
+
+    async def _send(self, payload: Dict):
+        await self.websocket.send(json.dumps(payload))
+
+    async def _send_events(self):
+        """Drain the hub subscription into the socket"""
+        while True:
+            for enqueued_at, event in await self.subscription.next_batch():
+                await self._send(event)
+                self.events_sent += 1
+                self.delivery_latency.record(time.monotonic() - enqueued_at)
+                if event['type'] == realtime.SUBSCRIPTION_EVICTED:
+                    await self.websocket.close(CLOSE_SLOW_CONSUMER, 'Slow consumer; resync and reconnect')
+                    return
+
+    async def _handle_frame(self, raw):
+        started = time.monotonic()
+        op, ref = None, None
+        try:
+            try:
+                frame = json.loads(raw)
+            except json.JSONDecodeError:
+                raise ValueError('Invalid JSON frame')
+            if not isinstance(frame, dict):
+                raise ValueError('Frame must be a JSON object')
+            op, ref = frame.get('op'), frame.get('ref')
+            presence.touch(self.user_id)
+            handler = self.OPS.get(op)
+            if handler is None:
+                raise ValueError(f"Unknown op: {op}")
+            data = await handler(self, frame)
+            await self._send({'type': 'ack', 'op': op, 'ref': ref, 'data': data})
+        except (ValueError, PermissionError) as e:
+            await self._send({'type': 'error', 'op': op, 'ref': ref, 'error': str(e)})
+        except ConnectionClosed:
+            raise
+        except Exception as e:
+            logger.error(f"WebSocket op {op} failed for {self.user_id}: {str(e)}")
+            await self._send({'type': 'error', 'op': op, 'ref': ref, 'error': 'Internal error'})
+        finally:
+            self.op_latency.record(time.monotonic() - started)
+
+    def _subscribed_conversation(self, frame: Dict) -> Dict:
+        conversation_id = frame.get('conversation_id')
+        conversation = self.conversations.get(conversation_id)
+        if not conversation:
+            raise PermissionError(f"Not subscribed to conversation {conversation_id}")
+        return conversation
+
+    def _check_access(self, conversation_ids: list) -> Dict:
+        """Load conversations and keep the ones the user may see (runs in a worker thread)"""
+        allowed = {}
+        is_admin = firebase_auth.is_admin_role(self.db_user.get('role'))
+        for conversation_id in conversation_ids:
+            conversation = self.db.get_conversation_by_id(conversation_id)
+            if conversation and (is_admin or self.user_id in realtime.conversation_participants(conversation)):
+                allowed[conversation_id] = conversation
+        return allowed
+
+    async def op_subscribe(self, frame: Dict) -> Dict:
+        requested = [cid for cid in frame.get('conversation_ids') or [] if cid not in self.conversations]
+        if len(self.conversations) + len(requested) > WS_MAX_SUBSCRIPTIONS:
+            raise ValueError(f"At most {WS_MAX_SUBSCRIPTIONS} conversations per connection")
+
+        allowed = await asyncio.to_thread(self._check_access, requested)
+        self.conversations.update(allowed)
+        self.subscription.conversation_ids = frozenset(self.conversations)
+        return {
+            'subscribed': sorted(allowed),
+            'denied': sorted(set(requested) - set(allowed)),
+            'conversation_ids': sorted(self.conversations)
+        }
+
+    async def op_unsubscribe(self, frame: Dict) -> Dict:
+        for conversation_id in frame.get('conversation_ids') or []:
+            self.conversations.pop(conversation_id, None)
+        self.subscription.conversation_ids = frozenset(self.conversations)
+        return {'conversation_ids': sorted(self.conversations)}
+
+    async def op_send(self, frame: Dict) -> Dict:
+        conversation = self._subscribed_conversation(frame)
+        content = frame.get('content', '')
+        if not content:
+            raise ValueError('No content provided')
+
+        message_data = {
+            'conversation_id': conversation['id'],
+            'thread_id': conversation['thread_id'],
+            'sender_id': self.user_id,
+            'sender_type': frame.get('sender_type', self.db_user.get('role') or 'client'),
+            'sender_name': self.db_user.get('display_name') or self.db_user.get('email', 'User'),
+            'type': frame.get('type', 'text'),
+            'content': content,
+            'text_content': content,
+            'timestamp': datetime.now().isoformat() + 'Z',
+            'status': 'delivered'
+        }
+
+        def create():
+            return self.db.get_message_by_id(self.db.create_message(message_data))
+
+        message = await asyncio.to_thread(create)
+        realtime.hub.publish(realtime.MESSAGE_CREATED, message,
+                             realtime.conversation_participants(conversation))
+        return message
+
+    async def op_typing(self, frame: Dict) -> Dict:
+        conversation = self._subscribed_conversation(frame)
+        event = {
+            'conversation_id': conversation['id'],
+            'user_id': self.user_id,
+            'is_typing': bool(frame.get('is_typing', True))
+        }
+        recipients = [uid for uid in realtime.conversation_participants(conversation) if uid != self.user_id]
+        realtime.hub.publish(realtime.TYPING, event, recipients)
+        return event
+
+    async def op_mark_read(self, frame: Dict) -> Dict:
+        conversation = self._subscribed_conversation(frame)
+        up_to_seq = frame.get('up_to_seq')
+        if up_to_seq is not None and (not isinstance(up_to_seq, int) or isinstance(up_to_seq, bool)):
+            raise ValueError('up_to_seq must be an integer')
+        result = await asyncio.to_thread(self.db.mark_messages_as_read, conversation['id'], self.user_id, up_to_seq)
+        if not result['success']:
+            raise ValueError(result['message'])
+        if result['marked_count']:
+            realtime.hub.publish(realtime.CONVERSATION_READ, {
+                'thread_id': conversation['thread_id'],
+                'conversation_id': conversation['id'],
+                'user_id': self.user_id,
+                'marked_count': result['marked_count'],
+                'last_read_seq': result['last_read_seq'],
+                'read_at': datetime.now().isoformat() + 'Z'
+            }, realtime.conversation_participants(conversation))
+        return {'marked_count': result['marked_count'], 'reason': result['reason'],
+                'last_read_seq': result['last_read_seq']}
+
+    async def op_ping(self, frame: Dict) -> Dict:
+        return {'pong': datetime.now().isoformat() + 'Z'}
+
+    OPS = {
+        'subscribe': op_subscribe,
+        'unsubscribe': op_unsubscribe,
+        'send': op_send,
+        'typing': op_typing,
+        'mark_read': op_mark_read,
+        'ping': op_ping
+    }
+
+    def stats(self) -> Dict:
+        subscription = self.subscription
+        return {
+            'user_id': self.user_id,
+            'connected_at': self.connected_at,
+            'conversations': len(self.conversations),
+            'frames_received': self.frames_received,
+            'events_sent': self.events_sent,
+            # Backpressure: events waiting for the socket now / at worst
+            'queue_depth': subscription.pending() if subscription else 0,
+            'queue_high_water': subscription.high_water if subscription else 0,
+            'evicted': bool(subscription and subscription.evicted),
+            'delivery_latency': self.delivery_latency.to_dict(),
+            'op_latency': self.op_latency.to_dict()
+        }
+
+
+class WebSocketGateway:
+    """asyncio WebSocket server running in a daemon thread of the API process"""
+
+    def __init__(self, host: str = WS_HOST, port: int = WS_PORT):
+        self.host = host
+        self.port = port
+        self.db = get_db()
+        self.connections = set()
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+
+        # Metrics
+        self._connections_total = 0
+        self._auth_failures = 0
+
+    async def _handle(self, websocket):
+        connection = GatewayConnection(self, websocket)
+        self.connections.add(connection)
+        self._connections_total += 1
+        try:
+            await connection.run()
+        except ConnectionClosed:
+            pass
+        finally:
+            self.connections.discard(connection)
+            if connection.user_id is None:
+                self._auth_failures += 1
+
+    async def serve_forever(self):
+        self.loop = asyncio.get_running_loop()
+        async with websockets.serve(self._handle, self.host, self.port, max_size=WS_MAX_FRAME_SIZE):
+            logger.info(f"WebSocket gateway listening on ws://{self.host}:{self.port}")
+            self._ready.set()
+            await asyncio.Future()
+
+    def start_in_thread(self, timeout: float = 5) -> bool:
+        """Start the server in a daemon thread; returns True once it is listening"""
+        def run():
+            try:
+                asyncio.run(self.serve_forever())
+            except Exception as e:
+                logger.error(f"WebSocket gateway stopped: {str(e)}")
+
+        self._thread = threading.Thread(target=run, name='ws-gateway', daemon=True)
+        self._thread.start()
+        return self._ready.wait(timeout)
+
+    def stats(self) -> Dict:
+        connections = [connection.stats() for connection in list(self.connections)
+                       if connection.user_id is not None]
+        return {
+            'enabled': True,
+            'address': f"ws://{self.host}:{self.port}",
+            'connections': len(connections),
+            'connections_total': self._connections_total,
+            'auth_failures': self._auth_failures,
+            'queued_events': sum(c['queue_depth'] for c in connections),
+            'per_connection': connections
+        }
+
+
+# Global gateway instance (set by start_gateway)
+gateway: Optional[WebSocketGateway] = None
+
+
+def start_gateway() -> Optional[WebSocketGateway]:
+    """Start the WebSocket gateway if WS_ENABLED and the websockets package is installed"""
+    global gateway
+    if gateway is not None or not WS_ENABLED:
+        return gateway
+    if not WEBSOCKETS_AVAILABLE:
+        logger.warning("WS_ENABLED is set but the 'websockets' package is not installed; gateway disabled")
+        return None
+
+    gateway = WebSocketGateway()
+    if not gateway.start_in_thread():
+        logger.error(f"WebSocket gateway failed to start on {WS_HOST}:{WS_PORT}")
+    return gateway
+
+
+def get_gateway_stats() -> Dict:
+    """Gateway metrics for the admin API"""
+    if gateway is None:
+        return {'enabled': False}
+    return gateway.stats()